@@ -0,0 +1,398 @@
+from datetime import datetime
+import queue
+import serial
+import threading
+import time
+from typing import NamedTuple
+
+from SoggyVision.acs import ACSFramer, FramerStats
+from SoggyVision.clock import ElapsedTimeClock
+from SoggyVision.metrics import Metrics
+from SoggyVision.pipeline import BoundedQueue
+from SoggyVision.qc import gap_test_batch, syntax_test
+from SoggyVision.storage import SQLITE, open_backend, session_metadata
+from SoggyVision.window import RollingWindow, WindowSnapshot
+
+
+class RawBatch(NamedTuple):
+    time: datetime
+    frames: list
+    checksums: list
+    framer_stats: FramerStats
+
+
+class StorageBatch(NamedTuple):
+    source: str
+    acs: object
+    dbname: str
+    session: int
+    data: list
+    flags: list
+    raw_only: bool = False
+
+
+class StorageWriter():
+    """
+    Write StorageBatches from any number of instruments.
+
+    Each logging session gets its own writer from the storage backend, opened on first use in the thread that runs
+    the writer (sqlite connections cannot be shared between threads). A source holds at most one open session, so the
+    number of open databases stays bounded however often logging is restarted or rotated.
+    With the sqlite backend, rows are group committed through an SVDBWriter per session, see SVDBWriter for the loss
+    window on power failure. With a partition policy, each session is a dataset of rolling partitions instead, see
+    PartitionedWriter. The netcdf backend appends to a NetCDF4 file per session instead, see NetCDFWriter.
+    """
+
+    STAGES = ['storage', 'commit']
+    COUNTERS = ['batches', 'rows', 'errors']
+
+    def __init__(self, flush_rows: int = 500, flush_interval: float = 1.0, wal: bool = True,
+                 synchronous: str = 'FULL', partition = None, codec: str = None, backend: str = SQLITE) -> None:
+        """
+        :param flush_rows: Commit once this many rows are buffered for a session.
+        :param flush_interval: Commit rows that have been buffered for this many seconds.
+        :param wal: Open databases in write-ahead logging mode. sqlite only.
+        :param synchronous: The sqlite synchronous mode. See SVDB.
+        :param partition: None for one database per session, or 'hourly', 'daily' or a size such as '500MB' to
+            split sessions into partitions. See parse_partition. sqlite only.
+        :param codec: Compress the rows of each commit into one block per table, e.g. 'delta+zlib'. See
+            SoggyVision.compression. The netcdf backend takes 'zlib', which compresses each chunk.
+        :param backend: 'sqlite' or 'netcdf'. See SoggyVision.storage.
+        """
+
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.backend = open_backend(backend, flush_rows, flush_interval, wal, synchronous, partition, codec)
+        self._sessions = {}  # source: [(dbname, session), writer from the backend]
+        self.error = None
+        self.metrics = Metrics(self.STAGES, self.COUNTERS, {'open_databases': lambda: len(self._sessions),
+                                                            'buffered_rows': self.buffered_rows})
+
+    def buffered_rows(self) -> int:
+        return sum(len(writer) for _, writer in list(self._sessions.values()))
+
+    def write(self, batch: StorageBatch) -> None:
+        """Buffer every frame and its flags, creating the database and metadata entry for a new session."""
+
+        for data, flags in zip(batch.data, batch.flags):
+            key = (batch.dbname, batch.session)
+            if batch.source not in self._sessions or self._sessions[batch.source][0] != key: #Initiate
+                self.close_session(batch.source)
+                writer = self.backend.open_session(batch.dbname, session_metadata(batch.acs, data.time),
+                                                   batch.raw_only)
+                self._sessions[batch.source] = [key, writer]
+            _, writer = self._sessions[batch.source]
+            writer.add(data, flags, data.time)
+
+    def flush_due(self) -> None:
+        """Commit every session whose oldest buffered row has waited flush_interval seconds."""
+
+        for source, (_, writer) in list(self._sessions.items()):
+            try:
+                t0 = time.perf_counter()
+                if writer.flush_if_due():
+                    self.metrics.observe('commit', time.perf_counter() - t0)
+            except Exception as error:
+                self.metrics.count('errors')
+                self.error = error
+
+    def run(self, storage_queue: BoundedQueue) -> None:
+        """
+        Write batches until the queue is closed, then flush and close every database.
+        A batch or flush that raises is counted in errors, kept in self.error and dropped, so one bad row or a full
+        disk never stops the thread that stores every instrument.
+        """
+
+        try:
+            while True:
+                try:
+                    batch = storage_queue.get(timeout = self.flush_interval / 2)
+                except queue.Empty:
+                    self.flush_due()
+                    continue
+                if batch is None:
+                    break
+                try:
+                    t0 = time.perf_counter()
+                    self.write(batch)
+                    self.metrics.observe('storage', time.perf_counter() - t0)
+                    self.metrics.count('batches')
+                    self.metrics.count('rows', len(batch.data))
+                except Exception as error:  # Drop the batch and keep writing, for every source.
+                    self.metrics.count('errors')
+                    self.error = error
+                self.flush_due()
+        except Exception as error:  # Recorded for AcquisitionManager.writer_stopped() to report.
+            self.metrics.count('errors')
+            self.error = error
+            raise
+        finally:
+            self.close()
+
+    def close_session(self, source: str, shutdown: bool = False) -> None:
+        """
+        Flush and close the open session of a source, if any.
+
+        :param shutdown: True when the writer is stopping. See StorageBackend.close_session.
+        """
+
+        if source in self._sessions:
+            _, writer = self._sessions.pop(source)
+            try:
+                self.backend.close_session(writer, shutdown)
+            except Exception as error:
+                self.metrics.count('errors')
+                self.error = error
+
+    def close(self) -> None:
+        for source in list(self._sessions):
+            self.close_session(source, shutdown = True)
+        self.backend.close()
+
+
+class NoDataTimeout(TimeoutError):
+    """Raised by the reader when no complete frame arrives within the no data timeout."""
+
+
+class DataAcquisition():
+    """
+    Read, convert, flag and log ACS data from a serial port.
+
+    This class has no Qt dependency so it can run headless. The work is split into three stages joined by bounded
+    queues: a reader thread that stamps and frames serial data, a conversion/QC stage (the thread that calls run()),
+    and a storage thread that writes to the database. A slow disk therefore never delays the next serial read.
+    The rolling window of recent data is handed to publish() after every batch of frames; subclasses override
+    publish() to pass it on (e.g. to a GUI).
+
+    Every stage is timed into self.metrics (see STAGES), along with frame and byte counters and queue and buffer
+    depth gauges. latency is the time from a serial read to the publication of its frames.
+    """
+
+    STAGES = ['read', 'frame', 'convert', 'flags', 'enqueue', 'publish', 'latency']
+    COUNTERS = ['frames', 'bytes_read', 'discarded_bytes', 'partial_frames']
+
+    def __init__(self, port: str, ACS: object, hindcast: int,
+                 raw_queue_size: int = 256, raw_queue_policy: str = BoundedQueue.DROP_OLDEST,
+                 storage_queue_size: int = 1024, storage_queue_policy: str = BoundedQueue.BLOCK,
+                 read_timeout: float = 1.0, no_data_timeout: float = 5.0, storage_queue: BoundedQueue = None,
+                 partition = None) -> None:
+        """
+        :param port: The serial port the ACS is connected to, or any pyserial URL (e.g. socket://host:port).
+        :param ACS: An ACS object built from the calibration file of the instrument.
+        :param hindcast: The length of the rolling window in seconds.
+        :param raw_queue_size: The maximum number of reads waiting for conversion.
+        :param raw_queue_policy: What the reader does when conversion falls behind. See BoundedQueue.
+        :param storage_queue_size: The maximum number of batches waiting to be written.
+        :param storage_queue_policy: What conversion does when storage falls behind. See BoundedQueue.
+        :param read_timeout: The longest a single blocking serial read waits, in seconds.
+        :param no_data_timeout: Stop and report a NoDataTimeout after this many seconds without a frame.
+        :param storage_queue: A queue shared with other instruments and drained by an external StorageWriter.
+            If None, this instance creates its own queue and runs its own storage thread.
+        :param partition: The partition policy of the own storage thread. See StorageWriter.
+        """
+
+        self.port = port
+        self.acs = ACS
+        self.hindcast = int(hindcast)
+        self.baudrate = self.acs.baudrate  #Get the baudrate defined in the .dev file. Should always be 115200.
+
+        self.serial = serial.serial_for_url(self.port, do_not_open = True)# Create a serial instance.
+        self.serial.baudrate = self.baudrate
+        self.serial.open()
+
+        # Create a rolling window of recent data. Size is dictated by the user defined hindcast.
+        self.window = RollingWindow(self.acs.wavelength_a, self.acs.wavelength_c, self.hindcast)
+        self.clock = ElapsedTimeClock()  # Frame times come from the instrument elapsed_time counter.
+        self._last_time = None
+
+        self.raw_queue = BoundedQueue(raw_queue_size, raw_queue_policy)
+        self.shared_storage = storage_queue is not None
+        if self.shared_storage:
+            self.storage_queue = storage_queue
+        else:
+            self.storage_queue = BoundedQueue(storage_queue_size, storage_queue_policy)
+        self.read_timeout = read_timeout
+        self.no_data_timeout = no_data_timeout
+        self.partition = partition
+        self.error = None
+
+        self._framer = ACSFramer(self.acs)
+        self.metrics = Metrics(self.STAGES, self.COUNTERS,
+                               {'framer_buffered_bytes': lambda: len(self._framer),
+                                'raw_queue_depth': lambda: len(self.raw_queue),
+                                'raw_queue_dropped': lambda: self.raw_queue.dropped})
+        if not self.shared_storage:  # A shared queue is reported once, by its owner.
+            self.metrics.gauges['storage_queue_depth'] = lambda: len(self.storage_queue)
+            self.metrics.gauges['storage_queue_dropped'] = lambda: self.storage_queue.dropped
+
+        self.log = False
+        self.dbname = None
+        self.raw_only = False
+        self.session = 0
+        self.running = True
+
+
+    def run(self) -> None:
+        # Reset serial buffers.
+        self.serial.reset_input_buffer()
+        self.serial.reset_output_buffer()
+        self._framer.reset()
+        self.clock.reset()
+        self._last_time = None
+        self.raw_queue.reopen()  # A previous run may have ended without its consumer seeing the close.
+        if not self.shared_storage:
+            self.storage_queue.reopen()
+
+        reader = threading.Thread(target=self.read_loop, name=f"{self.port}-reader", daemon=True)
+        reader.start()
+        if not self.shared_storage:
+            storage = threading.Thread(target=StorageWriter(partition = self.partition).run, args=(self.storage_queue,),
+                                       name=f"{self.port}-storage", daemon=True)
+            storage.start()
+        try:
+            self.convert_loop()
+        except Exception as error:  # Stop the other stages too, as the reader does on a serial error.
+            self.error = error
+            self.report_error(error)
+            self.stop()
+        finally:
+            self.running = False
+            self.raw_queue.close()  # Nothing converts the frames the reader still queues.
+            reader.join()
+            if not self.shared_storage:
+                self.storage_queue.close()
+                storage.join()
+
+
+    def read_loop(self) -> None:
+        """
+        Reader stage. Block until a full frame is likely available, stamp the read with the host time, frame it and
+        queue the frames for conversion.
+        """
+
+        self.serial.timeout = self.read_timeout  # Reads block in the serial driver (select on POSIX) until satisfied.
+        frame_span = self.acs.packet_length + 3  # Frame, checksum and pad byte.
+        metrics = self.metrics
+        last_frame_time = time.monotonic()
+        try:
+            while self.running:
+                needed = max(frame_span - len(self._framer), 1)
+                t0 = time.perf_counter()
+                incoming = self.serial.read(max(self.serial.in_waiting, needed))
+                dt = datetime.now()
+                t1 = time.perf_counter()
+                self._framer.feed(incoming)
+                frames, framer_stats = self._framer.drain()
+                metrics.observe('read', t1 - t0)
+                metrics.observe('frame', time.perf_counter() - t1)
+                metrics.count('bytes_read', len(incoming))
+                metrics.count('discarded_bytes', framer_stats.discarded_bytes)
+                metrics.count('partial_frames', framer_stats.partial_frames)
+                if not frames:
+                    if time.monotonic() - last_frame_time >= self.no_data_timeout:
+                        raise NoDataTimeout(f"No ACS data received on {self.port} for {self.no_data_timeout} seconds.")
+                    continue
+                last_frame_time = time.monotonic()
+                metrics.count('frames', len(frames))
+                self.raw_queue.put(RawBatch(time = dt,
+                                            frames = [bytes(frame) for frame, checksum in frames],
+                                            checksums = [bytes(checksum) for frame, checksum in frames],
+                                            framer_stats = framer_stats))
+        except (NoDataTimeout, serial.SerialException) as error:
+            if self.running:  # A SerialException after stop() is just the port closing.
+                self.error = error
+                self.report_error(error)
+        finally:
+            self.running = False
+            self.raw_queue.close()
+
+
+    def convert_loop(self) -> None:
+        """Conversion stage. Convert and flag each batch, update the rolling window and queue it for storage."""
+
+        metrics = self.metrics
+        while True:
+            batch = self.raw_queue.get()
+            if batch is None:
+                break
+            t0 = time.perf_counter()
+            dt = batch.time
+            if self.hindcast != self.window.hindcast:
+                self.window.resize(self.hindcast)
+
+            # Frame times are reconstructed from the instrument elapsed time, anchored and steered by the read time.
+            block = self.acs.get_data_block(dt, batch.frames)
+            block.time[:] = self.clock.timestamps(dt, block.raw.elapsed_time)
+            t1 = time.perf_counter()
+            metrics.observe('convert', t1 - t0)
+            batch_data = []
+            batch_flags = []
+
+            # Run gap test.
+            gap_test_results = gap_test_batch(block.time, self._last_time)
+            self._last_time = block.time[-1]
+            for gap_test_result, checksum, data in zip(gap_test_results.tolist(), batch.checksums, block):
+
+                # Run syntax test and flag data.
+                syntax_test_results = syntax_test(data.frame, data.frame_length, checksum)
+                flags = self.acs.get_flags(data,gap_test_result, syntax_test_results)
+                batch_data.append(data)
+                batch_flags.append(flags)
+            t2 = time.perf_counter()
+            metrics.observe('flags', t2 - t1)
+
+            # Log data if the user indicates they want to log data.
+            if self.dbname is not None and self.log is True:
+                self.storage_queue.put(StorageBatch(source = self.port, acs = self.acs, dbname = self.dbname,
+                                                    session = self.session, data = batch_data, flags = batch_flags,
+                                                    raw_only = self.raw_only))
+                t3 = time.perf_counter()
+                metrics.observe('enqueue', t3 - t2)
+                t2 = t3
+
+            self.window.extend(block.time,
+                               a_m = block.a_m,
+                               c_m = block.c_m,
+                               internal_temperature = block.internal_temperature,
+                               external_temperature = block.external_temperature,
+                               a_signal_dark = block.raw.a_signal_dark,
+                               c_signal_dark = block.raw.c_signal_dark,
+                               a_reference_dark = block.raw.a_reference_dark,
+                               c_reference_dark = block.raw.c_reference_dark,
+                               flag_gap = [flags.flag_gap_test for flags in batch_flags],
+                               flag_syntax = [flags.flag_syntax_test for flags in batch_flags],
+                               flag_gross_a_m = [flags.flag_gross_range_test_a_m for flags in batch_flags],
+                               flag_gross_c_m = [flags.flag_gross_range_test_c_m for flags in batch_flags])
+            self.publish(self.window.snapshot())  # Pass data on once per batch of frames.
+            metrics.observe('publish', time.perf_counter() - t2)
+            metrics.observe('latency', (datetime.now() - dt).total_seconds())
+
+
+    def start_logging(self, dbname: str, raw_only: bool = False) -> None:
+        """
+        Start a logging session. Each session adds its own metadata entry, even when the database is reused.
+        :param dbname: The database to log to.
+        :param raw_only: Only store the time and raw frame. Converted products are derived when the database is read.
+        """
+        self.session += 1
+        self.dbname = dbname
+        self.raw_only = raw_only
+        self.log = True
+
+    def stop_logging(self) -> None:
+        self.log = False
+        self.dbname = None
+
+
+    def publish(self, snapshot: WindowSnapshot) -> None:
+        """Hand a snapshot of the rolling window to a consumer. Does nothing by default."""
+        pass
+
+    def report_error(self, error: Exception) -> None:
+        """Report an error that stopped acquisition. Does nothing by default."""
+        pass
+
+    def stop(self):
+        self.running = False
+        if self.serial.is_open and hasattr(self.serial, 'cancel_read'):  # URL handlers may not support it.
+            self.serial.cancel_read()  # Wake the reader from a blocking read. Otherwise read_timeout bounds the wait.
@@ -33,6 +33,40 @@ class ACSMetadata(NamedTuple):
     end_time: str
 
 
+GATHER_ROWS = 1024  # Frames per fancy indexing step when offsets are unevenly spaced, which bounds the int64 index.
+
+
+def gather_frames(buffer, offsets, length):
+    """
+    Collect equal length spans of a buffer.
+
+    Evenly spaced offsets, the common case for a clean stream, are copied through a strided view. Otherwise the spans
+    are copied in steps of GATHER_ROWS, so the index array never grows with the number of frames. Either way the only
+    allocation of size N is the result, which owns its memory (a view would pin an mmap open).
+    :param buffer: 1D uint8 array
+    :param offsets: start index of each span
+    :param length: bytes per span
+    :return: (N, length) uint8 array
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    if len(offsets) == 0:
+        return np.zeros((0, length), dtype = np.uint8)
+    steps = np.diff(offsets)
+    in_bounds = offsets[0] >= 0 and offsets[-1] + length <= len(buffer)
+    if in_bounds and (len(steps) == 0 or (steps[0] > 0 and (steps == steps[0]).all())):
+        step = int(steps[0]) if len(steps) > 0 else length
+        start = buffer[int(offsets[0]):]
+        view = np.lib.stride_tricks.as_strided(start, shape = (len(offsets), length),
+                                               strides = (step * buffer.strides[0], buffer.strides[0]),
+                                               writeable = False)
+        return view.copy()
+    spans = np.empty((len(offsets), length), dtype = np.uint8)
+    span = np.arange(length)
+    for i in range(0, len(offsets), GATHER_ROWS):
+        spans[i:i + GATHER_ROWS] = buffer[offsets[i:i + GATHER_ROWS, None] + span]
+    return spans
+
+
 class ACSFlags(NamedTuple):
     time: str
     flag_elapsed_time: int
@@ -69,11 +103,43 @@ class ACSData(NamedTuple):
     external_temperature: float
 
 
+class ACSRawFrames(NamedTuple):
+    frame_length: np.ndarray
+    frame_type: np.ndarray
+    serial_number_hexdec: np.ndarray
+    a_reference_dark: np.ndarray
+    pressure_signal: np.ndarray
+    a_signal_dark: np.ndarray
+    t_external: np.ndarray
+    t_internal: np.ndarray
+    c_reference_dark: np.ndarray
+    c_signal_dark: np.ndarray
+    elapsed_time: np.ndarray
+    number_of_wavelengths: np.ndarray
+    c_reference: np.ndarray
+    a_reference: np.ndarray
+    c_signal: np.ndarray
+    a_signal: np.ndarray
+
+
+class FramerStats(NamedTuple):
+    frames: int
+    discarded_bytes: int
+    partial_frames: int
+    buffered_bytes: int
+
+
 class ACS(Dev):
-    def __init__(self, filepath):
-        super().__init__(filepath)
+    def __init__(self, filepath, lut_step = None):
+        super().__init__(filepath, lut_step)
         self.reset_buffer()
 
+    @classmethod
+    def from_metadata(cls, metadata, lut_step = None):
+        acs = super().from_metadata(metadata, lut_step)
+        acs.reset_buffer()
+        return acs
+
     def reset_buffer(self):
         self._buffer = bytearray()
 
@@ -103,26 +169,45 @@ class ACS(Dev):
 
 
             return (frame, checksum,  buffer[frame_end_index + 2:], buffer[:i])
-        except:
+        except (ValueError, IndexError):  # No registration found, or the frame is incomplete.
             return (None, None, buffer, None)
 
     def compute_internal_temperature(self,counts: int) -> float:
-        counts = np.array(counts).astype('int64')
+        return float(self.compute_internal_temperature_batch(counts))
+
+
+    def compute_internal_temperature_batch(self, counts: np.ndarray) -> np.ndarray:
+        """
+        Convert internal thermistor counts to degrees Celsius.
+        :param counts: array of counts, one per frame
+        :return: array of internal temperatures
+        """
+        counts = np.asarray(counts, dtype = np.float64)
         volts = 5 * counts / 65535
         resistance = 10000 * volts / (4.516 - volts)
+        log_resistance = np.log(resistance)
         internal_temperature = 1 / (
-                    0.00093135 + 0.000221631 * np.log(resistance) + 0.000000125741 * np.log(resistance) ** 3) - 273.15
-        return float(internal_temperature)
+                    0.00093135 + 0.000221631 * log_resistance + 0.000000125741 * log_resistance ** 3) - 273.15
+        return internal_temperature
 
 
     def compute_external_temperature(self,counts: int) -> float:
-        counts = np.array(counts).astype('int64')
+        return float(self.compute_external_temperature_batch(counts))
+
+
+    def compute_external_temperature_batch(self, counts: np.ndarray) -> np.ndarray:
+        """
+        Convert external thermistor counts to degrees Celsius.
+        :param counts: array of counts, one per frame
+        :return: array of external temperatures
+        """
+        counts = np.asarray(counts, dtype = np.float64)
         a = -7.1023317e-13
         b = 7.09341920e-08
         c = -3.87065673e-03
         d = 95.8241397
-        external_temperature = a * counts ** 3 + b * counts ** 2 + c * counts + d
-        return float(external_temperature)
+        external_temperature = ((a * counts + b) * counts + c) * counts + d
+        return external_temperature
 
 
     def compute_uncorrected(self, signal_counts: list, reference_counts: list) -> list:
@@ -131,17 +216,45 @@ class ACS(Dev):
         return uncorr.tolist()
 
 
+    def compute_uncorrected_batch(self, signal_counts: np.ndarray, reference_counts: np.ndarray) -> np.ndarray:
+        """
+        Compute uncorrected a or c for a batch of frames.
+        :param signal_counts: (N, wavelengths) array
+        :param reference_counts: (N, wavelengths) array
+        :return: (N, wavelengths) array
+        """
+        x = self.path_length
+        uncorr = (1 / x) * np.log(np.asarray(signal_counts, dtype = np.float64) / reference_counts)
+        return uncorr
+
+
     def compute_measured(self, uncorrected: list, channel: str, internal_temperature: float):
         if channel.lower() == 'a':
-            delta_t = self.f_delta_t_a(internal_temperature).T
             offsets = self.offset_a
         elif channel.lower() == 'c':
-            delta_t = self.f_delta_t_c(internal_temperature).T
             offsets = self.offset_c
+        delta_t = self.get_delta_t(channel, internal_temperature)
         measured = (offsets - np.array(uncorrected)) - delta_t
         return measured.tolist()
 
 
+    def compute_measured_batch(self, uncorrected: np.ndarray, channel: str, internal_temperature: np.ndarray) -> np.ndarray:
+        """
+        Temperature correct a batch of uncorrected spectra.
+        :param uncorrected: (N, wavelengths) array
+        :param channel: 'a' or 'c'
+        :param internal_temperature: (N,) internal temperature of each frame
+        :return: (N, wavelengths) measured array
+        """
+        if channel.lower() == 'a':
+            offsets = self.offset_a
+        elif channel.lower() == 'c':
+            offsets = self.offset_c
+        delta_t = self.get_delta_t(channel, internal_temperature)
+        measured = (offsets - np.asarray(uncorrected)) - delta_t
+        return measured
+
+
     def get_metadata(self):
         metadata = ACSMetadata(begin_time = None, sensor_type=self.sensor_type, calibration_filepath=self.filepath,
                             calibration_filename=os.path.basename(self.filepath),
@@ -227,6 +340,57 @@ class ACS(Dev):
         return data
 
 
+    def decode_frames(self, frames, offsets = None) -> ACSRawFrames:
+        """
+        Decode many frames at once into columnar numpy arrays.
+        :param frames: a sequence of frames (each starting with the packet registration), an (N, packet_length)
+                        uint8 array, or one contiguous buffer when offsets is given.
+        :param offsets: start index of each frame within the buffer.
+        :return: ACSRawFrames with (N,) header arrays and (N, wavelengths) count arrays.
+        """
+        if isinstance(frames, np.ndarray) and frames.ndim == 2:
+            records = np.ascontiguousarray(frames[:, :self.packet_length]).reshape(-1).view(self.packet_dtype)
+        elif offsets is None:
+            joined = b''.join(bytes(frame[:self.packet_length]) for frame in frames)
+            records = np.frombuffer(joined, dtype = self.packet_dtype)
+        else:
+            buffer = np.frombuffer(frames, dtype = np.uint8)
+            records = gather_frames(buffer, offsets, self.packet_length).reshape(-1).view(self.packet_dtype)
+
+        header = {name: records[name].astype(records.dtype[name].newbyteorder('=')) for name in ACSRawFrames._fields[:12]}
+        c_reference, a_reference, c_signal, a_signal = np.moveaxis(records['spectra'], 2, 0).astype(np.uint16, order = 'C')
+        return ACSRawFrames(**header,
+                            c_reference = c_reference,
+                            a_reference = a_reference,
+                            c_signal = c_signal,
+                            a_signal = a_signal)
+
+
+    def get_data_block(self, times, frames) -> 'ACSFrameBlock':
+        """
+        Decode and convert many frames at once.
+        :param times: a single datetime for all frames, or one per frame
+        :param frames: a sequence of frames or an (N, packet_length) uint8 array
+        :return: ACSFrameBlock
+        """
+        if not (isinstance(frames, np.ndarray) and frames.ndim == 2):
+            joined = b''.join(bytes(frame[:self.packet_length]) for frame in frames)
+            frames = np.frombuffer(joined, dtype = np.uint8).reshape(-1, self.packet_length)
+        raw = self.decode_frames(frames)
+        times = np.broadcast_to(np.asarray(times, dtype = 'datetime64[ns]'), (len(frames),)).copy()
+
+        internal_temperature = self.compute_internal_temperature_batch(raw.t_internal)
+        external_temperature = self.compute_external_temperature_batch(raw.t_external)
+        a_uncorr = self.compute_uncorrected_batch(raw.a_signal, raw.a_reference)
+        c_uncorr = self.compute_uncorrected_batch(raw.c_signal, raw.c_reference)
+        a_m = self.compute_measured_batch(a_uncorr, 'a', internal_temperature)
+        c_m = self.compute_measured_batch(c_uncorr, 'c', internal_temperature)
+        return ACSFrameBlock(time = times, frames = frames, raw = raw,
+                             a_uncorr = a_uncorr, c_uncorr = c_uncorr, a_m = a_m, c_m = c_m,
+                             internal_temperature = internal_temperature,
+                             external_temperature = external_temperature)
+
+
     def get_flags(self, data, gap_test_results, syntax_test_results):
         # Flag data.
 
@@ -237,4 +401,221 @@ class ACS(Dev):
                                 flag_gross_range_test_a_m = gross_range_test(data.a_m),
                                 flag_gross_range_test_c_m = gross_range_test(data.c_m),
                                 flag_outside_temperature_calibration = outside_temperature_calibration_test(data.internal_temperature, min(self.tbins), max(self.tbins)))
-        return flag_data
\ No newline at end of file
+        return flag_data
+
+
+class ACSFrameBlock():
+    """
+    Columnar storage for many converted frames.
+
+    Raw counts are kept as (N, wavelengths) uint16 arrays and converted spectra as float32 arrays.
+    Indexing a single frame or iterating a block yields ACSData tuples, so QC, database and daq code can use either.
+    Indexing with a slice, integer indices or a boolean mask yields a smaller block.
+    """
+
+    __slots__ = ('time', 'frames', 'raw', 'a_uncorr', 'c_uncorr', 'a_m', 'c_m',
+                 'internal_temperature', 'external_temperature')
+
+    def __init__(self, time: np.ndarray, frames: np.ndarray, raw: ACSRawFrames,
+                 a_uncorr: np.ndarray, c_uncorr: np.ndarray, a_m: np.ndarray, c_m: np.ndarray,
+                 internal_temperature: np.ndarray, external_temperature: np.ndarray) -> None:
+        self.time = np.asarray(time, dtype = 'datetime64[ns]')
+        self.frames = np.asarray(frames, dtype = np.uint8)
+        self.raw = raw
+        self.a_uncorr = np.asarray(a_uncorr, dtype = np.float32)
+        self.c_uncorr = np.asarray(c_uncorr, dtype = np.float32)
+        self.a_m = np.asarray(a_m, dtype = np.float32)
+        self.c_m = np.asarray(c_m, dtype = np.float32)
+        self.internal_temperature = np.asarray(internal_temperature, dtype = np.float64)
+        self.external_temperature = np.asarray(external_temperature, dtype = np.float64)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __getitem__(self, i):
+        """
+        :param i: An integer for a single frame, or a slice, integer indices or a boolean mask for many.
+        :return: ACSData for an integer, otherwise an ACSFrameBlock. See take.
+        """
+        if isinstance(i, (int, np.integer)):
+            return self.to_acsdata(i)
+        return self.take(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.to_acsdata(i)
+
+    def to_acsdata(self, i: int) -> ACSData:
+        """
+        Build the ACSData tuple for a single frame.
+        :param i: index of the frame within the block
+        :return: ACSData
+        """
+        raw = self.raw
+        return ACSData(time = self.time[i].astype('datetime64[us]').item(),
+                       frame = self.frames[i].tobytes(),
+                       frame_length = int(raw.frame_length[i]),
+                       frame_type = int(raw.frame_type[i]),
+                       serial_number_hexdec = int(raw.serial_number_hexdec[i]),
+                       a_reference_dark = int(raw.a_reference_dark[i]),
+                       pressure_signal = int(raw.pressure_signal[i]),
+                       a_signal_dark = int(raw.a_signal_dark[i]),
+                       t_external = int(raw.t_external[i]),
+                       t_internal = int(raw.t_internal[i]),
+                       c_reference_dark = int(raw.c_reference_dark[i]),
+                       c_signal_dark = int(raw.c_signal_dark[i]),
+                       elapsed_time = int(raw.elapsed_time[i]),
+                       number_of_wavelengths = int(raw.number_of_wavelengths[i]),
+                       c_reference = raw.c_reference[i].tolist(),
+                       a_reference = raw.a_reference[i].tolist(),
+                       c_signal = raw.c_signal[i].tolist(),
+                       a_signal = raw.a_signal[i].tolist(),
+                       a_uncorr = self.a_uncorr[i].tolist(),
+                       c_uncorr = self.c_uncorr[i].tolist(),
+                       a_m = self.a_m[i].tolist(),
+                       c_m = self.c_m[i].tolist(),
+                       internal_temperature = float(self.internal_temperature[i]),
+                       external_temperature = float(self.external_temperature[i]))
+
+    def to_data(self) -> list:
+        """Convert the whole block to a list of ACSData tuples."""
+        return list(self)
+
+    def take(self, index) -> 'ACSFrameBlock':
+        """
+        Select frames by position.
+        :param index: integer indices, a boolean mask or a slice
+        :return: ACSFrameBlock
+        """
+        raw = ACSRawFrames(*[v[index] for v in self.raw])
+        return ACSFrameBlock(raw = raw, **{slot: getattr(self, slot)[index] for slot in self.__slots__ if slot != 'raw'})
+
+    @classmethod
+    def concatenate(cls, blocks: list) -> 'ACSFrameBlock':
+        """
+        Join blocks end to end.
+        :param blocks: list of ACSFrameBlock
+        :return: ACSFrameBlock
+        """
+        blocks = list(blocks)
+        if len(blocks) == 0:
+            raise ValueError('No blocks to concatenate.')
+        raw = ACSRawFrames(*[np.concatenate([getattr(block.raw, field) for block in blocks])
+                             for field in ACSRawFrames._fields])
+        return cls(raw = raw, **{slot: np.concatenate([getattr(block, slot) for block in blocks])
+                                 for slot in cls.__slots__ if slot != 'raw'})
+
+
+class ACSFramer():
+    """
+    Incrementally frame ACS packets from a single growing buffer.
+
+    Each call to drain() returns every complete frame currently buffered. Frames and checksums are memoryview slices
+    of the internal buffer and are only valid until the next call to feed(). Copy them (bytes(frame)) to keep them.
+    A frame that was cut short by the next one is discarded and framing resumes at the next registration.
+    """
+
+    PAD_BYTE = 0x00  # The ACS sends a single pad byte after the checksum.
+
+    def __init__(self, acs: ACS, capacity: int = 65536) -> None:
+        self.registration = acs.PACKET_REGISTRATION
+        self.len_registration = acs.LEN_PACKET_REGISTRATION
+        self.packet_length = acs.packet_length
+        self.frame_span = self.packet_length + 2  # Frame plus checksum.
+        self._buffer = bytearray(max(capacity, 4 * self.frame_span))
+        self._view = memoryview(self._buffer)
+        self._start = 0  # First unread byte.
+        self._end = 0  # One past the last written byte.
+        self._expect_pad = False
+        self.stats = FramerStats(0, 0, 0, 0)
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def reset(self) -> None:
+        self._start = 0
+        self._end = 0
+        self._expect_pad = False
+
+    def feed(self, data: bytes) -> None:
+        """
+        Append incoming bytes to the buffer.
+        :param data: bytes read from the instrument.
+        """
+        n = len(data)
+        if self._end + n > len(self._buffer):
+            self._make_room(n)
+        self._buffer[self._end:self._end + n] = data
+        self._end += n
+
+    def _make_room(self, n: int) -> None:
+        """
+        Compact the buffer, growing it if the pending bytes would fill more than half of it.
+        The buffer is never resized in place, so frames handed out earlier do not block compaction.
+        """
+        pending = bytes(self._view[self._start:self._end])
+        size = len(self._buffer)
+        if len(pending) + n > size // 2:
+            size = max(2 * size, 2 * (len(pending) + n))
+            self._view.release()
+            self._buffer = bytearray(size)
+            self._view = memoryview(self._buffer)
+        self._buffer[:len(pending)] = pending
+        self._start = 0
+        self._end = len(pending)
+
+    def _truncated(self, j: int) -> bool:
+        """:return: True if the complete span at j contains another registration and fails the checksum."""
+        stop = min(j + self.frame_span - 1 + self.len_registration, self._end)
+        if self._buffer.find(self.registration, j + 1, stop) == -1:
+            return False
+        checksum = int.from_bytes(self._view[j + self.packet_length:j + self.frame_span], 'big')
+        return sum(self._view[j:j + self.packet_length]) & 0xFFFF != checksum
+
+    def drain(self) -> tuple:
+        """
+        Find every complete frame in the buffer.
+        :return: frames: list of (frame, checksum) memoryview pairs
+                 stats: FramerStats for this call
+        """
+        buffer = self._buffer
+        end = self._end
+        i = self._start
+        if self._expect_pad and i < end:
+            if buffer[i] == self.PAD_BYTE:
+                i += 1
+            self._expect_pad = False
+
+        frames = []
+        discarded = 0
+        partial = 0
+        while True:
+            j = buffer.find(self.registration, i, end)
+            if j == -1:
+                # Hold back a possible partial registration at the end of the buffer.
+                keep = min(end - i, self.len_registration - 1)
+                discarded += end - i - keep
+                i = end - keep
+                break
+            while buffer.find(self.registration, j + 2, min(j + 2 + self.len_registration, end)) != -1:
+                j += 2
+            discarded += j - i
+            if end - j < self.frame_span:
+                partial = 1
+                i = j
+                break
+            if self._truncated(j):  # Cut short by the next frame, which starts inside this one.
+                discarded += 1
+                i = j + 1
+                continue
+            frames.append((self._view[j:j + self.packet_length], self._view[j + self.packet_length:j + self.frame_span]))
+            i = j + self.frame_span
+            if i < end:
+                if buffer[i] == self.PAD_BYTE:
+                    i += 1
+            else:
+                self._expect_pad = True
+        self._start = i
+        self.stats = FramerStats(frames = len(frames), discarded_bytes = discarded, partial_frames = partial,
+                                 buffered_bytes = end - i)
+        return frames, self.stats
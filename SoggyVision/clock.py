@@ -0,0 +1,134 @@
+from collections import deque
+import numpy as np
+
+
+class ElapsedTimeClock():
+    """
+    Reconstruct frame timestamps from the instrument elapsed_time counter.
+
+    Host time is only used to anchor and steer the model: each read contributes one observation, the offset between
+    the host time of the read and the instrument time of the newest frame in it. Reads can only be late, never early,
+    so the model follows the lower envelope of the offsets: the minimum offset of each window is kept and a line
+    through the recent minima tracks drift between the host and instrument clocks. Every frame is then stamped
+    anchor + instrument time + modelled offset, so frames that share a read, or that were delayed by a stall, get
+    the times at which the instrument produced them.
+
+    elapsed_time rollovers are unwrapped. A counter that goes backwards (power cycle) or leaps ahead of host time
+    starts a new epoch and the model is re-anchored.
+    """
+
+    ROLLOVER = 2 ** 32  # elapsed_time is a uint32 count of milliseconds.
+
+    def __init__(self, window: float = 60.0, max_windows: int = 60, reset_tolerance: float = 5.0) -> None:
+        """
+        :param window: The length of an offset window in instrument seconds.
+        :param max_windows: The number of window minima used to fit drift.
+        :param reset_tolerance: Re-anchor if a frame appears to arrive this many seconds before it was produced.
+        """
+
+        self.window = float(window)
+        self.max_windows = int(max_windows)
+        self.reset_tolerance = float(reset_tolerance)
+        self.resets = 0
+        self.rollovers = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the model. The next frame re-anchors it."""
+
+        self.anchor = None  # datetime64[ns] host time of instrument time zero.
+        self._last_raw = None
+        self._wraps = 0
+        self._minima = deque(maxlen = self.max_windows)  # (instrument seconds, minimum offset seconds)
+        self._window_start = None
+        self._window_min = None
+        self._best_min = None
+        self._fit = None  # (intercept, slope) of offset against instrument seconds.
+
+    @property
+    def drift(self) -> float:
+        """Host clock rate relative to the instrument clock in parts per million, or None before a fit."""
+
+        return None if self._fit is None else self._fit[1] * 1e6
+
+    def offset(self, instrument_seconds) -> np.ndarray:
+        """The modelled host minus instrument offset, in seconds, at the given instrument times."""
+
+        if self._fit is not None:
+            intercept, slope = self._fit
+            return intercept + slope * np.asarray(instrument_seconds, dtype = np.float64)
+        return np.full(np.shape(instrument_seconds), self._best_min, dtype = np.float64)
+
+    def __unwrap(self, raw: np.ndarray) -> tuple:
+        """
+        Unwrap a batch of raw counts.
+
+        :return: instrument seconds since the epoch anchor, index of the first frame of a new epoch or None
+        """
+
+        previous = np.concatenate([[self._last_raw if self._last_raw is not None else raw[0]], raw])
+        steps = np.diff(previous)
+        resets = np.flatnonzero((steps < 0) & (steps >= -self.ROLLOVER // 2))
+        stop = resets[0] if len(resets) > 0 else len(raw)
+        wrapped = np.cumsum(steps[:stop] < -self.ROLLOVER // 2)
+        counts = raw[:stop] + (self._wraps + wrapped) * self.ROLLOVER
+        if stop > 0:
+            self.rollovers += int(wrapped[-1])
+            self._wraps += int(wrapped[-1])
+            self._last_raw = int(raw[stop - 1])
+        return counts / 1000, (stop if stop < len(raw) else None)
+
+    def __observe(self, instrument_second: float, offset: float) -> None:
+        """Add the offset observed for the newest frame of a read."""
+
+        if self._window_start is None:
+            self._window_start = instrument_second
+            self._best_min = offset
+        elif instrument_second - self._window_start >= self.window:
+            self._minima.append((self._window_start + self.window / 2, self._window_min))
+            self._window_start = instrument_second
+            self._window_min = None
+            if len(self._minima) >= 2:
+                x, y = np.array(self._minima).T
+                slope, intercept = np.polyfit(x, y, 1)
+                self._fit = (intercept, slope)
+        self._window_min = offset if self._window_min is None else min(self._window_min, offset)
+        self._best_min = min(self._best_min, offset)
+        if self._fit is not None and offset < self.offset(instrument_second):
+            self._fit = (self._fit[0] + offset - float(self.offset(instrument_second)), self._fit[1])  # Never late.
+
+    def timestamps(self, read_time, elapsed_time: np.ndarray) -> np.ndarray:
+        """
+        Stamp the frames of one read.
+
+        :param read_time: The host time at which the read returned.
+        :param elapsed_time: (N,) elapsed_time counters of the frames, oldest first.
+        :return: (N,) datetime64[ns] times.
+        """
+
+        read_time = np.datetime64(read_time, 'ns')
+        raw = np.asarray(elapsed_time, dtype = np.int64)
+        times = np.empty(len(raw), dtype = 'datetime64[ns]')
+        start = 0
+        while start < len(raw):
+            if self._last_raw is None:
+                self._last_raw = int(raw[start])
+            seconds, reset_at = self.__unwrap(raw[start:])
+            stop = start + len(seconds)
+            if len(seconds) > 0:
+                if self.anchor is None:  # Only the newest frame of a read is known to be fresh.
+                    self.anchor = read_time - np.timedelta64(int(round(seconds[-1] * 1e9)), 'ns')
+                if reset_at is None:  # The newest frame belongs to this epoch, so it can steer the model.
+                    offset = (read_time - self.anchor) / np.timedelta64(1, 's') - seconds[-1]
+                    if self._best_min is not None and offset < float(self.offset(seconds[-1])) - self.reset_tolerance:
+                        self.resets += 1  # The counter leapt ahead. Start again from the first frame of the read.
+                        self.reset()
+                        continue
+                    self.__observe(seconds[-1], offset)
+                since_anchor = np.round((seconds + self.offset(seconds)) * 1e9).astype('timedelta64[ns]')
+                times[start:stop] = self.anchor + since_anchor
+            if reset_at is not None:
+                self.resets += 1
+                self.reset()
+            start = stop
+        return times
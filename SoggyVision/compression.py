@@ -0,0 +1,107 @@
+"""
+Block codecs for compressing many rows of columnar data at once.
+
+A block is a dict of numpy arrays with the same first dimension (one entry per frame). zlib and lzma compress the
+concatenated arrays. The delta codecs first delta encode integer arrays along time, wrapping in their own dtype so
+the encoding is exact, then shuffle every array so that byte k of each value is stored together. Slowly varying
+counts and spectra then become long runs of similar bytes, which compress far better than the raw rows.
+"""
+
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+ZLIB = 'zlib'
+LZMA = 'lzma'
+DELTA_ZLIB = 'delta+zlib'
+DELTA_LZMA = 'delta+lzma'
+CODECS = [ZLIB, LZMA, DELTA_ZLIB, DELTA_LZMA]
+
+HEADER_LENGTH_FORMAT = '<I'
+
+
+def _compress(payload: bytes, codec: str) -> bytes:
+    if codec.endswith(ZLIB):
+        return zlib.compress(payload, 6)
+    return lzma.compress(payload, preset = 6)
+
+
+def _decompress(payload: bytes, codec: str) -> bytes:
+    if codec.endswith(ZLIB):
+        return zlib.decompress(payload)
+    return lzma.decompress(payload)
+
+
+def _shuffle(array: np.ndarray) -> bytes:
+    """Store each column contiguously, then group byte k of every value."""
+    columns = np.ascontiguousarray(array.reshape(len(array), -1).T)
+    return np.ascontiguousarray(columns.view(np.uint8).reshape(-1, array.dtype.itemsize).T).tobytes()
+
+
+def _unshuffle(payload: bytes, dtype: np.dtype, shape: tuple) -> np.ndarray:
+    n = shape[0]
+    columns = int(np.prod(shape[1:], dtype = np.int64))
+    planes = np.frombuffer(payload, dtype = np.uint8).reshape(dtype.itemsize, n * columns)
+    values = np.ascontiguousarray(planes.T).view(dtype).reshape(columns, n)
+    return np.ascontiguousarray(values.T).reshape(shape)
+
+
+def pack_block(arrays: dict, codec: str) -> bytes:
+    """
+    Compress a block of columns.
+
+    :param arrays: name: array, every array with the same length along axis 0.
+    :param codec: One of CODECS.
+    :return: The compressed block, see unpack_block.
+    """
+
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec: {codec}. Use one of {", ".join(CODECS)}.')
+    delta = codec.startswith('delta')
+    header = []
+    parts = []
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        encoded_delta = delta and np.issubdtype(array.dtype, np.integer) and len(array) > 0
+        if encoded_delta:
+            array = np.diff(array, axis = 0, prepend = np.zeros((1,) + array.shape[1:], dtype = array.dtype))
+        part = _shuffle(array) if delta and len(array) > 0 else np.ascontiguousarray(array).tobytes()
+        header.append([name, array.dtype.str, list(array.shape), bool(encoded_delta), len(part)])
+        parts.append(part)
+    header = json.dumps(header).encode()
+    payload = struct.pack(HEADER_LENGTH_FORMAT, len(header)) + header + b''.join(parts)
+    return _compress(payload, codec)
+
+
+def unpack_block(block: bytes, codec: str) -> dict:
+    """
+    Decompress a block of columns.
+
+    :param block: A block from pack_block.
+    :param codec: The codec it was packed with.
+    :return: name: array. Arrays not delta encoded or shuffled are read-only views of the decompressed bytes.
+    """
+
+    payload = _decompress(block, codec)
+    delta = codec.startswith('delta')
+    header_length = struct.unpack_from(HEADER_LENGTH_FORMAT, payload)[0]
+    offset = struct.calcsize(HEADER_LENGTH_FORMAT)
+    header = json.loads(payload[offset:offset + header_length])
+    offset += header_length
+    arrays = {}
+    for name, dtype, shape, encoded_delta, length in header:
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        part = memoryview(payload)[offset:offset + length]
+        offset += length
+        if delta and shape[0] > 0:
+            array = _unshuffle(part, dtype, shape)
+        else:
+            array = np.frombuffer(part, dtype = dtype).reshape(shape)
+        if encoded_delta:
+            array = np.cumsum(array, axis = 0, dtype = dtype)  # Wraps exactly like the encoding.
+        arrays[name] = array
+    return arrays
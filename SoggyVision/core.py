@@ -4,6 +4,7 @@ APP_NAME = 'SoggyVision'
 
 APP_DIR = os.path.normpath(os.path.join(os.path.expanduser('~'), APP_NAME))
 CAL_DIR = os.path.join(APP_DIR,'calibrations')
+CAL_CACHE_DIR = os.path.join(CAL_DIR,'cache')
 DB_DIR = os.path.join(APP_DIR,'db')
 EXPORT_DIR = os.path.join(APP_DIR,'data')
 
@@ -14,7 +15,7 @@ SV_DISCUSSION = f'https://github.com/IanTBlack/{APP_NAME}/discussion'
 
 
 def build_directories():
-    for _dir in [APP_DIR, CAL_DIR, DB_DIR, EXPORT_DIR]:
+    for _dir in [APP_DIR, CAL_DIR, CAL_CACHE_DIR, DB_DIR, EXPORT_DIR]:
         os.makedirs(_dir, exist_ok = True)
         if not os.path.isdir(_dir):
             raise NotADirectoryError(_dir)
@@ -0,0 +1,230 @@
+"""
+Headless ACS acquisition. Logs one or more instruments to SoggyVision databases without Qt.
+
+Usage: python -m SoggyVision.daemon --instrument /dev/ttyUSB0 ACS-00291.dev [--instrument PORT DEV ...]
+"""
+
+import argparse
+from datetime import datetime, timezone
+import logging
+import logging.handlers
+import signal
+import sys
+import threading
+import time
+
+from SoggyVision.acs import ACS
+from SoggyVision.compression import CODECS
+from SoggyVision.core import build_directories
+from SoggyVision.dev import LIVE_LUT_STEP
+from SoggyVision.manager import AcquisitionManager
+from SoggyVision.partitions import parse_partition
+from SoggyVision.storage import BACKENDS, SQLITE
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+logger = logging.getLogger('SoggyVision')
+
+
+def next_rotation(now: float, rotate: float) -> float:
+    """
+    Find the next rotation time. Rotations are aligned to multiples of the interval since the epoch, so a daily
+    interval rotates at UTC midnight.
+
+    :param now: The current time in seconds since the epoch.
+    :param rotate: The rotation interval in seconds.
+    :return: The next rotation time in seconds since the epoch.
+    """
+
+    return (now // rotate + 1) * rotate
+
+
+def setup_logging(log_file: str = None, max_bytes: int = 10 * 1024 * 1024, backups: int = 5) -> None:
+    """
+    Send daemon messages to stderr, and to a size rotated log file if one is given.
+
+    :param log_file: The location of the log file.
+    :param max_bytes: Rotate the log file when it reaches this size.
+    :param backups: The number of rotated log files to keep.
+    """
+
+    handlers = [logging.StreamHandler()]
+    if log_file is not None:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes = max_bytes, backupCount = backups))
+    logging.basicConfig(level = logging.INFO, format = LOG_FORMAT, handlers = handlers)
+
+
+class AcquisitionDaemon():
+    """
+    Run an AcquisitionManager until SIGTERM or SIGINT.
+
+    Databases are rotated on a fixed interval, stopped instruments are restarted and throughput and latency are
+    logged periodically. Every buffer in the pipeline is bounded, so memory use does not grow with run time.
+    """
+
+    def __init__(self, manager: AcquisitionManager, rotate: float = 86400, stats_interval: float = 60,
+                 restart_delay: float = 5, log: bool = True, metrics_file: str = None,
+                 metrics_interval: float = 15, raw_only: bool = False) -> None:
+        """
+        :param manager: A manager with its instruments added.
+        :param rotate: Start new databases every this many seconds. None logs to a single database per instrument.
+        :param stats_interval: Log statistics every this many seconds.
+        :param restart_delay: Wait this many seconds before restarting an instrument that stopped.
+        :param log: Log data to databases. If False, only acquire and report statistics.
+        :param metrics_file: If given, write Prometheus text format metrics to this file.
+        :param metrics_interval: Write the metrics file every this many seconds.
+        :param raw_only: Only log the time and raw frame. Converted products are derived on export.
+        """
+
+        self.manager = manager
+        self.rotate = rotate
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.log = log
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.raw_only = raw_only
+        self.stopping = threading.Event()
+        self._frames = {}
+
+    def handle_signal(self, signum, frame) -> None:
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down.")
+        self.stopping.set()
+
+    def rotate_databases(self) -> None:
+        """Start logging every instrument to a new database named {name}_{UTC time}."""
+
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        for name, daq in self.manager.instruments.items():
+            daq.start_logging(f"{name}_{stamp}", self.raw_only)
+            logger.info(f"Logging {name} to {daq.dbname}.db.")
+
+    def log_stats(self, elapsed: float) -> None:
+        for name, stats in self.manager.stats().items():
+            rate = (stats.frames - self._frames.get(name, 0)) / elapsed if elapsed > 0 else 0
+            self._frames[name] = stats.frames
+            p99 = self.manager[name].metrics.stages['latency'].quantile(0.99)
+            latency = 'n/a' if stats.latency is None else f"{stats.latency * 1000:.1f} ms (p99 <= {p99 * 1000:g} ms)"
+            logger.info(f"{name}: {rate:.2f} frames/s, {stats.frames} frames, latency {latency}, "
+                        f"{stats.discarded_bytes} bytes discarded, raw queue {stats.raw_queue_depth} "
+                        f"({stats.raw_queue_dropped} dropped)")
+        counters = self.manager.writer.metrics.counters
+        logger.info(f"storage: {len(self.manager.storage_queue)} batches queued, "
+                    f"{self.manager.storage_queue.dropped} dropped, {counters['rows']} rows written, "
+                    f"{counters['errors']} errors")
+        if self.manager.writer.error is not None:
+            logger.warning(f"storage: last error: {self.manager.writer.error}")
+
+    def write_metrics(self) -> None:
+        try:
+            self.manager.write_metrics(self.metrics_file)
+        except OSError as error:
+            logger.error(f"Could not write metrics: {error}")
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+
+        now = time.time()
+        next_stats = now + self.stats_interval
+        next_metrics = now + self.metrics_interval
+        last_stats = now
+        next_rotate = next_rotation(now, self.rotate) if self.rotate else None
+        if self.log:
+            self.rotate_databases()
+        self.manager.start()
+        restart_at = None
+        try:
+            while not self.stopping.wait(1):
+                now = time.time()
+                if self.log and next_rotate is not None and now >= next_rotate:
+                    self.rotate_databases()
+                    next_rotate = next_rotation(now, self.rotate)
+                stopped = self.manager.stopped()
+                if self.manager.writer_stopped():
+                    stopped = stopped + ['storage writer']
+                if stopped and restart_at is None:
+                    for name in stopped:
+                        error = self.manager.writer.error if name == 'storage writer' else self.manager[name].error
+                        logger.error(f"{name} stopped: {error}")
+                    restart_at = now + self.restart_delay
+                elif restart_at is not None and now >= restart_at:
+                    restart_at = None
+                    try:
+                        self.manager.start()
+                        logger.info(f"Restarted {', '.join(stopped)}.")
+                    except Exception as error:  # The port may still be missing. Try again later.
+                        logger.error(f"Restart failed: {error}")
+                if self.metrics_file is not None and now >= next_metrics:
+                    self.write_metrics()
+                    next_metrics = now + self.metrics_interval
+                if now >= next_stats:
+                    self.log_stats(now - last_stats)
+                    last_stats = now
+                    next_stats = now + self.stats_interval
+        finally:
+            self.manager.stop()
+            self.log_stats(time.time() - last_stats)
+            if self.metrics_file is not None:
+                self.write_metrics()
+            logger.info('Acquisition stopped.')
+        return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description = 'Headless ACS acquisition.')
+    parser.add_argument('-i', '--instrument', nargs = 2, action = 'append', required = True, metavar = ('PORT', 'DEV'),
+                        help = 'A serial port (or pyserial URL) and the .dev file of the ACS on it. Repeatable.')
+    parser.add_argument('--hindcast', type = int, default = 60, help = 'Rolling window length in seconds.')
+    parser.add_argument('--rotate', type = float, default = 86400,
+                        help = 'Start new databases every this many seconds. 0 disables rotation.')
+    parser.add_argument('--no-log', action = 'store_true', help = 'Acquire without logging to a database.')
+    parser.add_argument('--raw-only', action = 'store_true',
+                        help = 'Only log the time and raw frame. Converted products are derived on export.')
+    parser.add_argument('--lut-step', type = float, default = LIVE_LUT_STEP,
+                        help = 'The resolution of the delta T lookup tables in degrees C. 0 interpolates every frame.')
+    parser.add_argument('--stats-interval', type = float, default = 60, help = 'Seconds between statistics.')
+    parser.add_argument('--no-data-timeout', type = float, default = 30,
+                        help = 'Restart an instrument after this many seconds without data.')
+    parser.add_argument('--partition', type = parse_partition, default = None,
+                        help = 'Split each database into hourly, daily or size (e.g. 500MB) partitions with a catalog.')
+    parser.add_argument('--backend', choices = BACKENDS, default = SQLITE,
+                        help = 'Log to sqlite databases, or to NetCDF4 files already in the export layout.')
+    parser.add_argument('--compression', choices = CODECS, default = None,
+                        help = 'Compress the rows of each commit into one block per table. netcdf supports zlib.')
+    parser.add_argument('--flush-interval', type = float, default = 1.0,
+                        help = 'Commit buffered rows at least this often, in seconds. Bounds data lost on power failure.')
+    parser.add_argument('--synchronous', default = 'FULL', choices = ['NORMAL', 'FULL'],
+                        help = 'The sqlite synchronous mode. NORMAL is faster but may lose more on power failure.')
+    parser.add_argument('--metrics-file', default = None,
+                        help = 'Write Prometheus text format metrics to this file, e.g. for node_exporter.')
+    parser.add_argument('--metrics-interval', type = float, default = 15, help = 'Seconds between metrics writes.')
+    parser.add_argument('--log-file', default = None, help = 'Also write messages to this size rotated file.')
+    parser.add_argument('--log-max-bytes', type = int, default = 10 * 1024 * 1024)
+    parser.add_argument('--log-backups', type = int, default = 5)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    setup_logging(args.log_file, args.log_max_bytes, args.log_backups)
+    build_directories()
+
+    try:
+        manager = AcquisitionManager(flush_interval = args.flush_interval, synchronous = args.synchronous,
+                                     partition = args.partition, codec = args.compression, backend = args.backend)
+    except ValueError as error:  # An option the backend does not support, e.g. --partition with netcdf.
+        parser.error(str(error))
+    for port, dev in args.instrument:
+        acs = ACS(dev, args.lut_step or None)
+        manager.add_instrument(port, acs, args.hindcast, no_data_timeout = args.no_data_timeout)
+        logger.info(f"Opened {acs.sn} on {port}.")
+    daemon = AcquisitionDaemon(manager, rotate = args.rotate or None, stats_interval = args.stats_interval,
+                               log = not args.no_log, metrics_file = args.metrics_file,
+                               metrics_interval = args.metrics_interval, raw_only = args.raw_only)
+    return daemon.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
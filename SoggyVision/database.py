@@ -1,8 +1,14 @@
+import ast
+from datetime import datetime
+import json
+import numpy as np
 import os
 import sqlite3
+import time
 
+from SoggyVision.compression import pack_block, unpack_block
 from SoggyVision.core import DB_DIR
-from SoggyVision.acs import ACSFlags, ACSData, ACSMetadata
+from SoggyVision.acs import ACS, ACSFlags, ACSData, ACSMetadata, ACSRawFrames
 
 
 class ACSFlagsTable:
@@ -21,16 +27,199 @@ class ACSDataTable:
     dtypes = ['TEXT' if issubclass(v,(str,bytes, list)) else "BIGINT" if issubclass(v, int) else "FLOAT" if issubclass(v,float) else "TEXT" for v in list(ACSData.__annotations__.values())]
 
 
+# Schema 1 stores lists as JSON text and the raw frame as the str() of its bytes.
+# Schema 2 stores lists as little-endian BLOBs of the dtypes below and the raw frame as a BLOB.
+# The schema of a database is kept in PRAGMA user_version. Databases from before versioning read 0 and are schema 1.
+SCHEMA_VERSION = 2
+SCHEMA_VERSIONS = [1, 2]
+BLOB_DTYPES = {'c_reference': '<u2', 'a_reference': '<u2', 'c_signal': '<u2', 'a_signal': '<u2',
+               'a_uncorr': '<f4', 'c_uncorr': '<f4', 'a_m': '<f4', 'c_m': '<f4',
+               'flag_gross_range_test_a_m': '<i1', 'flag_gross_range_test_c_m': '<i1'}
+BYTES_FIELDS = ['frame']
+
+# Raw only logging stores just these acs_data fields. Every other field is left NULL and derived from the frame and
+# the calibration in acs_metadata when read. A partial index over the NULL rows finds them without a table scan.
+RAW_ONLY_FIELDS = ['time', 'frame']
+DERIVED_FIELDS = [field for field in ACSDataTable.fields if field not in RAW_ONLY_FIELDS]
+RAW_ONLY_INDEX = 'acs_data_raw_only'
+
+# Compressed logging stores acs_data and acs_flags rows in blocks, one block per table per flush.
+# See SoggyVision.compression.
+BLOCKS_TABLES = {ACSDataTable.name: 'acs_data_blocks', ACSFlagsTable.name: 'acs_flags_blocks'}
+
+
+def schema_dtypes(table, schema_version):
+    """
+    :param table: ACSDataTable, ACSFlagsTable or ACSMetadataTable.
+    :param schema_version: The schema version.
+    :return: The column types of the table in that schema.
+    """
+    if schema_version == 1 or table is ACSMetadataTable:
+        return table.dtypes
+    return ['BLOB' if field in BLOB_DTYPES or field in BYTES_FIELDS else dtype
+            for field, dtype in zip(table.fields, table.dtypes)]
+
+
+def format_time(t):
+    """
+    Format a time the way frame times are stored, so text comparisons against the time key order correctly.
+
+    :param t: A datetime, numpy datetime64 or ISO 8601 string.
+    :return: 'YYYY-MM-DD HH:MM:SS[.ffffff]'
+    """
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t)
+    elif isinstance(t, np.datetime64):
+        t = t.astype('datetime64[us]').item()
+    return str(t)
+
+
+def to_datetime64(t):
+    """Convert a time accepted by format_time to datetime64[ns]."""
+    return np.datetime64(format_time(t).replace(' ', 'T'), 'ns')
+
+
+EARLIEST = np.datetime64(np.iinfo(np.int64).min + 1, 'ns')  # Before every frame time. min itself is NaT.
+
+
+def concatenate_columns(columns):
+    """Join decoded columns (see SVDB.decode_column) from several queries."""
+    if isinstance(columns[0], list):  # Raw frames.
+        return [v for column in columns for v in column]
+    return np.concatenate(columns)
+
+
+def take_columns(columns, index):
+    """Select rows of decoded columns with an index array or slice."""
+    if isinstance(index, slice):
+        return {field: values[index] for field, values in columns.items()}
+    return {field: [values[i] for i in index] if isinstance(values, list) else values[index]
+            for field, values in columns.items()}
+
+
+def merge_columns(streams, batch_size):
+    """
+    Merge streams of decoded columns into batches in time order.
+
+    :param streams: Iterables of field: decoded column dicts that include time. Each stream is in time order.
+    :param batch_size: The number of rows per batch. Only the last batch may be shorter.
+    :return: A generator of field: decoded column dicts.
+    """
+    iterators = [iter(stream) for stream in streams]
+    heads = [None] * len(iterators)
+    pending = []
+    pending_rows = 0
+    while True:
+        for i in range(len(iterators)):
+            while heads[i] is None and iterators[i] is not None:
+                head = next(iterators[i], None)
+                if head is None:
+                    iterators[i] = None
+                elif len(head['time']) > 0:
+                    heads[i] = (head, np.asarray(head['time']).astype('datetime64[ns]'))
+        live = [i for i, head in enumerate(heads) if head is not None]
+        if len(live) == 0:
+            break
+        # No stream can still produce a row before the last time of its head, so every row up to the earliest of
+        # those times is final.
+        limit = min(heads[i][1][-1] for i in live)
+        parts = []
+        for i in live:
+            head, times = heads[i]
+            taken = int(np.searchsorted(times, limit, side = 'right'))
+            parts.append((take_columns(head, slice(0, taken)), times[:taken]))
+            heads[i] = None if taken == len(times) else (take_columns(head, slice(taken, None)), times[taken:])
+        parts = [part for part in parts if len(part[1]) > 0]
+        merged = {field: concatenate_columns([part[0][field] for part in parts]) for field in parts[0][0]}
+        if len(parts) > 1:
+            merged = take_columns(merged, np.argsort(np.concatenate([part[1] for part in parts]), kind = 'stable'))
+        pending.append(merged)
+        pending_rows += len(merged['time'])
+        if pending_rows >= batch_size:
+            columns = {field: concatenate_columns([part[field] for part in pending]) for field in pending[0]}
+            full = pending_rows - pending_rows % batch_size
+            for begin in range(0, full, batch_size):
+                yield take_columns(columns, slice(begin, begin + batch_size))
+            pending = [take_columns(columns, slice(full, None))] if full < pending_rows else []
+            pending_rows -= full
+    if pending_rows > 0:
+        yield {field: concatenate_columns([part[field] for part in pending]) for field in pending[0]}
+
+
+def encode_blob(values, field):
+    """Encode a list or array as a schema 2 BLOB."""
+    return np.asarray(values, dtype = BLOB_DTYPES[field]).tobytes()
+
+
+def decode_blob(blob, field):
+    """Decode a schema 2 BLOB without copying it. The array is read-only."""
+    return np.frombuffer(blob, dtype = BLOB_DTYPES[field])
+
+
 class SVDB():
-    def __init__(self,database_name):
-        os.makedirs(DB_DIR,exist_ok=True)
-        self.dbcon = sqlite3.connect(os.path.join(DB_DIR,f"{database_name}.db"))
+    SYNCHRONOUS = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+
+    def __init__(self,database_name, wal = False, synchronous = 'FULL', schema_version = SCHEMA_VERSION,
+                 filepath = None):
+        """
+        :param database_name: The name of the database in DB_DIR, without the .db extension.
+        :param wal: Use write-ahead logging. Commits append to the -wal file instead of rewriting pages, and readers
+            do not block the writer. The setting persists in the database file.
+        :param synchronous: The sqlite synchronous mode. With WAL, FULL syncs the log once per commit, so every
+            committed transaction survives a power failure. NORMAL only syncs at checkpoints, which is faster but
+            loses an unbounded number of recent commits on power failure.
+        :param schema_version: The schema of a new database. Existing databases keep the schema they were created with.
+        :param filepath: Open this existing database file instead of database_name in DB_DIR. See from_file.
+        """
+        if filepath is None:
+            os.makedirs(DB_DIR,exist_ok=True)
+            self.dbcon = sqlite3.connect(os.path.join(DB_DIR,f"{database_name}.db"))
+        elif os.path.isfile(filepath):
+            self.dbcon = sqlite3.connect(filepath)
+        else:  # Never create a database outside DB_DIR by accident.
+            raise FileNotFoundError(f'No database at {filepath}')
         self.dbcur = self.dbcon.cursor()
+        if wal:
+            if synchronous.upper() not in self.SYNCHRONOUS:
+                raise ValueError(f'Unknown synchronous mode: {synchronous}')
+            self.dbcur.execute("PRAGMA journal_mode=WAL")
+            self.dbcur.execute(f"PRAGMA synchronous={synchronous.upper()}")
 
-        self.build_table(ACSDataTable.name, ACSDataTable.fields, ACSDataTable.dtypes)
-        self.build_table(ACSFlagsTable.name, ACSFlagsTable.fields, ACSFlagsTable.dtypes)
+        self.schema_version = self.detect_schema_version(schema_version)
+        self.build_table(ACSDataTable.name, ACSDataTable.fields, schema_dtypes(ACSDataTable, self.schema_version))
+        self.build_table(ACSFlagsTable.name, ACSFlagsTable.fields, schema_dtypes(ACSFlagsTable, self.schema_version))
         self.build_metadata_table(ACSMetadataTable.name, ACSMetadataTable.fields, ACSMetadataTable.dtypes)
 
+    @classmethod
+    def from_file(cls, filepath, **kwargs):
+        """
+        Open an existing database anywhere on disk, e.g. one copied off a logger.
+
+        :param filepath: The .db file, absolute or relative to the working directory.
+        :param kwargs: See __init__.
+        :return: An SVDB. Raises FileNotFoundError if the file does not exist.
+        """
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        return cls(name, filepath = filepath, **kwargs)
+
+    def detect_schema_version(self, schema_version = SCHEMA_VERSION):
+        """
+        Read the schema version of the database, or set it if the database is new.
+
+        :param schema_version: The version given to a new database.
+        :return: The schema version of the database.
+        """
+        if schema_version not in SCHEMA_VERSIONS:
+            raise ValueError(f'Unknown schema version: {schema_version}')
+        version = self.dbcur.execute("PRAGMA user_version").fetchone()[0]
+        if version != 0:
+            return version
+        statement = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{ACSDataTable.name}'"
+        if self.dbcur.execute(statement).fetchone() is not None:
+            return 1
+        self.dbcur.execute(f"PRAGMA user_version={int(schema_version)}")
+        return schema_version
+
 
     def build_metadata_table(self, table_name, fields, dtypes):
         table_name = table_name.lower()
@@ -54,6 +243,20 @@ class SVDB():
         self.dbcur.execute(statement, data)
         self.dbcon.commit()
 
+    def insert_many(self, table_name, fields, rows, commit = True):
+        """
+        Insert many rows with a single executemany.
+
+        :param table_name: The table to insert into.
+        :param fields: The field names, in the order of the values in each row.
+        :param rows: A list of rows.
+        :param commit: Commit immediately. If False, the rows are part of the open transaction.
+        """
+        table_name = table_name.lower()
+        statement = f"INSERT INTO {table_name}({', '.join(fields)}) VALUES ({', '.join(['?' for i in range(len(fields))])})"
+        self.dbcur.executemany(statement, rows)
+        if commit:
+            self.dbcon.commit()
 
     def get_all_data(self, table_name):
         table_name = table_name.lower()
@@ -62,16 +265,564 @@ class SVDB():
         data = self.dbcur.fetchall()
         return data
 
-    def select_data(self, table_name, fields):
+    def select_data(self, table_name, fields, start = None, end = None):
+        """
+        Select fields from a table, optionally limited to start <= time < end.
+
+        :param table_name: The table to select from.
+        :param fields: The field names.
+        :param start: The first time to include, or None. See format_time for accepted types.
+        :param end: The time to stop before, or None.
+        :return: A list of rows, in time order when a range is given.
+        """
+        statement, parameters = self.__select_statement(table_name, fields, start, end)
+        self.dbcur.execute(statement, parameters)
+        data = self.dbcur.fetchall()
+        return data
+
+    def __select_statement(self, table_name, fields, start, end):
         table_name = table_name.lower()
         field_str = ', '.join(fields)
         statement = f"SELECT {field_str} FROM {table_name}"
-        self.dbcur.execute(statement)
-        data = self.dbcur.fetchall()
-        return data
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append('time >= ?')
+            parameters.append(format_time(start))
+        if end is not None:
+            conditions.append('time < ?')
+            parameters.append(format_time(end))
+        if len(conditions) > 0:  # The time primary key index serves both the range and the order.
+            statement += f" WHERE {' AND '.join(conditions)} ORDER BY time"
+        return statement, parameters
+
+    def iter_data(self, table_name, fields, start = None, end = None, batch_size = 1000):
+        """
+        Stream rows in fixed size batches, so memory use does not depend on the size of the table.
+        Uses its own cursor, so other queries can run between batches.
+
+        :param table_name: The table to select from.
+        :param fields: The field names.
+        :param start: The first time to include, or None.
+        :param end: The time to stop before, or None.
+        :param batch_size: The number of rows per batch.
+        :return: A generator of lists of at most batch_size rows, in time order.
+        """
+        statement, parameters = self.__select_statement(table_name, fields, start, end)
+        if 'ORDER BY' not in statement:
+            statement += ' ORDER BY time'
+        cursor = self.dbcon.cursor()
+        try:
+            cursor.execute(statement, parameters)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def time_range(self, table_name):
+        """
+        :param table_name: acs_data or acs_flags.
+        :return: The first and last stored times as strings, or (None, None) if the table is empty.
+        """
+        statement = f"SELECT MIN(time), MAX(time) FROM {table_name.lower()}"  # Both are index lookups.
+        first, last = self.dbcur.execute(statement).fetchone()
+        if self.has_blocks(table_name):
+            statement = f"SELECT MIN(begin_time), MAX(end_time) FROM {BLOCKS_TABLES[table_name.lower()]}"
+            block_first, block_last = self.dbcur.execute(statement).fetchone()
+            first = min([v for v in [first, block_first] if v is not None], default = None)
+            last = max([v for v in [last, block_last] if v is not None], default = None)
+        return first, last
+
+    def build_blocks_tables(self):
+        """Create the tables for compressed blocks of rows. Called when a compressed session starts."""
+        for blocks_table in BLOCKS_TABLES.values():
+            self.dbcur.execute(f"CREATE TABLE IF NOT EXISTS {blocks_table}(begin_time TEXT, end_time TEXT, "
+                               f"frames BIGINT, codec TEXT, block BLOB, PRIMARY KEY (begin_time))")
+        self.dbcon.commit()
+
+    def has_blocks(self, table_name):
+        """:return: True if compressed blocks of table_name rows may exist."""
+        if table_name.lower() not in BLOCKS_TABLES:
+            return False
+        statement = (f"SELECT name FROM sqlite_master WHERE type='table' "
+                     f"AND name='{BLOCKS_TABLES[table_name.lower()]}'")
+        return self.dbcur.execute(statement).fetchone() is not None
 
+    def insert_block(self, table_name, rows, fields, codec, commit = True):
+        """
+        Compress many ACSData or ACSFlags tuples into a single block row.
 
-    def update_end_time(self, table_name, begin_time, end_time):
+        :param table_name: acs_data or acs_flags.
+        :param rows: The tuples, in time order.
+        :param fields: The fields to store. Missing acs_data fields are derived on read, like raw only rows.
+        :param codec: See SoggyVision.compression.CODECS.
+        :param commit: Commit immediately. If False, the block is part of the open transaction.
+        """
+        arrays = {}
+        for field in fields:
+            values = [getattr(row, field) for row in rows]
+            if field == 'time':
+                arrays[field] = np.array(values, dtype = 'datetime64[ns]').view(np.int64)
+            elif field in BYTES_FIELDS:
+                frames = np.frombuffer(b''.join([bytes(v) for v in values]), dtype = np.uint8).reshape(len(rows), -1)
+                if frames.shape[1] % 2 == 0:  # Frames are big-endian uint16 words. Delta codecs work on their values.
+                    frames = frames.view('>u2').astype('<u2')
+                arrays[field] = frames
+            elif field in BLOB_DTYPES:
+                arrays[field] = np.asarray(values, dtype = BLOB_DTYPES[field])
+            else:
+                arrays[field] = np.asarray(values)
+        statement = (f"INSERT INTO {BLOCKS_TABLES[table_name.lower()]}(begin_time, end_time, frames, codec, block) "
+                     f"VALUES (?, ?, ?, ?, ?)")
+        self.dbcur.execute(statement, (format_time(rows[0].time), format_time(rows[-1].time), len(rows), codec,
+                                       pack_block(arrays, codec)))
+        if commit:
+            self.dbcon.commit()
+
+    def select_blocks(self, table_name, fields, start = None, end = None):
+        """
+        Decompress the blocks that overlap a time range.
+
+        :param table_name: acs_data or acs_flags.
+        :param fields: The field names.
+        :param start: The first time to include, or None.
+        :param end: The time to stop before, or None.
+        :return: A generator of field: decoded column dicts, one per block, in time order. See decode_column.
+        """
+        if not self.has_blocks(table_name):
+            return
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append('end_time >= ?')
+            parameters.append(format_time(start))
+        if end is not None:
+            conditions.append('begin_time < ?')
+            parameters.append(format_time(end))
+        statement = f"SELECT codec, block FROM {BLOCKS_TABLES[table_name.lower()]}"
+        if len(conditions) > 0:
+            statement += f" WHERE {' AND '.join(conditions)}"
+        cursor = self.dbcon.cursor()
+        try:
+            for codec, block in cursor.execute(statement + ' ORDER BY begin_time', parameters):
+                columns = self.__decode_block(unpack_block(block, codec), fields, start, end)
+                if len(columns['time']) > 0:
+                    yield {field: columns[field] for field in fields}
+        finally:
+            cursor.close()
+
+    def __decode_block(self, arrays, fields, start, end):
+        times = arrays['time'].view('datetime64[ns]')
+        keep = np.ones(len(times), dtype = bool)
+        if start is not None:
+            keep &= times >= to_datetime64(start)
+        if end is not None:
+            keep &= times < to_datetime64(end)
+        times = times[keep]
+        frames = arrays['frame'][keep] if 'frame' in arrays else None
+        if frames is not None and frames.dtype != np.uint8:
+            frames = frames.astype('>u2').view(np.uint8)
+        converted = None
+        times_text = np.char.replace(np.datetime_as_string(times, unit = 'us'), 'T', ' ')
+        columns = {'time': np.char.replace(times_text, '.000000', '')}  # Match format_time for whole seconds.
+        for field in fields:
+            if field == 'time':
+                continue
+            if field in BYTES_FIELDS:
+                columns[field] = [frame.tobytes() for frame in frames]
+            elif field in arrays:
+                columns[field] = arrays[field][keep]
+            else:  # Not stored in the block, derive it from the frames.
+                if converted is None:
+                    converted = self.convert_frames(times, frames, [f for f in fields if f not in arrays])
+                values = converted[field]
+                columns[field] = values.astype(BLOB_DTYPES[field]) if field in BLOB_DTYPES else values
+        return columns
+
+    def encode_row(self, table, row):
+        """
+        Encode an ACSData or ACSFlags tuple for insertion in the schema of this database.
+
+        :param table: ACSDataTable or ACSFlagsTable.
+        :param row: The tuple, in the order of table.fields.
+        :return: A list of values.
+        """
+        if self.schema_version == 1:
+            return [json.dumps(v) if isinstance(v, list) and table is ACSDataTable else float(v) if isinstance(v, float)
+                    else int(v) if isinstance(v, int) else str(v) for v in list(row)]
+        return [encode_blob(v, field) if field in BLOB_DTYPES else bytes(v) if field in BYTES_FIELDS
+                else float(v) if isinstance(v, float) else int(v) if isinstance(v, int) else str(v)
+                for field, v in zip(table.fields, row)]
+
+    def decode_column(self, field, values):
+        """
+        Decode the stored values of one column, whatever the schema of this database.
+
+        :param field: The field name.
+        :param values: The values as returned by sqlite.
+        :return: An (N, wavelengths) array for list fields, a list of bytes for frames, or an (N,) array otherwise.
+        """
+        if field in BLOB_DTYPES:
+            if len(values) == 0:
+                return np.empty((0, 0), dtype = BLOB_DTYPES[field])
+            if self.schema_version == 1:
+                return np.array([json.loads(v) for v in values], dtype = BLOB_DTYPES[field])
+            return decode_blob(b''.join(values), field).reshape(len(values), -1)
+        if field in BYTES_FIELDS:
+            if self.schema_version == 1:
+                return [ast.literal_eval(v) for v in values]  # The str() of the bytes.
+            return list(values)
+        return np.array(values)
+
+    def select_columns(self, table_name, fields, start = None, end = None):
+        """
+        Select fields from a table and decode them column by column.
+
+        :param table_name: The table to select from.
+        :param fields: The field names.
+        :param start: The first time to include, or None.
+        :param end: The time to stop before, or None.
+        :return: field: decoded column, see decode_column.
+        """
+        selected = self.__with_raw_only_fields(table_name, fields, start, end)
+        if self.has_blocks(table_name):
+            return self.__select_with_blocks(table_name, fields, selected, start, end)
+        rows = self.select_data(table_name, selected, start, end)
+        return self.__decode_rows(fields, selected, rows)
+
+    def __select_with_blocks(self, table_name, fields, selected, start, end):
+        """Merge rows and compressed blocks in time order."""
+        selected = selected if 'time' in selected else list(selected) + ['time']
+        with_time = list(fields) if 'time' in fields else list(fields) + ['time']
+        parts = [self.__decode_rows(with_time, selected, self.select_data(table_name, selected, start, end))]
+        parts += list(self.select_blocks(table_name, with_time, start, end))
+        parts = [part for part in parts if len(part['time']) > 0]
+        if len(parts) == 0:
+            return self.__decode_rows(fields, fields, [])
+        columns = {field: concatenate_columns([part[field] for part in parts]) for field in with_time}
+        if len(parts) > 1:
+            order = np.argsort(columns['time'].astype('datetime64[ns]'), kind = 'stable')
+            columns = take_columns(columns, order)
+        return {field: columns[field] for field in fields}
+
+    def iter_columns(self, table_name, fields, start = None, end = None, batch_size = 1000):
+        """
+        Stream decoded columns in fixed size batches, in time order. Rows and compressed blocks are merged.
+        See iter_data and decode_column.
+
+        :return: A generator of field: decoded column dicts.
+        """
+        selected = self.__with_raw_only_fields(table_name, fields, start, end)
+        if not self.has_blocks(table_name):
+            for rows in self.iter_data(table_name, selected, start, end, batch_size):
+                yield self.__decode_rows(fields, selected, rows)
+            return
+        selected = selected if 'time' in selected else list(selected) + ['time']
+        with_time = list(fields) if 'time' in fields else list(fields) + ['time']
+        rows = (self.__decode_rows(with_time, selected, batch)
+                for batch in self.iter_data(table_name, selected, start, end, batch_size))
+        for columns in merge_columns([rows, self.select_blocks(table_name, with_time, start, end)], batch_size):
+            yield {field: columns[field] for field in fields}
+
+    def __with_raw_only_fields(self, table_name, fields, start, end):
+        """Add time and frame to the selection if derived fields of raw only rows have to be computed."""
+        if table_name.lower() != ACSDataTable.name or not any(field in DERIVED_FIELDS for field in fields):
+            return fields
+        if not self.has_raw_only_rows(start, end):
+            return fields
+        return list(fields) + [field for field in RAW_ONLY_FIELDS if field not in fields]
+
+    def __decode_rows(self, fields, selected, rows):
+        columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(selected)
+        columns = dict(zip(selected, columns))
+        if 'frame' in columns and 'time' in columns and any(
+                field in DERIVED_FIELDS and None in columns[field] for field in fields):
+            columns = self.derive_columns(columns)
+            return {field: columns[field] for field in fields}
+        return {field: self.decode_column(field, columns[field]) for field in fields}
+
+    def get_metadata(self):
+        """
+        :return: Every metadata entry as an ACSMetadata field: value dict, with list fields decoded.
+        """
+        entries = []
+        for row in self.get_all_data(ACSMetadataTable.name):
+            entry = dict(zip(ACSMetadataTable.fields, row))
+            for field, dtype in ACSMetadata.__annotations__.items():
+                if dtype is list and isinstance(entry[field], str):
+                    entry[field] = json.loads(entry[field])
+            entries.append(entry)
+        return entries
+
+    def calibrations(self):
+        """
+        The calibration of every logging session in this database, rebuilt from its metadata entry.
+
+        :return: (begin_times, calibrations), with begin_times a datetime64[ns] array, both in time order.
+        """
+        entries = self.dbcur.execute(f"SELECT COUNT(*) FROM {ACSMetadataTable.name}").fetchone()[0]
+        if getattr(self, '_calibrations', None) is None or len(self._calibrations[1]) != entries:  # A new session.
+            metadata = self.get_metadata()
+            begin_times = np.array([EARLIEST if entry['begin_time'] is None else to_datetime64(entry['begin_time'])
+                                    for entry in metadata], dtype = 'datetime64[ns]')  # None applies from the start.
+            order = np.argsort(begin_times, kind = 'stable')
+            self._calibrations = (begin_times[order], [ACS.from_metadata(metadata[i]) for i in order])
+        return self._calibrations
+
+    def convert_frames(self, times, frames, fields):
+        """
+        Convert raw frames, each with the calibration of the session it was logged in. That is the latest session
+        that began at or before the frame, or the first session for frames before every session.
+
+        :param times: The frame times as a datetime64[ns] array.
+        :param frames: A list of frames or an (N, packet_length) uint8 array.
+        :param fields: ACSData fields to return.
+        :return: field: (N, ...) array.
+        """
+        begin_times, calibrations = self.calibrations()
+        sessions = np.maximum(np.searchsorted(begin_times, times, side = 'right') - 1, 0)
+        if len(sessions) == 0 or np.all(sessions == sessions[0]):
+            block = calibrations[sessions[0] if len(sessions) > 0 else 0].get_data_block(times, frames)
+            return {field: getattr(block.raw, field) if field in ACSRawFrames._fields else getattr(block, field)
+                    for field in fields}
+        converted = {}
+        for session in np.unique(sessions):
+            rows = np.flatnonzero(sessions == session)
+            selected = frames[rows] if isinstance(frames, np.ndarray) else [frames[i] for i in rows]
+            block = calibrations[session].get_data_block(times[rows], selected)
+            for field in fields:
+                values = getattr(block.raw, field) if field in ACSRawFrames._fields else getattr(block, field)
+                if field not in converted:
+                    converted[field] = np.empty((len(times),) + values.shape[1:], dtype = values.dtype)
+                elif converted[field].shape[1:] != values.shape[1:]:
+                    raise ValueError('The sessions in this database have different wavelengths. Read them one '
+                                     'session at a time.')
+                converted[field][rows] = values
+        return converted
+
+    def build_raw_only_index(self):
+        """Index the rows written by raw only logging. Called when a raw only session starts."""
+        self.dbcur.execute(f"CREATE INDEX IF NOT EXISTS {RAW_ONLY_INDEX} ON {ACSDataTable.name}(time) "
+                           f"WHERE a_m IS NULL")
+        self.dbcon.commit()
+
+    def has_raw_only_rows(self, start = None, end = None):
+        """
+        :param start: The first time to check, or None.
+        :param end: The time to stop before, or None.
+        :return: True if raw only rows, whose derived fields are NULL, exist in the range.
+        """
+        statement = f"SELECT name FROM sqlite_master WHERE type='index' AND name='{RAW_ONLY_INDEX}'"
+        if self.dbcur.execute(statement).fetchone() is None:  # Raw only logging never wrote to this database.
+            return False
+        conditions = ['a_m IS NULL']
+        parameters = []
+        if start is not None:
+            conditions.append('time >= ?')
+            parameters.append(format_time(start))
+        if end is not None:
+            conditions.append('time < ?')
+            parameters.append(format_time(end))
+        statement = (f"SELECT EXISTS(SELECT 1 FROM {ACSDataTable.name} INDEXED BY {RAW_ONLY_INDEX} "
+                     f"WHERE {' AND '.join(conditions)})")
+        return bool(self.dbcur.execute(statement, parameters).fetchone()[0])
+
+    def derive_columns(self, columns):
+        """
+        Fill the NULL derived fields of raw only rows, converting their frames in one vectorized block.
+
+        :param columns: field: undecoded column, including time and frame.
+        :return: field: decoded column for every field.
+        """
+        frames = self.decode_column('frame', columns['frame'])
+        derived = [field for field in columns if field in DERIVED_FIELDS]
+        probe = columns[derived[0]]
+        raw_only = np.array([v is None for v in probe], dtype = bool)
+        times = np.array([np.datetime64(datetime.fromisoformat(t), 'ns') for t in np.array(columns['time'])[raw_only]])
+        converted = self.convert_frames(times, [frame for frame, r in zip(frames, raw_only) if r], derived)
+        decoded = {}
+        for field, values in columns.items():
+            if field not in derived:
+                decoded[field] = frames if field == 'frame' else self.decode_column(field, values)
+                continue
+            values_derived = converted[field]
+            stored = self.decode_column(field, [v for v, r in zip(values, raw_only) if not r])
+            dtype = BLOB_DTYPES.get(field, np.result_type(values_derived.dtype, stored.dtype))
+            result = np.empty((len(raw_only),) + values_derived.shape[1:], dtype = dtype)
+            result[raw_only] = values_derived
+            if len(stored) > 0:
+                result[~raw_only] = stored
+            decoded[field] = result
+        return decoded
+
+    def update_end_time(self, table_name, begin_time, end_time, commit = True):
         statement = f"UPDATE {table_name} SET end_time='{end_time}' WHERE begin_time='{begin_time}'"
         self.dbcur.execute(statement)
-        self.dbcon.commit()
+        if commit:
+            self.dbcon.commit()
+
+
+class SVDBWriter():
+    """
+    Group commit ACS data and flags rows into a SoggyVision database.
+
+    Rows are buffered and written with executemany in one transaction per flush, which also updates the metadata
+    end_time. A flush happens once flush_rows rows are buffered or the oldest buffered row is flush_interval seconds
+    old, so with WAL and synchronous FULL a power failure loses at most flush_interval seconds of data (plus whatever
+    is still queued upstream). Call flush_if_due() periodically when no rows arrive, and close() when done.
+    """
+
+    def __init__(self, db: SVDB, begin_time, flush_rows: int = 500, flush_interval: float = 1.0,
+                 raw_only: bool = False, codec: str = None) -> None:
+        """
+        :param db: An open database. Use wal = True for group commits to pay off.
+        :param begin_time: The begin_time of the metadata entry whose end_time is kept up to date.
+        :param flush_rows: Flush once this many rows are buffered.
+        :param flush_interval: Flush once the oldest buffered row is this many seconds old.
+        :param raw_only: Only store the time and raw frame of each frame in acs_data. See RAW_ONLY_FIELDS.
+        :param codec: If given, compress the rows of each flush into one block per table. See SoggyVision.compression.
+        """
+
+        self.db = db
+        self.begin_time = begin_time
+        self.flush_rows = int(flush_rows)
+        self.flush_interval = float(flush_interval)
+        self.raw_only = raw_only
+        self.codec = codec
+        self._data_fields = RAW_ONLY_FIELDS if raw_only else ACSDataTable.fields
+        if codec is not None:
+            self.db.build_blocks_tables()
+        elif raw_only:
+            self.db.build_raw_only_index()
+        self._data = []
+        self._flags = []
+        self._end_time = None
+        self._first_buffered = None
+        self.flushes = 0
+        self.dropped_rows = 0  # Rows dropped because their time was already stored.
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def add(self, data: ACSData, flags: ACSFlags, end_time) -> None:
+        """
+        Encode and buffer one frame.
+
+        :param data: The converted frame.
+        :param flags: The flags of the frame.
+        :param end_time: The time of the frame, written to the metadata end_time at the next flush.
+        """
+
+        if self._first_buffered is None:
+            self._first_buffered = time.monotonic()
+        if self.codec is not None:
+            self._data.append(data)  # Packed into a block at the next flush.
+        elif self.raw_only:
+            self._data.append([str(data.time), bytes(data.frame)] if self.db.schema_version != 1 else
+                              [str(data.time), str(bytes(data.frame))])
+        else:
+            self._data.append(self.db.encode_row(ACSDataTable, data))
+        self._flags.append(flags if self.codec is not None else self.db.encode_row(ACSFlagsTable, flags))
+        self._end_time = end_time
+        if len(self._data) >= self.flush_rows:
+            self.flush()
+
+    def flush_if_due(self) -> bool:
+        """Flush if the oldest buffered row has waited flush_interval seconds. :return: True if flushed."""
+
+        if self._first_buffered is not None and time.monotonic() - self._first_buffered >= self.flush_interval:
+            self.flush()
+            return True
+        return False
+
+    def flush(self) -> None:
+        """Write every buffered row and the end_time in a single transaction."""
+
+        if len(self._data) == 0:
+            return
+        try:
+            self.__drop_stored_times()
+            try:
+                if len(self._data) > 0:
+                    self.__insert(self._data, self._flags)
+            except sqlite3.IntegrityError:  # e.g. a repeated frame time. Only drop the rows that collide.
+                self.db.dbcon.rollback()
+                self.__insert_skipping_duplicates()
+            self.db.update_end_time(ACSMetadataTable.name, self.begin_time, self._end_time, commit = False)
+            self.db.dbcon.commit()
+        except sqlite3.Error:
+            self.db.dbcon.rollback()
+            raise
+        finally:  # Rows that failed are not retried, so one bad row cannot block the rest of the session.
+            self._data = []
+            self._flags = []
+            self._first_buffered = None
+        self.flushes += 1
+
+    def __drop_stored_times(self):
+        """
+        Drop buffered rows whose time repeats in the buffer or is already stored, as a row or inside the time range
+        of a block, so the database keeps one row per time in either storage mode. The primary key only covers rows,
+        and a block is keyed by its first time.
+        """
+        times = [format_time(row.time) if self.codec is not None else row[0] for row in self._data]  # As stored.
+        first, last = min(times), max(times)
+        statement = f"SELECT time FROM {ACSDataTable.name} WHERE time >= ? AND time <= ?"
+        stored = set(row[0] for row in self.db.dbcur.execute(statement, (first, last)))
+        blocks = []
+        if self.db.has_blocks(ACSDataTable.name):
+            statement = (f"SELECT begin_time, end_time FROM {BLOCKS_TABLES[ACSDataTable.name]} "
+                         f"WHERE end_time >= ? AND begin_time <= ?")
+            blocks = self.db.dbcur.execute(statement, (first, last)).fetchall()
+        keep = []
+        for i, t in enumerate(times):
+            if t not in stored and not any(begin <= t <= end for begin, end in blocks):
+                keep.append(i)
+                stored.add(t)
+        if len(keep) < len(times):
+            self.dropped_rows += len(times) - len(keep)
+            self._data = [self._data[i] for i in keep]
+            self._flags = [self._flags[i] for i in keep]
+
+    def __insert(self, data, flags):
+        if self.codec is not None:
+            self.db.insert_block(ACSDataTable.name, data, self._data_fields, self.codec, commit = False)
+            self.db.insert_block(ACSFlagsTable.name, flags, ACSFlagsTable.fields, self.codec, commit = False)
+        else:
+            self.db.insert_many(ACSDataTable.name, self._data_fields, data, commit = False)
+            self.db.insert_many(ACSFlagsTable.name, ACSFlagsTable.fields, flags, commit = False)
+
+    def __insert_skipping_duplicates(self):
+        """
+        Insert the buffered rows in one transaction, dropping those that violate a primary key.
+        Rows are inserted one at a time, each data and flags pair under a savepoint so a pair is kept or dropped whole.
+        Blocks are keyed by their first time, so leading rows are dropped until the rest of the block fits.
+        """
+        self.db.dbcur.execute("BEGIN")
+        if self.codec is not None:
+            pairs = [(self._data[i:], self._flags[i:]) for i in range(len(self._data))]
+        else:
+            pairs = [([data], [flags]) for data, flags in zip(self._data, self._flags)]
+        for data, flags in pairs:
+            self.db.dbcur.execute("SAVEPOINT flush_rows")
+            try:
+                self.__insert(data, flags)
+            except sqlite3.IntegrityError:
+                self.db.dbcur.execute("ROLLBACK TO flush_rows")
+                self.dropped_rows += 1
+                continue
+            finally:
+                self.db.dbcur.execute("RELEASE flush_rows")
+            if self.codec is not None:  # The block holds every remaining row.
+                break
+
+    def close(self) -> None:
+        """Flush and close the database."""
+
+        try:
+            self.flush()
+        finally:
+            self.db.dbcon.close()
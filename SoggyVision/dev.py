@@ -1,10 +1,42 @@
 from datetime import datetime
+import glob
+import hashlib
+import io
+import json
 import numpy as np
 import re
-from scipy import interpolate
 from struct import calcsize
-import xarray as xr
 import os
+import tempfile
+
+from SoggyVision.core import CAL_DIR, CAL_CACHE_DIR
+
+
+PACKET_HEADER_FIELDS = ['frame_length', 'frame_type', 'reserved_1', 'serial_number_hexdec', 'a_reference_dark',
+                        'pressure_signal', 'a_signal_dark', 't_external', 't_internal', 'c_reference_dark',
+                        'c_signal_dark', 'elapsed_time', 'reserved_2', 'number_of_wavelengths']
+STRUCT_TO_DTYPE = {'B': 'u1', 'H': 'u2', 'l': 'i4', 'I': 'u4'}  # Standard sizes for network byte order.
+
+# The delta T lookup table resolution for live conversion, in degrees C. The tables match interp1d to within about
+# 3e-4 1/m, well below the instrument resolution, and take a few MB per instrument.
+LIVE_LUT_STEP = 0.01
+
+CACHE_VERSION = 1  # Increment when the parse or the cache layout changes.
+CACHE_METADATA = ['sensor_type', 'sn_hexdec', 'sn', 'structure_version', 'tcal', 'ical', 'cal_date',
+                  'depth_cal_1', 'depth_cal_2', 'baudrate', 'path_length', 'output_wavelengths', 'num_tbins',
+                  'max_a_noise', 'max_c_noise', 'max_a_nonconform', 'max_c_nonconform', 'max_a_difference',
+                  'max_c_difference', 'min_a_counts', 'min_c_counts', 'min_r_counts', 'max_tempsdev',
+                  'max_depth_sdev']
+CACHE_ARRAYS = ['tbins', 'wavelength_c', 'wavelength_a', 'offset_c', 'offset_a', 'delta_t_c', 'delta_t_a']
+
+# Attribute: ACSMetadata field, for rebuilding a calibration from a database metadata entry.
+METADATA_ATTRIBUTES = {'filepath': 'calibration_filepath', 'sensor_type': 'sensor_type', 'sn': 'serial_number',
+                       'sn_hexdec': 'serial_number_hexdec', 'cal_date': 'factory_calibration_date',
+                       'structure_version': 'structure_version', 'baudrate': 'baudrate', 'path_length': 'path_length',
+                       'tcal': 'tcal', 'ical': 'ical', 'output_wavelengths': 'number_of_wavelengths',
+                       'num_tbins': 'number_of_temperature_bins'}
+METADATA_ARRAYS = {'tbins': 'temperature_bins', 'wavelength_c': 'wavelengths_c', 'wavelength_a': 'wavelengths_a',
+                   'offset_c': 'offsets_c', 'offset_a': 'offsets_a', 'delta_t_c': 'delta_t_c', 'delta_t_a': 'delta_t_a'}
 
 
 class Dev():
@@ -17,25 +49,115 @@ class Dev():
     operations based in xarray. The to_nc() function will export calibration data as a netcdf.
     """
 
-    def __init__(self, filepath: os.path.abspath) -> None:
+    def __init__(self, filepath: os.path.abspath, lut_step: float = None, cache: bool = True) -> None:
         """
         Parse the .dev file.
 
         :param filepath: The location of the dev file.
+        :param lut_step: If given, build temperature correction lookup tables at this resolution (degrees C).
+        :param cache: Load the compiled calibration from CAL_CACHE_DIR when available, and write it after parsing.
         """
         self.filepath = os.path.normpath(filepath)
         self.__read_dev()
-        self.__parse_metadata()
-        self.__parse_tbins()
-        self.__parse_offsets()
-        self.__check_parse()
+        if not (cache and self.__load_cache()):
+            self.__parse_metadata()
+            self.__parse_tbins()
+            self.__parse_offsets()
+            self.__check_parse()
+            if cache:
+                self.__save_cache()
+        self._f_delta_t_a = None  # Built on first use, see f_delta_t_a and f_delta_t_c.
+        self._f_delta_t_c = None
         self.__build_packet_header()
 
+        self.delta_t_a_lut = None
+        self.delta_t_c_lut = None
+        if lut_step is not None:
+            self.build_delta_t_lut(lut_step)
+
+    @classmethod
+    def from_metadata(cls, metadata: dict, lut_step: float = None) -> 'Dev':
+        """
+        Rebuild a calibration from a database metadata entry, without the .dev file.
+        The entry holds everything needed to convert frames, see ACS.get_metadata.
+
+        :param metadata: ACSMetadata field: value, with list fields already decoded.
+        :param lut_step: See __init__.
+        :return: An instance of cls.
+        """
+
+        dev = cls.__new__(cls)
+        dev.digest = None
+        for name, field in METADATA_ATTRIBUTES.items():
+            setattr(dev, name, metadata[field])
+        for name, field in METADATA_ARRAYS.items():
+            setattr(dev, name, np.array(metadata[field], dtype = np.float64))
+        dev.__check_parse()
+        dev._f_delta_t_a = None
+        dev._f_delta_t_c = None
+        dev.__build_packet_header()
+        dev.delta_t_a_lut = None
+        dev.delta_t_c_lut = None
+        if lut_step is not None:
+            dev.build_delta_t_lut(lut_step)
+        return dev
+
     def __read_dev(self) -> None:
-        """Import the .dev file as a text file."""
+        """Import the .dev file as a text file and hash its contents."""
 
-        with open(self.filepath, 'r') as _file:
-            self._lines = _file.readlines()
+        with open(self.filepath, 'rb') as _file:
+            content = _file.read()
+        self.digest = hashlib.sha256(content).hexdigest()
+        self._lines = io.TextIOWrapper(io.BytesIO(content)).readlines()
+
+    def __cache_filepath(self) -> os.path.abspath:
+        return os.path.join(CAL_CACHE_DIR, f"{self.digest}.npz")
+
+    def __load_cache(self) -> bool:
+        """
+        Load the compiled calibration for this file content.
+
+        :return: True if a valid cache was loaded.
+        """
+
+        try:
+            with np.load(self.__cache_filepath()) as cached:
+                metadata = json.loads(str(cached['metadata']))
+                if metadata.pop('cache_version') != CACHE_VERSION:
+                    return False
+                arrays = {name: cached[name] for name in CACHE_ARRAYS}
+        except FileNotFoundError:
+            return False
+        except Exception:  # A corrupt cache (BadZipFile, truncated arrays, ...) is a miss. Remove it so it is rebuilt.
+            try:
+                os.remove(self.__cache_filepath())
+            except OSError:
+                pass
+            return False
+        for name, value in metadata.items():
+            setattr(self, name, value)
+        for name, value in arrays.items():
+            setattr(self, name, value)
+        return True
+
+    def __save_cache(self) -> None:
+        """Write the compiled calibration to CAL_CACHE_DIR. Failures are ignored; the cache is only an optimization."""
+
+        metadata = {name: getattr(self, name) for name in CACHE_METADATA if hasattr(self, name)}
+        metadata['cache_version'] = CACHE_VERSION
+        arrays = {name: getattr(self, name) for name in CACHE_ARRAYS}
+        filepath = self.__cache_filepath()
+        tmp_filepath = None
+        try:
+            os.makedirs(CAL_CACHE_DIR, exist_ok=True)
+            # A temporary file of its own, so processes that build the same calibration at once never mix writes.
+            fd, tmp_filepath = tempfile.mkstemp(suffix='.tmp', dir=CAL_CACHE_DIR)
+            with os.fdopen(fd, 'wb') as _file:
+                np.savez(_file, metadata=np.array(json.dumps(metadata)), **arrays)
+            os.replace(tmp_filepath, filepath)
+        except OSError:
+            if tmp_filepath is not None and os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
 
     def __parse_metadata(self) -> None:
         """Parse the .dev file for sensor metadata."""
@@ -114,12 +236,29 @@ class Dev():
         self.offset_a = np.array(a_offsets)
         self.delta_t_c = np.array(c_deltas)
         self.delta_t_a = np.array(a_deltas)
-        self.f_delta_t_c = interpolate.interp1d(self.tbins, self.delta_t_c, axis=1, assume_sorted=True, copy=False,
-                                                bounds_error=False,
-                                                fill_value=(self.delta_t_c[:, 1], self.delta_t_c[:, -1]))
-        self.f_delta_t_a = interpolate.interp1d(self.tbins, self.delta_t_a, axis=1, assume_sorted=True, copy=False,
-                                                bounds_error=False,
-                                                fill_value=(self.delta_t_a[:, 1], self.delta_t_a[:, -1]))
+
+    def __build_interpolators(self) -> None:
+        """Build temperature correction interpolators from the delta T tables. scipy is only imported here."""
+
+        from scipy import interpolate
+        self._f_delta_t_c = interpolate.interp1d(self.tbins, self.delta_t_c, axis=1, assume_sorted=True, copy=False,
+                                                 bounds_error=False,
+                                                 fill_value=(self.delta_t_c[:, 1], self.delta_t_c[:, -1]))
+        self._f_delta_t_a = interpolate.interp1d(self.tbins, self.delta_t_a, axis=1, assume_sorted=True, copy=False,
+                                                 bounds_error=False,
+                                                 fill_value=(self.delta_t_a[:, 1], self.delta_t_a[:, -1]))
+
+    @property
+    def f_delta_t_a(self):
+        if self._f_delta_t_a is None:
+            self.__build_interpolators()
+        return self._f_delta_t_a
+
+    @property
+    def f_delta_t_c(self):
+        if self._f_delta_t_c is None:
+            self.__build_interpolators()
+        return self._f_delta_t_c
 
     def __build_packet_header(self) -> None:
         """
@@ -136,6 +275,21 @@ class Dev():
         for i in range(self.output_wavelengths):
             self.packet_header += 'HHHH'
         self.packet_length = self.LEN_PACKET_REGISTRATION + calcsize(self.packet_header)
+        self.__build_packet_dtype()
+
+    def __build_packet_dtype(self) -> None:
+        """
+        Build a big-endian numpy structured dtype that mirrors the packet header.
+        Used for decoding many frames at once with np.frombuffer.
+        """
+
+        header_codes = self.PACKET_HEADER.lstrip('!')
+        fields = [('packet_registration', f'V{self.LEN_PACKET_REGISTRATION}')]
+        fields += [(name, '>' + STRUCT_TO_DTYPE[code]) for name, code in zip(PACKET_HEADER_FIELDS, header_codes)]
+        fields += [('spectra', '>u2', (self.output_wavelengths, 4))]  # c_reference, a_reference, c_signal, a_signal
+        self.packet_dtype = np.dtype(fields)
+        if self.packet_dtype.itemsize != self.packet_length:
+            raise ValueError('Mismatch between packet dtype size and packet length.')
 
     def __check_parse(self) -> None:
         """Verify that the parse obtained the correct informatoin."""
@@ -147,13 +301,67 @@ class Dev():
         if self.delta_t_a.shape != (len(self.wavelength_a), self.num_tbins):
             raise ValueError('Mismatch between length of A wavelengths and number of temperature bins.')
 
-    def to_ds(self) -> xr.Dataset:
+    def build_delta_t_lut(self, step: float = 0.001) -> None:
+        """
+        Precompute dense temperature correction lookup tables across the temperature bins.
+        Nearest-step lookups match the interp1d results to within self.delta_t_lut_tolerance (1/m), which is
+        half a step times the steepest delta T slope plus float32 rounding.
+
+        :param step: The temperature resolution of the tables in degrees Celsius.
+        """
+
+        self.lut_step = float(step)
+        self.lut_tmin = float(self.tbins.min())
+        n = int(np.ceil((float(self.tbins.max()) - self.lut_tmin) / self.lut_step)) + 1
+        grid = self.lut_tmin + self.lut_step * np.arange(n)
+
+        # The extra last row holds the fill value used below the lowest temperature bin.
+        self.delta_t_a_lut = np.vstack([self.f_delta_t_a(grid).T, self.delta_t_a[:, 1]]).astype(np.float32)
+        self.delta_t_c_lut = np.vstack([self.f_delta_t_c(grid).T, self.delta_t_c[:, 1]]).astype(np.float32)
+
+        tolerance = 0
+        for delta_t in [self.delta_t_a, self.delta_t_c]:
+            max_slope = np.abs(np.diff(delta_t, axis=1) / np.diff(self.tbins)).max()
+            rounding = np.abs(delta_t).max() * np.finfo(np.float32).eps
+            tolerance = max(tolerance, 0.5 * self.lut_step * max_slope + rounding)
+        self.delta_t_lut_tolerance = float(tolerance)
+
+    def get_delta_t(self, channel: str, internal_temperature) -> np.ndarray:
+        """
+        Get the temperature correction for a channel.
+
+        :param channel: 'a' or 'c'
+        :param internal_temperature: A single temperature or a vector of N temperatures.
+        :return: (wavelengths,) for a single temperature, (N, wavelengths) for a vector.
+        """
+
+        if channel.lower() == 'a':
+            lut, f_delta_t = self.delta_t_a_lut, self.f_delta_t_a
+        elif channel.lower() == 'c':
+            lut, f_delta_t = self.delta_t_c_lut, self.f_delta_t_c
+        else:
+            raise ValueError(f'Unknown channel: {channel}')
+
+        if lut is None:
+            return f_delta_t(internal_temperature).T
+        internal_temperature = np.asarray(internal_temperature, dtype=np.float64)
+        below = len(lut) - 1
+        idx = np.rint((internal_temperature - self.lut_tmin) / self.lut_step)
+        missing = np.isnan(internal_temperature)  # e.g. from an out of range thermistor count.
+        idx = np.where(internal_temperature < self.lut_tmin, below, np.clip(idx, 0, below - 1))
+        delta_t = lut[np.where(missing, below, idx).astype(np.int64)]
+        if missing.any():  # NaN rows, like the interpolator. +-inf already clip to the edge rows, like its fill.
+            delta_t = np.where(missing[..., None], np.nan, delta_t).astype(lut.dtype)
+        return delta_t
+
+    def to_ds(self) -> 'xr.Dataset':
         """
         Export class attributes as an xr.Dataset.
 
         :return: An xarray dataset containing calibration information.
         """
 
+        import xarray as xr
         ds = xr.Dataset()
         ds = ds.assign_coords({'wavelength_a': self.wavelength_a})
         ds = ds.assign_coords({'wavelength_c': self.wavelength_c})
@@ -188,4 +396,66 @@ class Dev():
         if split[-1] != '.nc':
             out_filepath += '.nc'
         ds = self.to_ds()
-        ds.to_netcdf(out_filepath, engine='netcdf4')
\ No newline at end of file
+        ds.to_netcdf(out_filepath, engine='netcdf4')
+
+
+class DevRegistry():
+    """
+    Index the calibration files in a directory by serial_number_hexdec.
+    Parsing goes through the compiled calibration cache, so indexing is fast after the first run.
+    """
+
+    def __init__(self, directory: os.path.abspath = CAL_DIR) -> None:
+        self.directory = os.path.normpath(directory)
+        self.refresh()
+
+    @staticmethod
+    def normalize_serial_number(serial_number_hexdec) -> int:
+        """
+        :param serial_number_hexdec: The hexdec serial number as in the .dev file ('0x53000123'),
+            or the integer read from a frame.
+        :return: The serial number as an integer.
+        """
+
+        if isinstance(serial_number_hexdec, str):
+            return int(serial_number_hexdec, 16)
+        return int(serial_number_hexdec) & 0xFFFFFFFF  # Frames carry it as a signed 32-bit integer.
+
+    def refresh(self) -> None:
+        """Rescan the directory for .dev files."""
+
+        self._index = {}
+        for filepath in sorted(glob.glob(os.path.join(self.directory, '*.dev'))):
+            try:
+                dev = Dev(filepath)
+            except (ValueError, IndexError, AttributeError):  # Not a parsable calibration file.
+                continue
+            key = self.normalize_serial_number(dev.sn_hexdec)
+            self._index.setdefault(key, []).append((dev.cal_date, dev.filepath))
+        for calibrations in self._index.values():
+            calibrations.sort()
+
+    def __contains__(self, serial_number_hexdec) -> bool:
+        return self.normalize_serial_number(serial_number_hexdec) in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def serial_numbers(self) -> list:
+        """:return: The hexdec serial numbers with at least one calibration."""
+        return [f"0x{key:08X}" for key in sorted(self._index)]
+
+    def filepaths(self, serial_number_hexdec) -> list:
+        """
+        :param serial_number_hexdec: The serial number of the instrument.
+        :return: Calibration filepaths for the instrument, oldest factory calibration first.
+        """
+        return [filepath for _, filepath in self._index.get(self.normalize_serial_number(serial_number_hexdec), [])]
+
+    def latest(self, serial_number_hexdec) -> os.path.abspath:
+        """
+        :param serial_number_hexdec: The serial number of the instrument.
+        :return: The filepath of the most recent factory calibration, or None.
+        """
+        filepaths = self.filepaths(serial_number_hexdec)
+        return filepaths[-1] if filepaths else None
@@ -3,16 +3,24 @@ import json
 import xarray as xr
 import os
 import yaml
-import matplotlib.pyplot as plt
 
-from SoggyVision.database import SVDB, ACSDataTable, ACSMetadataTable, ACSFlagsTable
+from SoggyVision.database import ACSDataTable, ACSMetadataTable, ACSFlagsTable
+from SoggyVision.partitions import open_database
 from SoggyVision.core import APP_NAME, EXPORT_DIR
+from SoggyVision.netcdf import copy_netcdf, netcdf_path
 from SoggyVision.acs import ACS
 
 
 class DBLoader():
-    def __init__(self, dbname):
-        self.db = SVDB(dbname)
+    def __init__(self, dbname, start = None, end = None):
+        """
+        :param dbname: The name of a database, or of a partitioned dataset.
+        :param start: Only load frames from this time on, or None. See SoggyVision.database.format_time.
+        :param end: Only load frames before this time, or None.
+        """
+        self.db = open_database(dbname, start, end)  # Only the partitions that overlap start and end are opened.
+        self.start = start
+        self.end = end
         self.metadata = self.load_metadata()
 
         with open('C:/Users/Ian/projects/SoggyVision/SoggyVision/attributes.yaml', 'r') as f:
@@ -68,15 +76,7 @@ class DBLoader():
     def build_flag_dataset(self):
         table = ACSFlagsTable.name
         fields = ACSFlagsTable.fields
-        d = np.array(self.db.get_all_data(table))
-        data = {}
-        for field in fields:
-            idx = fields.index(field)
-            data[field] = d[:, idx]
-
-        for k, d in data.items():
-            if k in ['flag_gross_range_test_a_m', 'flag_gross_range_test_c_m']:
-                data[k] = [json.loads(v.item()) for v in d]
+        data = self.db.select_columns(table, fields, self.start, self.end)  # Decodes either schema.
         for coord in ['time']:
             data[coord] = data[coord].astype('datetime64[ns]')
         for var in ['flag_syntax_test', 'flag_gap_test', 'flag_elapsed_time', 'flag_outside_temperature_calibration']:
@@ -122,15 +122,7 @@ class DBLoader():
         fields = ['time', 'a_m', 'a_uncorr', 'c_m', 'c_uncorr', 'internal_temperature', 'external_temperature']
 
         table = ACSDataTable.name
-        d = np.array(self.db.select_data(table, fields))
-
-        data = {}
-        for field in fields:
-            idx = fields.index(field)
-            data[field] = d[:, idx]
-        for k, d in data.items():
-            if k in ['a_m', 'a_uncorr', 'c_m', 'c_uncorr']:
-                data[k] = [json.loads(v.item()) for v in d]
+        data = self.db.select_columns(table, fields, self.start, self.end)  # Decodes either schema.
         for coord in ['time']:
             data[coord] = data[coord].astype('datetime64[ns]')
         for var in ['internal_temperature', 'external_temperature']:
@@ -176,15 +168,7 @@ class DBLoader():
                   'a_reference', 'c_signal', 'a_signal']
 
         table = ACSDataTable.name
-        d = np.array(self.db.select_data(table, fields))
-
-        data = {}
-        for field in fields:
-            idx = fields.index(field)
-            data[field] = d[:, idx]
-        for k, d in data.items():
-            if k in ['c_reference', 'a_reference', 'c_signal', 'a_signal']:
-                data[k] = [json.loads(v.item()) for v in d]
+        data = self.db.select_columns(table, fields, self.start, self.end)  # Decodes either schema.
         for coord in ['time']:
             data[coord] = data[coord].astype('datetime64[ns]')
         for var in ['pressure_signal', 'frame_length', 'frame_type', 'a_reference_dark', 'a_signal_dark', 't_external',
@@ -241,6 +225,11 @@ def export_netcdf(dbname, output_filename,attrs, progress):
     encoding = {'time': {'units': 'nanoseconds since 1900-01-01'}}
     engine = 'netcdf4'
     output = os.path.join(EXPORT_DIR,output_filename)
+    if os.path.isfile(netcdf_path(dbname)):  # Logged by the netcdf backend, which is already in this layout.
+        progress.setValue(10)
+        copy_netcdf(dbname, output, attrs)
+        progress.setValue(100)
+        return True
     dbl = DBLoader(dbname)
     mds = dbl.build_metdata_dataset()
 
@@ -0,0 +1,191 @@
+import threading
+from typing import NamedTuple
+
+from SoggyVision.acquisition import DataAcquisition, StorageWriter
+from SoggyVision.metrics import to_prometheus, write_prometheus
+from SoggyVision.pipeline import BoundedQueue
+
+
+class InstrumentStats(NamedTuple):
+    name: str
+    port: str
+    sn: str
+    running: bool
+    logging: bool
+    frames: int
+    discarded_bytes: int
+    raw_queue_depth: int
+    raw_queue_dropped: int
+    latency: float
+    error: str
+
+
+class AcquisitionManager():
+    """
+    Run several ACS instruments concurrently in one process.
+
+    Each instrument gets its own DataAcquisition (reader and conversion threads, rolling window and counters). All
+    instruments share one storage queue drained by a single StorageWriter thread, so the database work of N
+    instruments never competes for N sqlite connections.
+    """
+
+    def __init__(self, storage_queue_size: int = 4096, storage_queue_policy: str = BoundedQueue.BLOCK,
+                 acquisition_class: type = DataAcquisition, **writer_kwargs) -> None:
+        """
+        :param storage_queue_size: The maximum number of batches waiting to be written, across all instruments.
+        :param storage_queue_policy: What conversion does when storage falls behind. See BoundedQueue.
+        :param acquisition_class: DataAcquisition or a subclass of it, e.g. DataAcquisitionThread for a GUI.
+        :param writer_kwargs: Passed to the StorageWriter, e.g. flush_interval.
+        """
+
+        self.acquisition_class = acquisition_class
+        self.storage_queue = BoundedQueue(storage_queue_size, storage_queue_policy)
+        self.writer_kwargs = writer_kwargs
+        self.writer = StorageWriter(**writer_kwargs)
+        self.instruments = {}  # name: DataAcquisition
+        self._threads = {}
+        self._writer_thread = None
+
+    def __len__(self) -> int:
+        return len(self.instruments)
+
+    def __getitem__(self, name: str) -> DataAcquisition:
+        return self.instruments[name]
+
+    def add_instrument(self, port: str, acs: object, hindcast: int = 60, name: str = None,
+                       **kwargs) -> DataAcquisition:
+        """
+        Open a port and prepare an instrument for acquisition.
+
+        :param port: The serial port the ACS is connected to.
+        :param acs: An ACS object built from the calibration file of the instrument.
+        :param hindcast: The length of the rolling window in seconds.
+        :param name: A unique name for the instrument. Defaults to the serial number.
+        :param kwargs: Passed to the acquisition class.
+        :return: The acquisition object of the instrument.
+        """
+
+        name = acs.sn if name is None else name
+        if name in self.instruments:
+            raise ValueError(f'An instrument named {name} already exists.')
+        daq = self.acquisition_class(port, acs, hindcast, storage_queue = self.storage_queue, **kwargs)
+        self.instruments[name] = daq
+        return daq
+
+    def start(self) -> None:
+        """
+        Start the storage writer and every instrument that is not already running.
+        Calling it again restarts instruments that stopped, e.g. after a NoDataTimeout, reopening their ports, and a
+        storage writer that died.
+        """
+
+        if self._writer_thread is None or not self._writer_thread.is_alive():
+            # Restarting after stop(), or after the writer thread died. See writer_stopped().
+            if self._writer_thread is not None or self.writer.metrics.counters['batches'] > 0:
+                self.writer = StorageWriter(**self.writer_kwargs)
+            self.storage_queue.reopen()
+            self._writer_thread = threading.Thread(target=self.writer.run, args=(self.storage_queue,),
+                                                   name="storage-writer", daemon=True)
+            self._writer_thread.start()
+        for name, daq in self.instruments.items():
+            if name in self._threads and self._threads[name].is_alive():
+                continue
+            if name in self._threads:  # Reopen the port of a stopped instrument, it may have been unplugged.
+                daq.serial.close()
+            if not daq.serial.is_open:
+                daq.serial.open()
+            daq.error = None
+            daq.running = True
+            thread = threading.Thread(target=daq.run, name=f"{name}-acquisition", daemon=True)
+            thread.start()
+            self._threads[name] = thread
+
+    def stop(self) -> None:
+        """Stop every instrument, then flush and close the storage writer."""
+
+        for daq in self.instruments.values():
+            daq.stop()
+        for thread in self._threads.values():
+            thread.join()
+        self._threads = {}
+        if self._writer_thread is not None:
+            self.storage_queue.close()
+            self._writer_thread.join()
+            self._writer_thread = None
+        for daq in self.instruments.values():
+            daq.serial.close()
+
+    def stopped(self) -> list:
+        """Names of instruments whose acquisition has ended, e.g. because of an error."""
+
+        return [name for name, thread in self._threads.items() if not thread.is_alive()]
+
+    def writer_stopped(self) -> bool:
+        """
+        True if the storage writer thread has ended while acquisition runs. Nothing drains the storage queue then, so
+        every batch waits for the queue timeout and is dropped. The cause is in self.writer.error.
+        """
+
+        return self._writer_thread is not None and not self._writer_thread.is_alive()
+
+    def start_logging(self, prefix: str, raw_only: bool = False) -> None:
+        """
+        Start logging every instrument. Each instrument logs to its own database, named {prefix}_{name}.
+
+        :param prefix: The database name prefix.
+        :param raw_only: Only store the time and raw frame. See DataAcquisition.start_logging.
+        """
+
+        for name, daq in self.instruments.items():
+            daq.start_logging(f"{prefix}_{name}", raw_only)
+
+    def stop_logging(self) -> None:
+        for daq in self.instruments.values():
+            daq.stop_logging()
+
+    def snapshots(self) -> dict:
+        """Copy out the rolling window of every instrument. name: WindowSnapshot"""
+
+        return {name: daq.window.snapshot() for name, daq in self.instruments.items()}
+
+    def stats(self) -> dict:
+        """Return the counters of every instrument. name: InstrumentStats"""
+
+        stats = {}
+        for name, daq in self.instruments.items():
+            stats[name] = InstrumentStats(name = name,
+                                          port = daq.port,
+                                          sn = daq.acs.sn,
+                                          running = daq.running,
+                                          logging = daq.log,
+                                          frames = daq.metrics.counters['frames'],
+                                          discarded_bytes = daq.metrics.counters['discarded_bytes'],
+                                          raw_queue_depth = len(daq.raw_queue),
+                                          raw_queue_dropped = daq.raw_queue.dropped,
+                                          latency = daq.metrics.stages['latency'].last,
+                                          error = None if daq.error is None else str(daq.error))
+        return stats
+
+    def metrics(self) -> dict:
+        """
+        Return the metrics of every instrument and of storage. name: Metrics
+
+        The storage entry also carries the depth and drop count of the shared storage queue.
+        """
+
+        sources = {name: daq.metrics for name, daq in self.instruments.items()}
+        storage = self.writer.metrics
+        storage.gauges['storage_queue_depth'] = lambda: len(self.storage_queue)
+        storage.gauges['storage_queue_dropped'] = lambda: self.storage_queue.dropped
+        sources['storage'] = storage
+        return sources
+
+    def metrics_text(self) -> str:
+        """The metrics of every instrument and of storage in the Prometheus text format."""
+
+        return to_prometheus(self.metrics())
+
+    def write_metrics(self, filepath: str) -> None:
+        """Atomically write the Prometheus text format metrics file."""
+
+        write_prometheus(filepath, self.metrics())
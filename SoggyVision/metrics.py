@@ -0,0 +1,158 @@
+from bisect import bisect_left
+import os
+import time
+
+# Histogram bucket upper bounds in seconds, from 10 us to 10 s.
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """
+    A fixed bucket histogram of durations. Observing is a bisect and two additions, so it can stay on in the
+    acquisition loop. Nothing is aggregated until someone reads it.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'last')
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last count is above the largest bucket.
+        self.sum = 0.0
+        self.count = 0
+        self.last = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket that contains it.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The bucket upper bound in seconds, inf if above every bucket, or None if empty.
+        """
+
+        if self.count == 0:
+            return None
+        target = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float('inf')
+
+    def cumulative(self) -> list:
+        """Return (upper bound, cumulative count) pairs, ending with +inf, as Prometheus expects."""
+
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class Metrics():
+    """
+    Per-stage timing histograms, counters and gauges for one part of the pipeline.
+
+    Gauges are callables evaluated only when the metrics are read, so queue and buffer depths cost nothing to
+    track. Stages and counters are written by a single thread each; readers see a consistent enough view without
+    locking.
+    """
+
+    def __init__(self, stages: list, counters: list, gauges: dict = None) -> None:
+        """
+        :param stages: Names of the timed stages.
+        :param counters: Names of the monotonic counters.
+        :param gauges: name: callable returning the current value.
+        """
+
+        self.stages = {stage: Histogram() for stage in stages}
+        self.counters = {counter: 0 for counter in counters}
+        self.gauges = dict(gauges or {})
+        self._rate_marks = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        self.stages[stage].observe(seconds)
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self.counters[counter] += n
+
+    def read_gauges(self) -> dict:
+        return {name: gauge() for name, gauge in self.gauges.items()}
+
+    def rate(self, counter: str) -> float:
+        """
+        The per second rate of a counter since the previous call for the same counter.
+
+        :param counter: The counter name.
+        :return: The rate, or None on the first call.
+        """
+
+        now = time.monotonic()
+        value = self.counters[counter]
+        mark = self._rate_marks.get(counter)
+        self._rate_marks[counter] = (now, value)
+        if mark is None or now <= mark[0]:
+            return None
+        return (value - mark[1]) / (now - mark[0])
+
+
+def to_prometheus(sources: dict, prefix: str = 'soggyvision') -> str:
+    """
+    Format metrics in the Prometheus text exposition format.
+
+    :param sources: source name: Metrics. The name becomes the source label.
+    :param prefix: The metric name prefix.
+    :return: The exposition text.
+    """
+
+    lines = [f"# HELP {prefix}_stage_seconds Time spent in each acquisition stage.",
+             f"# TYPE {prefix}_stage_seconds histogram"]
+    for source, metrics in sources.items():
+        for stage, histogram in metrics.stages.items():
+            labels = f'source="{source}",stage="{stage}"'
+            for bound, total in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_stage_seconds_bucket{{{labels},le="{le}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_sum{{{labels}}} {histogram.sum!r}')
+            lines.append(f'{prefix}_stage_seconds_count{{{labels}}} {histogram.count}')
+
+    counters = {}
+    gauges = {}
+    for source, metrics in sources.items():
+        for name, value in metrics.counters.items():
+            counters.setdefault(name, []).append((source, value))
+        for name, value in metrics.read_gauges().items():
+            gauges.setdefault(name, []).append((source, value))
+    for name, values in counters.items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines += [f'{prefix}_{name}_total{{source="{source}"}} {value}' for source, value in values]
+    for name, values in gauges.items():
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines += [f'{prefix}_{name}{{source="{source}"}} {value}' for source, value in values]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(filepath: os.path.abspath, sources: dict, prefix: str = 'soggyvision') -> None:
+    """
+    Write a Prometheus text file atomically, e.g. for the node_exporter textfile collector.
+
+    :param filepath: The location of the metrics file.
+    :param sources: source name: Metrics.
+    :param prefix: The metric name prefix.
+    """
+
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, 'w') as f:
+        f.write(to_prometheus(sources, prefix))
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,313 @@
+"""
+Append-only NetCDF4 logging.
+
+A NetCDFWriter writes frames straight into the layout of SoggyVision.export.export_netcdf: root attributes and the
+converted, raw and calibration groups. converted and raw have an unlimited time dimension and (time, wavelength)
+variables chunked along time, and each flush appends one block of rows to every variable. The file is opened for
+each flush and closed again, so between flushes it is complete and readable by xarray or any netCDF reader while
+logging continues. Exporting the file is a copy.
+
+netCDF4 and yaml are imported when the first file is opened, so the acquisition stack only needs them when this
+backend is used.
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from SoggyVision.core import DB_DIR
+from SoggyVision.database import ACSMetadataTable
+
+NETCDF_SUFFIX = '.nc'
+NETCDF_CODECS = ['zlib']  # zlib with the HDF5 shuffle filter, per chunk.
+TIME_UNITS = 'nanoseconds since 1900-01-01'  # The time encoding of export_netcdf.
+TIME_EPOCH = np.datetime64('1900-01-01T00:00:00', 'ns')
+ATTRIBUTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attributes.yaml')
+
+# name: (dimensions, dtype). The source of each variable is the ACSData or ACSFlags field of the same name.
+CONVERTED_VARIABLES = {'a_uncorr': (('time', 'wavelength_a'), 'f4'), 'a_m': (('time', 'wavelength_a'), 'f4'),
+                       'c_uncorr': (('time', 'wavelength_c'), 'f4'), 'c_m': (('time', 'wavelength_c'), 'f4'),
+                       'internal_temperature': (('time',), 'f4'), 'external_temperature': (('time',), 'f4')}
+FLAG_VARIABLES = {'flag_gross_range_test_a_m': (('time', 'wavelength_a'), 'i1'),
+                  'flag_gross_range_test_c_m': (('time', 'wavelength_c'), 'i1'),
+                  'flag_syntax_test': (('time',), 'i1'), 'flag_gap_test': (('time',), 'i1'),
+                  'flag_elapsed_time': (('time',), 'i1'), 'flag_outside_temperature_calibration': (('time',), 'i1')}
+RAW_VARIABLES = {'a_signal': (('time', 'wavelength_a'), 'u2'), 'a_reference': (('time', 'wavelength_a'), 'u2'),
+                 'c_signal': (('time', 'wavelength_c'), 'u2'), 'c_reference': (('time', 'wavelength_c'), 'u2'),
+                 'frame_length': (('time',), 'i4'), 'frame_type': (('time',), 'i4'),
+                 'a_reference_dark': (('time',), 'i4'), 'a_signal_dark': (('time',), 'i4'),
+                 'pressure_signal': (('time',), 'i4'), 'c_reference_dark': (('time',), 'i4'),
+                 'c_signal_dark': (('time',), 'i4'), 't_external': (('time',), 'i4'), 't_internal': (('time',), 'i4'),
+                 'elapsed_time': (('time',), 'i8')}
+
+# netCDF attribute: metadata field, as written by export_netcdf.
+ROOT_ATTRIBUTES = {'sensor_type': 'sensor_type', 'serial_number': 'serial_number',
+                   'serial_number_hexdec': 'serial_number_hexdec', 'number_of_wavelengths': 'number_of_wavelengths',
+                   'baudrate': 'baudrate', 'calibration_filename': 'calibration_filename',
+                   'calibration_date': 'factory_calibration_date'}
+GROUP_ATTRIBUTES = {'sensor_type': 'sensor_type', 'serial_number': 'serial_number',
+                    'serial_number_hexdec': 'serial_number_hexdec', 'number_of_wavelengths': 'number_of_wavelengths',
+                    'number_of_temperature_bins': 'number_of_temperature_bins', 'baudrate': 'baudrate',
+                    'tcal': 'tcal', 'ical': 'ical', 'factory_calibration_structure_version': 'structure_version',
+                    'calibration_filename': 'calibration_filename',
+                    'factory_calibration_date': 'factory_calibration_date'}
+LIST_FIELDS = ['wavelengths_a', 'wavelengths_c', 'offsets_a', 'offsets_c', 'temperature_bins', 'delta_t_a', 'delta_t_c']
+
+
+def netcdf_path(name):
+    """:return: The path of the NetCDF log of a database name."""
+    return os.path.join(DB_DIR, name + NETCDF_SUFFIX)
+
+
+def load_attributes():
+    """:return: Variable name: attributes, from attributes.yaml."""
+    import yaml
+    with open(ATTRIBUTES_FILE, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def copy_netcdf(name, output, attrs = None):
+    """
+    Copy a NetCDF log, which is already in the export layout, and add attributes to the root and every group.
+    The converted spectra and temperatures of a raw only log are derived in the copy. See derive_converted.
+
+    :param name: The database name of the log.
+    :param output: The path to copy to.
+    :param attrs: Attributes such as operator or institution, or None.
+    :return: output
+    """
+    import netCDF4
+    shutil.copyfile(netcdf_path(name), output)
+    with netCDF4.Dataset(output, 'a') as nc:
+        if 'a_m' not in nc.groups['converted'].variables:  # Logged raw only.
+            derive_converted(nc)
+        if attrs:
+            for group in [nc] + list(nc.groups.values()):
+                group.setncatts(attrs)
+    return output
+
+
+def create_variable(group, name, dimensions, dtype, chunk_rows, compressed, attributes):
+    """Create a (time, ...) variable chunked along time, with its attributes from attributes.yaml."""
+    chunks = (chunk_rows,) + tuple(len(group.dimensions[d]) for d in dimensions[1:])
+    variable = group.createVariable(name, dtype, dimensions, chunksizes = chunks, fill_value = False,
+                                    zlib = compressed, shuffle = compressed)
+    variable.setncatts(attributes.get(name, {}))
+    return variable
+
+
+def read_calibration(nc):
+    """
+    Rebuild the calibration of a NetCDF log from its calibration group. See SoggyVision.dev.Dev.from_metadata.
+
+    :param nc: The open log.
+    :return: An ACS.
+    """
+    from SoggyVision.acs import ACS
+    calibration = nc.groups['calibration']
+    if 'path_length' not in calibration.ncattrs():
+        raise ValueError(f'{nc.filepath()} does not record the path length, so its products can not be derived.')
+    metadata = {field: calibration.getncattr(name) for name, field in GROUP_ATTRIBUTES.items()}
+    metadata['calibration_filepath'] = metadata['calibration_filename']
+    metadata['path_length'] = float(calibration.getncattr('path_length'))
+    for field, name in [('wavelengths_a', 'wavelength_a'), ('wavelengths_c', 'wavelength_c'),
+                        ('temperature_bins', 'temperature_bins'), ('offsets_a', 'offset_a'),
+                        ('offsets_c', 'offset_c'), ('delta_t_a', 'delta_t_a'), ('delta_t_c', 'delta_t_c')]:
+        metadata[field] = np.asarray(calibration.variables[name][:])
+    return ACS.from_metadata(metadata)
+
+
+def derive_converted(nc, rows = 10000):
+    """
+    Add the converted spectra and temperatures of a raw only log to its converted group, computed from the raw and
+    calibration groups with the same chunking and compression as the raw group.
+
+    :param nc: The log, open for appending.
+    :param rows: Convert this many rows at a time, so memory use does not depend on the length of the log.
+    """
+    acs = read_calibration(nc)
+    raw = nc.groups['raw']
+    converted = nc.groups['converted']
+    raw.set_auto_mask(False)  # Without a fill value, netCDF4 would mask counts equal to the default fill.
+    attributes = load_attributes()
+    chunk_rows = raw.variables['time'].chunking()[0]
+    compressed = raw.variables['a_signal'].filters()['zlib']
+    variables = {name: create_variable(converted, name, dimensions, dtype, chunk_rows, compressed, attributes)
+                 for name, (dimensions, dtype) in CONVERTED_VARIABLES.items()}
+    length = len(raw.dimensions['time'])
+    for begin in range(0, length, rows):
+        end = min(begin + rows, length)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):  # Rows of a failed flush may hold zero counts.
+            values = {'internal_temperature': acs.compute_internal_temperature_batch(raw['t_internal'][begin:end]),
+                      'external_temperature': acs.compute_external_temperature_batch(raw['t_external'][begin:end]),
+                      'a_uncorr': acs.compute_uncorrected_batch(raw['a_signal'][begin:end],
+                                                                raw['a_reference'][begin:end]),
+                      'c_uncorr': acs.compute_uncorrected_batch(raw['c_signal'][begin:end],
+                                                                raw['c_reference'][begin:end])}
+            values['a_m'] = acs.compute_measured_batch(values['a_uncorr'], 'a', values['internal_temperature'])
+            values['c_m'] = acs.compute_measured_batch(values['c_uncorr'], 'c', values['internal_temperature'])
+        for name, value in values.items():
+            variables[name][begin:end] = value
+
+
+class NetCDFWriter():
+    """
+    Append ACS data and flags to a NetCDF4 file in blocks. Has the interface of SVDBWriter.
+
+    A flush opens the file, appends every buffered row along the unlimited time dimension and closes it again. HDF5
+    cannot recover a file that was being written when power failed, so the file is only open during a flush. A power
+    failure between flushes loses at most flush_interval seconds of data, but one during a flush may lose the file.
+    Prefer the sqlite backend where power is unreliable.
+    """
+
+    def __init__(self, path, metadata, flush_rows = 500, flush_interval = 1.0, raw_only = False, codec = None,
+                 chunk_rows = None):
+        """
+        :param path: The file. An existing file is appended to, and keeps the layout it was created with.
+        :param metadata: Values for ACSMetadataTable.fields, with lists as JSON.
+        :param flush_rows: Flush once this many rows are buffered.
+        :param flush_interval: Flush once the oldest buffered row is this many seconds old.
+        :param raw_only: Leave the converted spectra and temperatures out of the converted group. They are
+            derived from the raw group and the calibration group on export, see derive_converted.
+        :param codec: None or one of NETCDF_CODECS.
+        :param chunk_rows: The chunk length along time, or None for flush_rows.
+        """
+        if codec is not None and codec not in NETCDF_CODECS:
+            raise ValueError(f'Unknown NetCDF codec: {codec}. Use one of {", ".join(NETCDF_CODECS)}.')
+        self.path = path
+        self.metadata = dict(zip(ACSMetadataTable.fields, metadata))
+        for field in LIST_FIELDS:
+            if isinstance(self.metadata[field], str):
+                self.metadata[field] = json.loads(self.metadata[field])
+        self.flush_rows = int(flush_rows)
+        self.flush_interval = float(flush_interval)
+        self.raw_only = raw_only
+        self.codec = codec
+        self.chunk_rows = int(chunk_rows or flush_rows)
+        self._data = []
+        self._flags = []
+        self._first_buffered = None
+        self.flushes = 0
+        if os.path.isfile(path):
+            self.__check_existing()
+        else:
+            self.__create()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __create(self):
+        import netCDF4
+        attributes = load_attributes()
+        metadata = self.metadata
+        with netCDF4.Dataset(self.path, 'w', format = 'NETCDF4') as nc:
+            nc.setncatts({name: metadata[field] for name, field in ROOT_ATTRIBUTES.items()})
+            groups = {'converted': {} if self.raw_only else dict(CONVERTED_VARIABLES), 'raw': RAW_VARIABLES}
+            groups['converted'].update(FLAG_VARIABLES)
+            for group_name, variables in groups.items():
+                group = nc.createGroup(group_name)
+                group.setncatts({name: metadata[field] for name, field in GROUP_ATTRIBUTES.items()})
+                self.__create_coordinates(group, attributes)
+                time_variable = group.createVariable('time', 'i8', ('time',), chunksizes = (self.chunk_rows,),
+                                                     fill_value = netCDF4.default_fillvals['i8'])
+                time_variable.setncatts({'units': TIME_UNITS, 'calendar': 'proleptic_gregorian'})
+                time_variable.setncatts(attributes.get('time', {}))
+                for name, (dimensions, dtype) in variables.items():
+                    create_variable(group, name, dimensions, dtype, self.chunk_rows, self.codec is not None,
+                                    attributes)
+
+            calibration = nc.createGroup('calibration')
+            calibration.setncatts({name: metadata[field] for name, field in GROUP_ATTRIBUTES.items()})
+            calibration.setncattr('path_length', metadata['path_length'])  # See read_calibration.
+            self.__create_coordinates(calibration, attributes)
+            calibration.createDimension('temperature_bins', len(metadata['temperature_bins']))
+            values = {'temperature_bins': (('temperature_bins',), metadata['temperature_bins']),
+                      'offset_a': (('wavelength_a',), metadata['offsets_a']),
+                      'offset_c': (('wavelength_c',), metadata['offsets_c']),
+                      'delta_t_a': (('wavelength_a', 'temperature_bins'), metadata['delta_t_a']),
+                      'delta_t_c': (('wavelength_c', 'temperature_bins'), metadata['delta_t_c'])}
+            for name, (dimensions, value) in values.items():
+                variable = calibration.createVariable(name, 'f8', dimensions)
+                variable[:] = np.asarray(value, dtype = np.float64)
+                variable.setncatts(attributes.get(name, {}))
+
+    def __create_coordinates(self, group, attributes):
+        """Create the time (unlimited) and wavelength dimensions and wavelength coordinates of a group."""
+        group.createDimension('time', None)
+        for name, field in [('wavelength_a', 'wavelengths_a'), ('wavelength_c', 'wavelengths_c')]:
+            group.createDimension(name, len(self.metadata[field]))
+            variable = group.createVariable(name, 'f8', (name,))
+            variable[:] = np.asarray(self.metadata[field], dtype = np.float64)
+            variable.setncatts(attributes.get(name, {}))
+
+    def __check_existing(self):
+        """Refuse to append frames of another instrument or wavelength layout to an existing file."""
+        import netCDF4
+        with netCDF4.Dataset(self.path, 'r') as nc:
+            for name, field in [('serial_number', 'serial_number'), ('number_of_wavelengths', 'number_of_wavelengths')]:
+                if str(nc.getncattr(name)) != str(self.metadata[field]):
+                    raise ValueError(f'{self.path} holds {name} {nc.getncattr(name)}, not {self.metadata[field]}.')
+
+    def add(self, data, flags, end_time):
+        """
+        Buffer one frame.
+
+        :param data: The converted frame.
+        :param flags: The flags of the frame.
+        :param end_time: Unused, the time variable records it. Kept for the interface of SVDBWriter.
+        """
+        if self._first_buffered is None:
+            self._first_buffered = time.monotonic()
+        self._data.append(data)
+        self._flags.append(flags)
+        if len(self._data) >= self.flush_rows:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flush if the oldest buffered row has waited flush_interval seconds. :return: True if flushed."""
+        if self._first_buffered is not None and time.monotonic() - self._first_buffered >= self.flush_interval:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """
+        Append every buffered row to the file as one block, then close it.
+
+        time is written last. If a flush fails part way, its rows keep the fill value of time and read as missing,
+        and the next flush appends to both groups after the longest of them, so the groups stay aligned.
+        """
+        if len(self._data) == 0:
+            return
+        import netCDF4
+        try:
+            times = np.array([data.time for data in self._data], dtype = 'datetime64[ns]')
+            times = (times - TIME_EPOCH).astype(np.int64)
+            with netCDF4.Dataset(self.path, 'a') as nc:
+                groups = [nc.groups['converted'], nc.groups['raw']]
+                start = max(len(group.dimensions['time']) for group in groups)
+                stop = start + len(times)
+                for group in groups:
+                    for name, variable in group.variables.items():
+                        if name in FLAG_VARIABLES:
+                            rows = self._flags
+                        elif name in CONVERTED_VARIABLES or name in RAW_VARIABLES:
+                            rows = self._data
+                        else:  # time and the wavelength coordinates.
+                            continue
+                        variable[start:stop] = np.asarray([getattr(row, name) for row in rows],
+                                                          dtype = variable.dtype)
+                for group in groups:
+                    group.variables['time'][start:stop] = times
+        finally:  # Rows that failed are not retried, like SVDBWriter.
+            self._data = []
+            self._flags = []
+            self._first_buffered = None
+        self.flushes += 1
+
+    def close(self):
+        """Flush. The file is already closed between flushes."""
+        self.flush()
@@ -0,0 +1,391 @@
+import numpy as np
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+from SoggyVision.core import DB_DIR
+from SoggyVision.database import SVDB, SVDBWriter, ACSDataTable, ACSMetadataTable, concatenate_columns, format_time
+
+HOURLY = 'hourly'
+DAILY = 'daily'
+CATALOG_SUFFIX = '.catalog'
+SIZE_UNITS = {'': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+
+def parse_partition(value):
+    """
+    Parse a partitioning policy.
+
+    :param value: None, 'hourly', 'daily', a number of bytes or a size such as '500MB'.
+    :return: None, HOURLY, DAILY or a number of bytes.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    text = str(value).strip()
+    if text.lower() in [HOURLY, DAILY]:
+        return text.lower()
+    match = re.fullmatch(r'(\d+)\s*([KMG]?B?)', text.upper())
+    if match is None or match.group(2) not in SIZE_UNITS:
+        raise ValueError(f'Unknown partitioning: {value}. Use hourly, daily or a size such as 500MB.')
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def partition_name(name, index):
+    return f"{name}_p{index:04d}"
+
+
+def database_size(dbname):
+    """The size of a database in bytes, including its write-ahead log. 0 if it does not exist."""
+    filepath = os.path.join(DB_DIR, f"{dbname}.db")
+    return sum(os.path.getsize(f) for f in [filepath, f"{filepath}-wal"] if os.path.isfile(f))
+
+
+class SVCatalog():
+    """
+    A small database that maps time ranges to the partitions of a dataset, stored as {name}.catalog.db in DB_DIR.
+    Each partition is a complete SoggyVision database with its own metadata, so it can also be read on its own.
+    """
+
+    TABLE = 'partitions'
+
+    def __init__(self, name, readonly = False):
+        """
+        :param name: The dataset name.
+        :param readonly: Open an existing catalog for reading only, without touching the file. For readers such as
+            size lookups on the GUI clock.
+        """
+        self.name = name
+        filepath = os.path.join(DB_DIR, f"{name}{CATALOG_SUFFIX}.db")
+        if readonly:
+            self.dbcon = sqlite3.connect(f"file:{filepath}?mode=ro", uri = True)
+            self.dbcur = self.dbcon.cursor()
+            return
+        os.makedirs(DB_DIR, exist_ok=True)
+        self.dbcon = sqlite3.connect(filepath)
+        self.dbcur = self.dbcon.cursor()
+        self.dbcur.execute("PRAGMA journal_mode=WAL")  # The GUI and exports read while the writer updates it.
+        self.dbcur.execute(f"CREATE TABLE IF NOT EXISTS {self.TABLE}(dbname TEXT, begin_time TEXT, end_time TEXT, "
+                           f"closed BIGINT, bytes BIGINT, PRIMARY KEY (dbname))")
+        self.dbcon.commit()
+
+    @staticmethod
+    def exists(name):
+        return os.path.isfile(os.path.join(DB_DIR, f"{name}{CATALOG_SUFFIX}.db"))
+
+    def __len__(self):
+        return self.dbcur.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+
+    def add(self, dbname, begin_time):
+        self.dbcur.execute(f"INSERT INTO {self.TABLE} VALUES (?, ?, ?, 0, 0)",
+                           (dbname, format_time(begin_time), format_time(begin_time)))
+        self.dbcon.commit()
+
+    def update(self, dbname, end_time = None, closed = None, size = None):
+        """Record the last frame time, whether the partition is finished and its size on disk."""
+        assignments = {'end_time': None if end_time is None else format_time(end_time),
+                       'closed': None if closed is None else int(closed), 'bytes': size}
+        assignments = {k: v for k, v in assignments.items() if v is not None}
+        if len(assignments) == 0:
+            return
+        statement = f"UPDATE {self.TABLE} SET {', '.join([f'{k}=?' for k in assignments])} WHERE dbname=?"
+        self.dbcur.execute(statement, list(assignments.values()) + [dbname])
+        self.dbcon.commit()
+
+    def partitions(self, start = None, end = None):
+        """
+        :param start: Only partitions with frames at or after this time, or None.
+        :param end: Only partitions with frames before this time, or None.
+        :return: A list of (dbname, begin_time, end_time) in time order.
+        """
+        statement = f"SELECT dbname, begin_time, end_time FROM {self.TABLE}"
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append('end_time >= ?')
+            parameters.append(format_time(start))
+        if end is not None:
+            conditions.append('begin_time < ?')
+            parameters.append(format_time(end))
+        if len(conditions) > 0:
+            statement += f" WHERE {' AND '.join(conditions)}"
+        return self.dbcur.execute(statement + ' ORDER BY begin_time', parameters).fetchall()
+
+    def size(self):
+        """The size of every partition in bytes, read from disk."""
+        return sum(database_size(dbname) for dbname, _, _ in self.partitions())
+
+    def close(self):
+        self.dbcon.close()
+
+
+class Compactor():
+    """
+    Compact finished partitions in a background thread, off the acquisition and storage hot path.
+    Compaction checkpoints and truncates the write-ahead log, rewrites the file with VACUUM and leaves it in rollback
+    journal mode, so a finished partition is a single self-contained file.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self.compacted = 0
+        self.error = None
+
+    def submit(self, name, dbname):
+        """Compact dbname and record its final size in the catalog of name."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="partition-compactor", daemon=True)
+            self._thread.start()
+        self._queue.put((name, dbname))
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            name, dbname = item
+            try:
+                dbcon = sqlite3.connect(os.path.join(DB_DIR, f"{dbname}.db"))
+                dbcon.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                dbcon.execute("VACUUM")
+                dbcon.execute("PRAGMA journal_mode=DELETE")
+                dbcon.close()
+                catalog = SVCatalog(name)  # Opened per job, so no connection outlives its dataset.
+                try:
+                    catalog.update(dbname, size = database_size(dbname))
+                finally:
+                    catalog.close()
+                self.compacted += 1
+            except sqlite3.Error as error:  # The partition is still complete, only larger than it could be.
+                self.error = error
+
+    def close(self):
+        """Finish pending compactions and stop the thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+class PartitionedWriter():
+    """
+    Group commit frames into rolling partitions of a dataset. Has the interface of SVDBWriter.
+
+    A new partition starts when the frame time crosses an hour or day boundary, or once a flush leaves the current
+    partition at or above a size. Each partition gets the metadata entry of the session and a catalog entry. Finished
+    partitions are handed to a Compactor.
+    """
+
+    def __init__(self, name, metadata, partition, flush_rows = 500, flush_interval = 1.0, wal = True,
+                 synchronous = 'FULL', compactor = None, raw_only = False, codec = None):
+        """
+        :param name: The dataset name. Partitions are named {name}_p0000, {name}_p0001, ...
+        :param metadata: Values for ACSMetadataTable.fields. begin_time is set per partition.
+        :param partition: HOURLY, DAILY or a size in bytes. See parse_partition.
+        :param flush_rows: See SVDBWriter.
+        :param flush_interval: See SVDBWriter.
+        :param wal: See SVDB.
+        :param synchronous: See SVDB.
+        :param compactor: A Compactor for finished partitions, or None to leave them as they are.
+        :param raw_only: See SVDBWriter.
+        :param codec: See SVDBWriter.
+        """
+        self.name = name
+        self.metadata = list(metadata)
+        self.partition = parse_partition(partition)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.wal = wal
+        self.synchronous = synchronous
+        self.compactor = compactor
+        self.raw_only = raw_only
+        self.codec = codec
+        self.catalog = SVCatalog(name)
+        self._index = len(self.catalog)  # Continue numbering when logging resumes into the same dataset.
+        self._writer = None
+        self._key = None
+        self._end_time = None
+        self.flushes = 0
+
+    def __len__(self):
+        return 0 if self._writer is None else len(self._writer)
+
+    @property
+    def dbname(self):
+        return None if self._writer is None else partition_name(self.name, self._index - 1)
+
+    def partition_key(self, t):
+        if self.partition == HOURLY:
+            return t.replace(minute = 0, second = 0, microsecond = 0)
+        if self.partition == DAILY:
+            return t.date()
+        return None
+
+    def __open(self, begin_time):
+        dbname = partition_name(self.name, self._index)
+        self._index += 1
+        db = SVDB(dbname, wal = self.wal, synchronous = self.synchronous)
+        metadata = list(self.metadata)
+        metadata[ACSMetadataTable.fields.index('begin_time')] = begin_time
+        db.insert_data(ACSMetadataTable.name, ACSMetadataTable.fields, metadata)
+        self.catalog.add(dbname, begin_time)
+        self._writer = SVDBWriter(db, begin_time, self.flush_rows, self.flush_interval, self.raw_only, self.codec)
+
+    def __finish(self, compact = True):
+        """Flush and close the current partition."""
+        if self._writer is None:
+            return
+        dbname = self.dbname
+        writer = self._writer
+        try:
+            if len(writer) > 0:
+                writer.flush()
+                self.flushes += 1
+                self.catalog.update(dbname, end_time = self._end_time)
+        finally:
+            self._writer = None
+            writer.db.dbcon.close()
+            self.catalog.update(dbname, closed = True, size = database_size(dbname))
+        if compact and self.compactor is not None:
+            self.compactor.submit(self.name, dbname)
+
+    def __flushed(self):
+        """Bookkeeping after the current partition flushed: catalog end_time, then a size rollover if due."""
+        self.flushes += 1
+        dbname = self.dbname
+        self.catalog.update(dbname, end_time = self._end_time)
+        if isinstance(self.partition, int) and database_size(dbname) >= self.partition:
+            self.__finish()
+
+    def add(self, data, flags, end_time):
+        """Buffer one frame, starting a new partition first if the frame belongs to the next one."""
+        key = self.partition_key(data.time)
+        if self._writer is not None and key != self._key:
+            self.__finish()
+        if self._writer is None:
+            self.__open(data.time)
+            self._key = key
+        self._end_time = end_time
+        self._writer.add(data, flags, end_time)
+        if len(self._writer) == 0:  # The add filled the buffer and flushed.
+            self.__flushed()
+
+    def flush(self):
+        if self._writer is not None and len(self._writer) > 0:
+            self._writer.flush()
+            self.__flushed()
+
+    def flush_if_due(self):
+        if self._writer is not None and self._writer.flush_if_due():
+            self.__flushed()
+            return True
+        return False
+
+    def close(self, compact = True):
+        """
+        Flush and close the current partition.
+
+        :param compact: Hand the partition to the compactor, as when a session ends or rotates. False at process
+            shutdown, so it stays quick. The partition is then left in WAL mode.
+        """
+        try:
+            self.__finish(compact = compact)
+        finally:
+            self.catalog.close()
+
+
+class PartitionedSVDB():
+    """
+    Read a partitioned dataset through the read interface of SVDB.
+    Only the partitions that overlap start and end are opened.
+    """
+
+    def __init__(self, name, start = None, end = None):
+        """
+        :param name: The dataset name.
+        :param start: Only open partitions with frames at or after this time, or None.
+        :param end: Only open partitions with frames before this time, or None.
+        """
+        catalog = SVCatalog(name, readonly = True)
+        self.partitions = catalog.partitions(start, end)
+        catalog.close()
+        if os.path.isfile(os.path.join(DB_DIR, f"{name}.db")):  # Logged without partitioning under the same name.
+            self.partitions = sorted(self.partitions + self.__unpartitioned(name, start, end), key = lambda p: p[1])
+        self.databases = [SVDB(dbname) for dbname, _, _ in self.partitions]
+
+    @staticmethod
+    def __unpartitioned(name, start, end):
+        """:return: The plain database {name}.db as a partition, in a list, if it overlaps start and end."""
+        db = SVDB(name)
+        try:
+            begin_time, end_time = db.time_range(ACSDataTable.name)
+        finally:
+            db.dbcon.close()
+        if begin_time is None:
+            return []
+        if start is not None and end_time < format_time(start):
+            return []
+        if end is not None and begin_time >= format_time(end):
+            return []
+        return [(name, begin_time, end_time)]
+
+    def get_all_data(self, table_name):
+        return [row for db in self.databases for row in db.get_all_data(table_name)]
+
+    def select_data(self, table_name, fields, start = None, end = None):
+        return [row for db in self.databases for row in db.select_data(table_name, fields, start, end)]
+
+    def iter_data(self, table_name, fields, start = None, end = None, batch_size = 1000):
+        for db in self.databases:
+            yield from db.iter_data(table_name, fields, start, end, batch_size)
+
+    def select_columns(self, table_name, fields, start = None, end = None):
+        parts = [db.select_columns(table_name, fields, start, end) for db in self.databases]
+        filled = [part for part in parts if len(part[fields[0]]) > 0]
+        if len(filled) == 0:
+            return parts[0] if len(parts) > 0 else {field: np.array([]) for field in fields}
+        return {field: concatenate_columns([part[field] for part in filled]) for field in fields}
+
+    def iter_columns(self, table_name, fields, start = None, end = None, batch_size = 1000):
+        for db in self.databases:
+            yield from db.iter_columns(table_name, fields, start, end, batch_size)
+
+    def time_range(self, table_name):
+        ranges = [db.time_range(table_name) for db in self.databases]
+        ranges = [r for r in ranges if r[0] is not None]
+        if len(ranges) == 0:
+            return None, None
+        return ranges[0][0], ranges[-1][1]
+
+    def close(self):
+        for db in self.databases:
+            db.dbcon.close()
+
+
+def open_database(name, start = None, end = None):
+    """
+    Open a dataset for reading, partitioned or not.
+
+    :param name: A database name, a dataset name with a catalog, or the name of the catalog itself.
+    :param start: For partitioned datasets, only open partitions with frames at or after this time.
+    :param end: For partitioned datasets, only open partitions with frames before this time.
+    :return: An SVDB or a PartitionedSVDB.
+    """
+    if name.endswith(CATALOG_SUFFIX):
+        name = name[:-len(CATALOG_SUFFIX)]
+    if SVCatalog.exists(name):
+        return PartitionedSVDB(name, start, end)
+    return SVDB(name)
+
+
+def dataset_size(name):
+    """The size on disk of a dataset, partitioned or not, in bytes."""
+    if SVCatalog.exists(name):
+        catalog = SVCatalog(name, readonly = True)
+        try:
+            return catalog.size() + database_size(name)  # And {name}.db, if it was logged without partitioning.
+        finally:
+            catalog.close()
+    return database_size(name)
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+
+
+class BoundedQueue():
+    """
+    A bounded FIFO between two pipeline stages with an explicit policy for when it is full.
+
+    BLOCK: wait up to timeout seconds for space (backpressure on the producer), then drop the new item.
+    DROP_OLDEST: discard the oldest queued item to make room, so the consumer always sees the newest data.
+    DROP_NEWEST: discard the new item.
+    close() never blocks, so a producer can always shut down, even when the consumer has died with the queue full.
+    The consumer sees each close once, as a None from get(). Call reopen() before restarting a stage on the queue.
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    POLICIES = [BLOCK, DROP_OLDEST, DROP_NEWEST]
+    CLOSED_POLL = 0.1  # How often a waiting get() checks for a close() that found the queue full, in seconds.
+
+    def __init__(self, maxsize: int, policy: str = BLOCK, timeout: float = 1.0) -> None:
+        """
+        :param maxsize: The maximum number of queued items.
+        :param policy: One of POLICIES.
+        :param timeout: How long a BLOCK put waits for space, in seconds.
+        """
+
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown queue policy: {policy}')
+        self.maxsize = int(maxsize)
+        self.policy = policy
+        self.timeout = timeout
+        self.dropped = 0
+        self._queue = queue.Queue(self.maxsize)
+        self._closed = threading.Event()
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, item) -> bool:
+        """
+        Queue an item according to the policy.
+
+        :param item: Anything but None, which is reserved for close().
+        :return: True if the item was queued. Always False once the queue is closed.
+        """
+
+        if self._closed.is_set():
+            self.dropped += 1
+            return False
+        if self.policy == self.BLOCK:
+            try:
+                self._queue.put(item, timeout=self.timeout)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                return False
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                if self.policy == self.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def get(self, timeout: float = None):
+        """
+        Take the oldest item.
+
+        :param timeout: Seconds to wait. None waits forever.
+        :return: The item, or None once the producer has closed the queue and every queued item was taken.
+        :raises queue.Empty: If nothing arrived within the timeout.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.CLOSED_POLL if deadline is None else min(self.CLOSED_POLL, max(deadline - time.monotonic(), 0))
+            try:
+                item = self._queue.get(timeout=wait)
+                if item is None:
+                    self._closed.clear()
+                return item
+            except queue.Empty:
+                if self._closed.is_set():  # close() found the queue full, and it has drained since.
+                    self._closed.clear()
+                    return None
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    def close(self) -> None:
+        """Signal the consumer that no more items will arrive. Never blocks, and the signal is never dropped."""
+
+        self._closed.set()
+        try:
+            self._queue.put_nowait(None)  # Wakes a waiting get() at once. When full, get() notices the flag instead.
+        except queue.Full:
+            pass
+
+    def reopen(self) -> None:
+        """Forget a close() that no consumer saw, e.g. because it died. Queued items are kept."""
+
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._closed.clear()
+        for item in items:
+            if item is not None:
+                self._queue.put_nowait(item)
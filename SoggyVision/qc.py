@@ -30,6 +30,24 @@ def gap_test(now, tim_stmp, buffer_length, frame_length, time_inc = 0.25):
     else:
         return FLAGS.PASS
 
+@staticmethod
+def gap_test_batch(times, previous_time = None, time_inc = 0.25, tolerance = 0.125):
+    """
+    Gap test on reconstructed frame times (see ElapsedTimeClock). A frame fails if more than time_inc + tolerance
+    seconds passed since the frame before it. Unlike gap_test, read delays and batched reads do not fail frames
+    because the times come from the instrument clock.
+
+    :param times: (N,) datetime64 frame times, oldest first.
+    :param previous_time: The time of the frame before the first one, or None.
+    :param time_inc: The expected interval between frames in seconds.
+    :param tolerance: The allowed lateness in seconds.
+    :return: (N,) int8 flags
+    """
+    times = np.asarray(times, dtype = 'datetime64[ns]')
+    previous = np.concatenate([[times[0] if previous_time is None else np.datetime64(previous_time, 'ns')], times[:-1]])
+    intervals = (times - previous) / np.timedelta64(1, 's')
+    return np.where(intervals > time_inc + tolerance, FLAGS.FAIL, FLAGS.PASS).astype(np.int8)
+
 @staticmethod
 def syntax_test(rec_char, nchar, checksum):
     if len(rec_char) - 3 != nchar:
@@ -0,0 +1,219 @@
+from datetime import datetime, timedelta
+import mmap
+import numpy as np
+import os
+import struct
+
+from SoggyVision.acs import ACS, ACSFrameBlock, gather_frames
+
+
+class RawFileReader():
+    """
+    Stream frames from a raw ACS binary capture (a serial dump or a .bin log) using memory mapped I/O.
+
+    Registration offsets are located in bulk with numpy and frames are decoded and converted in chunks, so memory use
+    is bounded by chunk_frames regardless of the file size. Frames that fail the checksum are dropped by default.
+    """
+
+    def __init__(self, filepath: os.path.abspath, acs: ACS, chunk_frames: int = 10000,
+                 start_time: datetime = None, drop_invalid: bool = True) -> None:
+        """
+        :param filepath: The location of the raw capture.
+        :param acs: An ACS object built from the calibration file of the instrument that made the capture.
+        :param chunk_frames: The approximate number of frames decoded at a time.
+        :param start_time: The time of the first frame. If None, the file modification time is taken as the time
+            of the last frame and the start is derived from the instrument elapsed time.
+        :param drop_invalid: Drop frames with an invalid checksum.
+        """
+
+        self.filepath = os.path.normpath(filepath)
+        self.acs = acs
+        self.drop_invalid = drop_invalid
+        self.frame_span = self.acs.packet_length + 2  # Frame plus checksum.
+        self.chunk_bytes = max(int(chunk_frames), 1) * (self.frame_span + 1)
+
+        self._file = open(self.filepath, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+            self._array = np.frombuffer(self._mmap, dtype = np.uint8)
+        else:
+            self._mmap = None
+            self._array = np.zeros(0, dtype = np.uint8)
+
+        self.first_elapsed_time, last_elapsed_time = self.__get_elapsed_time_range()
+        if start_time is None:
+            mtime = datetime.fromtimestamp(os.path.getmtime(self.filepath))
+            start_time = mtime - timedelta(milliseconds = last_elapsed_time - self.first_elapsed_time)
+        self.start_time = np.datetime64(start_time, 'ns')
+
+        self.frames = 0
+        self.invalid_frames = 0
+        self.discarded_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, et, ev, etb):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_blocks()
+
+    def close(self) -> None:
+        self._array = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __get_elapsed_time_range(self) -> tuple:
+        """Read the elapsed time of the first and last complete frames in the file."""
+
+        offset = self.acs.packet_dtype.fields['elapsed_time'][1]
+        if self._mmap is None:
+            return 0, 0
+        first = self._mmap.find(self.acs.PACKET_REGISTRATION)
+        last = self._mmap.rfind(self.acs.PACKET_REGISTRATION, 0, max(self.size - self.frame_span + 1, 0))
+        if first == -1 or last == -1 or first + self.frame_span > self.size:
+            return 0, 0
+        first_elapsed_time = struct.unpack_from('!I', self._mmap, first + offset)[0]
+        last_elapsed_time = struct.unpack_from('!I', self._mmap, last + offset)[0]
+        return first_elapsed_time, last_elapsed_time
+
+    def find_registrations(self, start: int, stop: int) -> np.ndarray:
+        """
+        Locate every packet registration that begins within [start, stop).
+        Runs of repeated registrations collapse to the last one, as in ACS.find_packet.
+
+        :param start: The first byte to search.
+        :param stop: One past the last byte a registration may begin at.
+        :return: Sorted array of byte offsets.
+        """
+
+        registration = self.acs.PACKET_REGISTRATION
+        n = len(registration)
+        window = self._array[start:min(stop + n - 1, self.size)]
+        if len(window) < n:
+            return np.zeros(0, dtype = np.int64)
+        mask = window[:len(window) - n + 1] == registration[0]
+        for k in range(1, n):
+            mask &= window[k:len(window) - n + 1 + k] == registration[k]
+        hits = np.flatnonzero(mask).astype(np.int64) + start
+        if len(hits) > 1:
+            keep = np.ones(len(hits), dtype = bool)
+            keep[:-1] = hits[1:] != hits[:-1] + 2
+            hits = hits[keep]
+        return hits
+
+    def iter_offsets(self):
+        """
+        Yield arrays of frame start offsets, one array per chunk.
+        Frames never overlap and a frame that straddles a chunk boundary belongs to the chunk it starts in.
+        A frame that was cut short by the next registration is discarded and the scan resumes at that registration.
+        """
+
+        pos = 0
+        next_allowed = 0
+        previous_end = None
+        while pos < self.size:
+            end = min(pos + self.chunk_bytes, self.size)
+            hits = self.find_registrations(pos, end + self.frame_span)
+            truncated = set(self.__find_truncated(hits).tolist())
+            starts = []
+            for hit in hits.tolist():
+                if hit < next_allowed or hit in truncated:
+                    continue
+                if hit >= end or hit + self.frame_span > self.size:
+                    break
+                starts.append(hit)
+                next_allowed = hit + self.frame_span
+            starts = np.array(starts, dtype = np.int64)
+
+            if len(starts) > 0:
+                # Bytes between frames are discarded, except the single pad byte that follows each checksum.
+                ends = np.concatenate([[previous_end if previous_end is not None else 0], starts[:-1] + self.frame_span])
+                gaps = starts - ends
+                has_pad = (gaps > 0) & (self._array[np.minimum(ends, self.size - 1)] == 0)
+                if previous_end is None:
+                    has_pad[0] = False
+                self.discarded_bytes += int(gaps.sum() - has_pad.sum())
+                previous_end = int(starts[-1]) + self.frame_span
+                yield starts
+            pos = max(end, next_allowed)
+
+    def __find_truncated(self, hits: np.ndarray) -> np.ndarray:
+        """
+        :param hits: Registration offsets, as returned by find_registrations.
+        :return: The offsets of frames that contain the next registration and fail the checksum.
+        """
+
+        candidates = hits[:-1][np.diff(hits) < self.frame_span]
+        candidates = candidates[candidates + self.frame_span <= self.size]
+        _, valid = self.read_frames(candidates)
+        return candidates[~valid]
+
+    def find_offsets(self) -> np.ndarray:
+        """Locate the start offset of every frame in the file."""
+
+        offsets = list(self.iter_offsets())
+        if len(offsets) == 0:
+            return np.zeros(0, dtype = np.int64)
+        return np.concatenate(offsets)
+
+    def read_frames(self, offsets: np.ndarray) -> tuple:
+        """
+        Copy frames out of the file.
+
+        :param offsets: Frame start offsets.
+        :return: frames: (N, packet_length) uint8 array
+                 valid: (N,) boolean array, True where the checksum matches
+        """
+
+        spans = gather_frames(self._array, offsets, self.frame_span)
+        frames = spans[:, :self.acs.packet_length]
+        checksums = spans[:, self.acs.packet_length:].astype(np.uint16)
+        checksums = (checksums[:, 0] << 8) | checksums[:, 1]
+        valid = (frames.sum(axis = 1, dtype = np.uint64) & 0xFFFF) == checksums
+        return frames, valid
+
+    def read_block(self, offsets: np.ndarray) -> ACSFrameBlock:
+        """
+        Decode and convert the frames at the given offsets.
+
+        :param offsets: Frame start offsets, as yielded by iter_offsets.
+        :return: An ACSFrameBlock, or None if no valid frames remain.
+        """
+
+        frames, valid = self.read_frames(offsets)
+        self.frames += len(frames)
+        self.invalid_frames += int((~valid).sum())
+        if self.drop_invalid:
+            frames = frames[valid]
+        if len(frames) == 0:
+            return None
+        elapsed_time = self.acs.decode_frames(frames).elapsed_time.astype(np.int64)
+        times = self.start_time + (elapsed_time - self.first_elapsed_time).astype('timedelta64[ms]')
+        return self.acs.get_data_block(times, frames)
+
+    def iter_blocks(self):
+        """Decode and convert the file one chunk at a time, yielding an ACSFrameBlock per chunk."""
+
+        for offsets in self.iter_offsets():
+            block = self.read_block(offsets)
+            if block is not None:
+                yield block
+
+
+def replay_file(filepath: os.path.abspath, acs: ACS, **kwargs) -> ACSFrameBlock:
+    """
+    Convert a whole raw capture into a single ACSFrameBlock.
+
+    :param filepath: The location of the raw capture.
+    :param acs: An ACS object built from the matching calibration file.
+    :param kwargs: Passed to RawFileReader.
+    :return: An ACSFrameBlock holding every valid frame.
+    """
+
+    with RawFileReader(filepath, acs, **kwargs) as reader:
+        return ACSFrameBlock.concatenate(list(reader.iter_blocks()))
@@ -0,0 +1,203 @@
+"""
+Offline conversion of raw captures and databases, in parallel across processes.
+
+Usage: python -m SoggyVision.reprocess ACS-00291.dev capture1.bin capture2.bin ... --name reprocessed
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import os
+import sys
+
+from SoggyVision.acs import ACS, ACSFrameBlock
+from SoggyVision.compression import CODECS
+from SoggyVision.core import build_directories
+from SoggyVision.database import SVDB, ACSDataTable
+from SoggyVision.qc import FLAGS, gap_test_batch
+from SoggyVision.replay import RawFileReader
+from SoggyVision.storage import BACKENDS, SQLITE, open_backend, session_metadata
+
+DB_EXTENSION = '.db'
+
+_acs = None  # The calibration of a worker process, built once by _init_worker.
+
+
+def _init_worker(dev_filepath: os.path.abspath, lut_step: float = None) -> None:
+    """Build the ACS calibration once per worker process."""
+
+    global _acs
+    _acs = ACS(dev_filepath, lut_step)
+
+
+def _convert_raw_chunk(task: tuple) -> ACSFrameBlock:
+    """Convert a frame-aligned chunk of a raw capture."""
+
+    filepath, offsets, start_time, drop_invalid = task
+    with RawFileReader(filepath, _acs, start_time = start_time, drop_invalid = drop_invalid) as reader:
+        return reader.read_block(offsets)
+
+
+def _convert_database(task: tuple) -> ACSFrameBlock:
+    """Reconvert the raw frames stored in a SoggyVision database."""
+
+    filepath, = task
+    db = SVDB.from_file(filepath)  # The given path, not a name in DB_DIR.
+    columns = db.select_columns(ACSDataTable.name, ['time', 'frame'])  # Decodes either schema.
+    db.dbcon.close()
+    if len(columns['time']) == 0:
+        return None
+    times = np.array([np.datetime64(datetime.fromisoformat(t), 'ns') for t in columns['time']])
+    return _acs.get_data_block(times, columns['frame'])
+
+
+def build_tasks(inputs: list, acs: ACS, chunk_frames: int = 50000, drop_invalid: bool = True) -> list:
+    """
+    Split inputs into independent conversion tasks.
+    Raw captures are split into frame-aligned chunks. Databases are converted whole.
+
+    :param inputs: Filepaths of raw captures and/or SoggyVision databases.
+    :param acs: The ACS calibration used to locate frames.
+    :param chunk_frames: The maximum number of frames in a raw capture task.
+    :param drop_invalid: Drop frames with an invalid checksum.
+    :return: A list of (function, task) pairs.
+    """
+
+    tasks = []
+    for filepath in inputs:
+        if os.path.splitext(filepath)[-1].lower() == DB_EXTENSION:
+            tasks.append((_convert_database, (filepath,)))
+            continue
+        with RawFileReader(filepath, acs, chunk_frames = chunk_frames) as reader:
+            start_time = reader.start_time
+            offsets = reader.find_offsets()
+        for i in range(0, len(offsets), chunk_frames):
+            tasks.append((_convert_raw_chunk, (filepath, offsets[i:i + chunk_frames], start_time, drop_invalid)))
+    return tasks
+
+
+def _run_task(function_task: tuple) -> ACSFrameBlock:
+    function, task = function_task
+    return function(task)
+
+
+def _merge(blocks: list) -> ACSFrameBlock:
+    """Join the converted chunks of one input in time order. None if there are none."""
+
+    blocks = [block for block in blocks if block is not None]
+    if len(blocks) == 0:
+        return None
+    block = ACSFrameBlock.concatenate(blocks)
+    return block.take(np.argsort(block.time, kind = 'stable'))
+
+
+def reprocess(inputs: list, dev_filepath: os.path.abspath, max_workers: int = None, chunk_frames: int = 50000,
+              lut_step: float = None, drop_invalid: bool = True):
+    """
+    Convert many raw captures and databases from one instrument, in parallel across processes.
+    Each worker builds the calibration once. Results are yielded one input at a time, in the order given, and match a
+    single-process run. At most two tasks per worker are in flight, so memory use depends on the largest input, not on
+    the number of inputs.
+
+    :param inputs: Filepaths of raw captures and/or SoggyVision databases.
+    :param dev_filepath: The calibration file of the instrument.
+    :param max_workers: The number of worker processes. 0 converts in this process. None uses every core.
+    :param chunk_frames: The maximum number of frames in a raw capture task.
+    :param lut_step: If given, use delta T lookup tables at this resolution.
+    :param drop_invalid: Drop frames with an invalid checksum.
+    :return: A generator of (filepath, ACSFrameBlock sorted by time), with None for an input without frames.
+    """
+
+    acs = ACS(dev_filepath, lut_step)
+    if max_workers == 0:
+        _init_worker(dev_filepath, lut_step)
+        for filepath in inputs:
+            yield filepath, _merge([_run_task(task) for task in build_tasks([filepath], acs, chunk_frames,
+                                                                             drop_invalid)])
+        return
+
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = _init_worker,
+                             initargs = (dev_filepath, lut_step)) as executor:
+        in_flight = 2 * (max_workers or os.cpu_count() or 1)
+        pending = deque()  # (filepath, futures of its tasks), in input order.
+        for filepath in inputs:
+            futures = []
+            pending.append((filepath, futures))
+            for task in build_tasks([filepath], acs, chunk_frames, drop_invalid):
+                while sum(len(f) for _, f in pending) >= in_flight and len(pending) > 1:
+                    done, futures_done = pending.popleft()
+                    yield done, _merge([future.result() for future in futures_done])
+                futures.append(executor.submit(_run_task, task))
+        while len(pending) > 0:
+            done, futures_done = pending.popleft()
+            yield done, _merge([future.result() for future in futures_done])
+
+
+def write_reprocessed(results, acs: ACS, name: str, backend = SQLITE, codec: str = None) -> int:
+    """
+    Stream the results of reprocess into one logging session, as the acquisition stack would have logged them.
+
+    :param results: (filepath, ACSFrameBlock) pairs, see reprocess. Inputs should be given in time order.
+    :param acs: The calibration of the instrument, for the session metadata and flags.
+    :param name: The database name of the session.
+    :param backend: One of SoggyVision.storage.BACKENDS.
+    :param codec: A codec of the backend, or None.
+    :return: The number of frames written.
+    """
+
+    storage = open_backend(backend, codec = codec)
+    writer = None
+    previous_time = None
+    frames = 0
+    try:
+        for _, block in results:
+            if block is None:
+                continue
+            if writer is None:
+                writer = storage.open_session(name, session_metadata(acs, block[0].time))
+            gap_test_results = gap_test_batch(block.time, previous_time)
+            previous_time = block.time[-1]
+            for gap_test_result, data in zip(gap_test_results.tolist(), block):
+                writer.add(data, acs.get_flags(data, gap_test_result, FLAGS.PASS), data.time)  # Checksums passed.
+            frames += len(block)
+    finally:
+        if writer is not None:
+            storage.close_session(writer)
+        storage.close()
+    return frames
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description = 'Convert raw captures and databases of one ACS in parallel.')
+    parser.add_argument('dev', help = 'The .dev file of the instrument.')
+    parser.add_argument('inputs', nargs = '+', help = 'Raw captures and/or SoggyVision databases, in time order.')
+    parser.add_argument('--name', required = True, help = 'The database name to write the converted frames to.')
+    parser.add_argument('--workers', type = int, default = None,
+                        help = 'The number of worker processes. 0 converts in this process. Default: every core.')
+    parser.add_argument('--chunk-frames', type = int, default = 50000, help = 'Frames per raw capture task.')
+    parser.add_argument('--lut-step', type = float, default = None,
+                        help = 'Use delta T lookup tables at this temperature resolution, e.g. 0.001.')
+    parser.add_argument('--backend', choices = BACKENDS, default = SQLITE, help = 'Where to write the frames.')
+    parser.add_argument('--compression', choices = CODECS, default = None,
+                        help = 'Compress the rows of each commit into one block per table. netcdf supports zlib.')
+    return parser
+
+
+def main(argv: list = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    build_directories()
+    acs = ACS(args.dev, args.lut_step)
+    results = reprocess(args.inputs, args.dev, args.workers, args.chunk_frames, args.lut_step)
+    try:
+        frames = write_reprocessed(results, acs, args.name, args.backend, args.compression)
+    except ValueError as error:  # An option the backend does not support.
+        parser.error(str(error))
+    print(f"Wrote {frames} frames from {len(args.inputs)} inputs to {args.name}.", file = sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import serial
 import serial.tools.list_ports
+from struct import calcsize, unpack_from
+import threading
+import time
+from typing import NamedTuple
 
 
 class RS232():
@@ -46,3 +51,96 @@ class RS232():
     def disconnect(self):
         self._serial.close()
 
+
+PACKET_REGISTRATION = b'\xff\x00\xff\x00'
+FRAME_LENGTH_FORMAT = '!H'  # Immediately after the registration. Counts the registration, header and spectra.
+SERIAL_NUMBER_FORMAT = '!l'  # After the frame length, frame type and a reserved byte.
+SERIAL_NUMBER_OFFSET = len(PACKET_REGISTRATION) + 4
+MIN_FRAME_LENGTH = len(PACKET_REGISTRATION) + calcsize('!HBBlHHHHHHHIBB')
+MAX_FRAME_LENGTH = 4096
+
+
+class ProbeResult(NamedTuple):
+    port: str
+    serial_number_hexdec: int
+    frame: bytes
+
+
+def find_valid_frame(buffer: bytearray) -> tuple:
+    """
+    Find the first frame with a valid checksum, without knowing the calibration of the instrument.
+    The frame length is read from the frame itself.
+
+    :param buffer: Bytes read from a port.
+    :return: frame: the first valid frame, or None
+             keep: the index of the first byte that could still start a valid frame
+    """
+
+    i = buffer.find(PACKET_REGISTRATION)
+    while i != -1:
+        if i + SERIAL_NUMBER_OFFSET > len(buffer):
+            return None, i
+        frame_length = unpack_from(FRAME_LENGTH_FORMAT, buffer, i + len(PACKET_REGISTRATION))[0]
+        if MIN_FRAME_LENGTH <= frame_length <= MAX_FRAME_LENGTH:
+            end = i + frame_length
+            if end + 2 > len(buffer):
+                return None, i
+            if sum(buffer[i:end]) & 0xFFFF == unpack_from('!H', buffer, end)[0]:
+                return bytes(buffer[i:end]), end + 2
+        i = buffer.find(PACKET_REGISTRATION, i + 1)
+    return None, max(len(buffer) - len(PACKET_REGISTRATION) + 1, 0)
+
+
+def probe_port(port: str, baudrate: int = 115200, timeout: float = 3.0, stop: threading.Event = None) -> ProbeResult:
+    """
+    Listen to a port until a valid ACS frame arrives.
+
+    :param port: The port to listen to.
+    :param baudrate: The baudrate of the ACS, 115200 unless the .dev file says otherwise.
+    :param timeout: Give up after this many seconds.
+    :param stop: Give up early when this event is set, e.g. because another port has already been found.
+    :return: A ProbeResult, or None if no valid frame arrived or the port could not be opened.
+    """
+
+    try:
+        _serial = serial.serial_for_url(port, baudrate = int(baudrate), timeout = 0.1)
+    except (serial.SerialException, ValueError, OSError):
+        return None
+    try:
+        buffer = bytearray()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not (stop is not None and stop.is_set()):
+            buffer += _serial.read(max(_serial.in_waiting, 1))
+            frame, keep = find_valid_frame(buffer)
+            if frame is not None:
+                serial_number_hexdec = unpack_from(SERIAL_NUMBER_FORMAT, frame, SERIAL_NUMBER_OFFSET)[0]
+                return ProbeResult(port = port, serial_number_hexdec = serial_number_hexdec, frame = frame)
+            del buffer[:keep]
+        return None
+    except (serial.SerialException, OSError):
+        return None
+    finally:
+        _serial.close()
+
+
+def probe_ports(ports: list, baudrate: int = 115200, timeout: float = 3.0) -> ProbeResult:
+    """
+    Listen to every port at once and return as soon as one of them delivers a valid ACS frame.
+
+    :param ports: The ports to listen to.
+    :param baudrate: The baudrate of the ACS.
+    :param timeout: Give up after this many seconds.
+    :return: The first ProbeResult, or None if no port delivered a valid frame.
+    """
+
+    if len(ports) == 0:
+        return None
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers = len(ports)) as executor:
+        futures = [executor.submit(probe_port, port, baudrate, timeout, stop) for port in ports]
+        for future in as_completed(futures):
+            result = future.result()
+            if result is not None:
+                stop.set()  # The other probes close their ports and return.
+                return result
+    return None
@@ -0,0 +1,321 @@
+"""
+Simulate an ACS for load, soak and throughput testing without a meter attached.
+
+Frames are built from a parsed .dev file, so they carry the packet registration, header layout, serial number and
+wavelength count of that instrument, a valid checksum and pad byte, and spectra that convert to plausible a_m and c_m.
+Frames can be written to a pseudo-terminal (attach DataAcquisition to the printed port), a TCP socket (attach to
+socket://host:port) or a raw capture file (read with RawFileReader), with optional corruption, partial frames,
+garbage bytes and stalls that release frames in bursts.
+
+Usage: python -m SoggyVision.simulator ACS-00291.dev --pty --rate 4
+"""
+
+import argparse
+import os
+import socket
+import sys
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from SoggyVision.acs import ACS
+
+
+class SimulatorStats(NamedTuple):
+    frames: int
+    corrupted: int
+    partial: int
+    garbage_bytes: int
+    bytes_written: int
+
+
+class ACSSimulator():
+    """
+    Generate ACS frames for a calibration at a nominal rate.
+
+    The elapsed_time field advances by 1000/rate milliseconds per frame whether or not output is paced in real time,
+    so captures written as fast as possible still carry a realistic instrument clock.
+    """
+
+    def __init__(self, acs: ACS, rate: float = 4, seed: int = None,
+                 internal_temperature: float = 20.0, external_temperature: float = 15.0,
+                 corrupt: float = 0.0, partial: float = 0.0, garbage: float = 0.0,
+                 stall_every: float = None, stall: float = 0.0) -> None:
+        """
+        :param acs: The calibration of the simulated instrument.
+        :param rate: Frames per second.
+        :param seed: Seed for the random number generator, for repeatable output.
+        :param internal_temperature: The simulated internal temperature in degrees Celsius.
+        :param external_temperature: The simulated external temperature in degrees Celsius.
+        :param corrupt: Probability that a frame has a byte altered, so it fails the checksum.
+        :param partial: Probability that a frame is cut short.
+        :param garbage: Probability that random bytes are inserted before a frame.
+        :param stall_every: When paced, pause output every this many seconds. The frames due during the pause are
+            then written in one burst.
+        :param stall: The length of a pause in seconds.
+        """
+
+        self.acs = acs
+        self.rate = float(rate)
+        self.rng = np.random.default_rng(seed)
+        self.corrupt = corrupt
+        self.partial = partial
+        self.garbage = garbage
+        self.stall_every = stall_every
+        self.stall = stall
+        self.frame_span = self.acs.packet_length + 3  # Frame, checksum and pad byte.
+        self.elapsed_time = 0.0
+
+        self.frames = 0
+        self.corrupted = 0
+        self.partials = 0
+        self.garbage_bytes = 0
+        self.bytes_written = 0
+
+        self.t_internal = self.__invert(self.acs.compute_internal_temperature_batch, internal_temperature)
+        self.t_external = self.__invert(self.acs.compute_external_temperature_batch, external_temperature)
+        self.__build_spectra(internal_temperature)
+
+    @staticmethod
+    def __invert(conversion, temperature: float) -> int:
+        """Find the thermistor counts that convert closest to a temperature."""
+
+        counts = np.arange(1, 59000)  # Stay below the 4.516 V limit of the internal thermistor conversion.
+        return int(counts[np.nanargmin(np.abs(conversion(counts) - temperature))])
+
+    def __build_spectra(self, internal_temperature: float) -> None:
+        """
+        Pick target a_m and c_m spectra typical of coastal water, and the reference counts and signal/reference
+        ratios that produce them through the calibration at the simulated temperature.
+        """
+
+        x = self.acs.path_length
+        wavelength_a = self.acs.wavelength_a
+        wavelength_c = self.acs.wavelength_c
+        self.a_m = 0.05 + 0.3 * np.exp(-0.014 * (wavelength_a - 440))
+        self.c_m = 0.05 + 0.3 * np.exp(-0.014 * (wavelength_c - 440)) + 0.4 * (550 / wavelength_c)
+
+        ratios = []
+        for channel, offsets, measured in [('a', self.acs.offset_a, self.a_m), ('c', self.acs.offset_c, self.c_m)]:
+            uncorrected = offsets - self.acs.get_delta_t(channel, internal_temperature) - measured
+            ratios.append(np.exp(x * uncorrected))
+        self.ratio_a, self.ratio_c = ratios
+
+        references = []
+        for wavelength, ratio in [(wavelength_a, self.ratio_a), (wavelength_c, self.ratio_c)]:
+            reference = 30000 * (0.4 + 0.6 * np.exp(-((wavelength - 550) / 150) ** 2))
+            reference *= min(1.0, 50000 / float(np.max(reference * ratio)))  # Keep signals within uint16.
+            references.append(reference)
+        self.reference_a, self.reference_c = references
+
+    def generate(self, n: int) -> np.ndarray:
+        """
+        Build n valid frames, each followed by its checksum and pad byte.
+
+        :param n: The number of frames.
+        :return: (n, packet_length + 3) uint8 array
+        """
+
+        nw = self.acs.output_wavelengths
+        records = np.zeros(n, dtype = self.acs.packet_dtype)
+        records['packet_registration'] = self.acs.PACKET_REGISTRATION
+        records['frame_length'] = self.acs.packet_length
+        records['frame_type'] = 5
+        records['serial_number_hexdec'] = int(self.acs.sn_hexdec, 16)
+        records['number_of_wavelengths'] = nw
+        records['reserved_2'] = 1
+        records['pressure_signal'] = 0
+        for name, level in [('a_reference_dark', 110), ('a_signal_dark', 120), ('c_reference_dark', 105),
+                            ('c_signal_dark', 115)]:
+            records[name] = level + self.rng.integers(-3, 4, n)
+        records['t_internal'] = self.t_internal + self.rng.integers(-1, 2, n)
+        records['t_external'] = self.t_external + self.rng.integers(-1, 2, n)
+        elapsed_time = self.elapsed_time + np.arange(n) * 1000 / self.rate
+        records['elapsed_time'] = np.round(elapsed_time).astype(np.int64) % 2 ** 32
+        self.elapsed_time += n * 1000 / self.rate
+
+        noise = 1 + 0.002 * self.rng.standard_normal((4, n, nw))
+        c_reference = self.reference_c * noise[0]
+        a_reference = self.reference_a * noise[1]
+        c_signal = c_reference * self.ratio_c * noise[2]
+        a_signal = a_reference * self.ratio_a * noise[3]
+        spectra = np.stack([c_reference, a_reference, c_signal, a_signal], axis = 2)
+        records['spectra'] = np.clip(np.rint(spectra), 1, 65535)
+
+        frames = records.view(np.uint8).reshape(n, self.acs.packet_length)
+        checksums = frames.sum(axis = 1, dtype = np.uint64) & 0xFFFF
+        spans = np.zeros((n, self.frame_span), dtype = np.uint8)
+        spans[:, :self.acs.packet_length] = frames
+        spans[:, -3] = checksums >> 8
+        spans[:, -2] = checksums & 0xFF
+        return spans
+
+    def chunk(self, n: int) -> bytes:
+        """
+        Build the bytes for n frames, with faults injected at the configured probabilities.
+
+        :param n: The number of frames.
+        :return: The bytes to write.
+        """
+
+        spans = self.generate(n)
+        self.frames += n
+        if not (self.corrupt or self.partial or self.garbage):
+            return spans.tobytes()
+
+        corrupt = self.rng.random(n) < self.corrupt
+        partial = self.rng.random(n) < self.partial
+        garbage = self.rng.random(n) < self.garbage
+        pieces = []
+        for i in range(n):
+            span = spans[i]
+            if garbage[i]:
+                noise = self.rng.integers(0, 256, int(self.rng.integers(1, 65)), dtype = np.uint8).tobytes()
+                self.garbage_bytes += len(noise)
+                pieces.append(noise)
+            if corrupt[i]:
+                span = span.copy()
+                span[self.rng.integers(self.acs.LEN_PACKET_REGISTRATION, self.acs.packet_length)] ^= 0x55
+                self.corrupted += 1
+            if partial[i]:
+                span = span[:self.rng.integers(1, self.frame_span - 1)]
+                self.partials += 1
+            pieces.append(span.tobytes())
+        return b''.join(pieces)
+
+    def run(self, write, count: int = None, duration: float = None, realtime: bool = True, stop = None) -> None:
+        """
+        Write frames until count frames, duration seconds or a stop request, whichever comes first.
+
+        :param write: A callable that writes bytes, e.g. file.write or socket.sendall.
+        :param count: The number of frames to write. None for no limit.
+        :param duration: The number of seconds to run. None for no limit.
+        :param realtime: Pace output at the frame rate. If False, write as fast as possible.
+        :param stop: An object with is_set() (e.g. threading.Event) that ends the run when set.
+        """
+
+        if count is None and duration is None and stop is None and not realtime:
+            raise ValueError('An unpaced run needs a count, a duration or a stop event.')
+        batch = max(int(self.rate / 100), 1)  # Write in batches of at most ~10 ms of frames.
+        written = 0
+        t0 = time.monotonic()
+        next_stall = t0 + self.stall_every if self.stall_every else None
+        while count is None or written < count:
+            now = time.monotonic()
+            if (duration is not None and now - t0 >= duration) or (stop is not None and stop.is_set()):
+                break
+            if realtime:
+                if next_stall is not None and now >= next_stall:
+                    time.sleep(self.stall)
+                    next_stall = time.monotonic() + self.stall_every
+                    continue
+                due = int((now - t0) * self.rate) + 1 - written
+                if due <= 0:
+                    time.sleep(min((written - (now - t0) * self.rate) / self.rate, 0.01) + 1e-4)
+                    continue
+            else:
+                due = batch
+            n = due if count is None else min(due, count - written)
+            data = self.chunk(n)
+            write(data)
+            written += n
+            self.bytes_written += len(data)
+
+    def stats(self) -> SimulatorStats:
+        return SimulatorStats(frames = self.frames,
+                              corrupted = self.corrupted,
+                              partial = self.partials,
+                              garbage_bytes = self.garbage_bytes,
+                              bytes_written = self.bytes_written)
+
+
+def open_pty() -> tuple:
+    """
+    Open a raw pseudo-terminal pair. POSIX only.
+
+    :return: master file descriptor to write frames to, port name to attach DataAcquisition to
+    """
+
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)  # No newline translation or echo, so binary frames pass unchanged.
+    return master, os.ttyname(slave)
+
+
+def write_fd(fd: int):
+    """Return a callable that writes all bytes to a file descriptor."""
+
+    def write(data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    return write
+
+
+def serve_tcp(simulator: ACSSimulator, host: str = '127.0.0.1', port: int = 5600, **kwargs) -> None:
+    """
+    Serve frames to one TCP client at a time, forever. Attach with the port socket://host:port.
+
+    :param simulator: The frame source.
+    :param host: The address to listen on.
+    :param port: The TCP port to listen on.
+    :param kwargs: Passed to ACSSimulator.run for each client.
+    """
+
+    with socket.create_server((host, port)) as server:
+        while True:
+            client, _ = server.accept()
+            with client:
+                try:
+                    simulator.run(client.sendall, **kwargs)
+                except OSError:  # The client disconnected.
+                    pass
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description = 'Simulate an ACS from its .dev file.')
+    parser.add_argument('dev', help = 'The .dev file of the simulated instrument.')
+    output = parser.add_mutually_exclusive_group(required = True)
+    output.add_argument('--pty', action = 'store_true', help = 'Write to a pseudo-terminal and print its name.')
+    output.add_argument('--tcp', metavar = 'HOST:PORT', help = 'Serve frames over TCP.')
+    output.add_argument('--file', help = 'Write a raw capture to this file as fast as possible.')
+    parser.add_argument('--rate', type = float, default = 4, help = 'Frames per second.')
+    parser.add_argument('--count', type = int, default = None, help = 'Stop after this many frames.')
+    parser.add_argument('--duration', type = float, default = None, help = 'Stop after this many seconds.')
+    parser.add_argument('--corrupt', type = float, default = 0, help = 'Probability of a bad checksum per frame.')
+    parser.add_argument('--partial', type = float, default = 0, help = 'Probability of a truncated frame.')
+    parser.add_argument('--garbage', type = float, default = 0, help = 'Probability of garbage before a frame.')
+    parser.add_argument('--stall-every', type = float, default = None, help = 'Seconds between stalls.')
+    parser.add_argument('--stall', type = float, default = 0, help = 'Stall length in seconds.')
+    parser.add_argument('--seed', type = int, default = None)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    simulator = ACSSimulator(ACS(args.dev), rate = args.rate, seed = args.seed, corrupt = args.corrupt,
+                             partial = args.partial, garbage = args.garbage, stall_every = args.stall_every,
+                             stall = args.stall)
+    try:
+        if args.file is not None:
+            count = args.count if args.count is not None else int(args.rate * (args.duration or 60))
+            with open(args.file, 'wb') as f:
+                simulator.run(f.write, count = count, realtime = False)
+        elif args.tcp is not None:
+            host, _, port = args.tcp.rpartition(':')
+            print(f"Serving {simulator.acs.sn} on socket://{host or '127.0.0.1'}:{port}", flush = True)
+            serve_tcp(simulator, host or '127.0.0.1', int(port), count = args.count, duration = args.duration)
+        else:
+            master, port = open_pty()
+            print(f"Simulating {simulator.acs.sn} on {port}", flush = True)
+            simulator.run(write_fd(master), count = args.count, duration = args.duration)
+    except KeyboardInterrupt:
+        pass
+    print(simulator.stats(), file = sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Storage backends for logged data.
+
+A backend opens one writer per logging session. Every writer has the interface of SVDBWriter: add(data, flags,
+end_time), flush(), flush_if_due(), close() and len() for the number of buffered rows. StorageWriter only talks to
+its backend, so the acquisition stack does not depend on where or how frames are stored. Sessions are closed through
+the backend, see StorageBackend.close_session.
+"""
+
+import json
+
+from SoggyVision.compression import CODECS
+from SoggyVision.database import SVDB, SVDBWriter, ACSMetadataTable
+from SoggyVision.netcdf import NETCDF_CODECS, NetCDFWriter, netcdf_path
+from SoggyVision.partitions import Compactor, PartitionedWriter, parse_partition
+
+SQLITE = 'sqlite'
+NETCDF = 'netcdf'
+BACKENDS = [SQLITE, NETCDF]
+
+
+def session_metadata(acs, begin_time) -> list:
+    """
+    :param acs: The ACS of the session.
+    :param begin_time: The time of the first frame of the session.
+    :return: Values for ACSMetadataTable.fields, with lists as JSON, for StorageBackend.open_session.
+    """
+    metadata = [json.dumps(v) if isinstance(v, list) else float(v) if isinstance(v, float) else int(
+        v) if isinstance(v, int) else str(v) for v in list(acs.get_metadata())]
+    metadata[ACSMetadataTable.fields.index('begin_time')] = begin_time
+    return metadata
+
+
+class StorageBackend():
+    """The interface of a storage backend."""
+
+    def open_session(self, name, metadata, raw_only = False):
+        """
+        Start a logging session.
+
+        :param name: The database name of the session.
+        :param metadata: Values for ACSMetadataTable.fields, with lists as JSON. begin_time is the first frame time.
+        :param raw_only: Only store what is needed to derive the converted products later.
+        :return: A writer with the interface of SVDBWriter.
+        """
+        raise NotImplementedError
+
+    def close_session(self, writer, shutdown = False):
+        """
+        Flush and close the writer of a session.
+
+        :param writer: A writer from open_session.
+        :param shutdown: True when the process is stopping, so work that can wait, such as compaction, is skipped.
+        """
+        writer.close()
+
+    def close(self):
+        """Release what is shared between sessions. Called after every session is closed."""
+
+
+class SQLiteBackend(StorageBackend):
+    """One SoggyVision database per session, or a dataset of rolling partitions with a partition policy."""
+
+    def __init__(self, flush_rows = 500, flush_interval = 1.0, wal = True, synchronous = 'FULL', partition = None,
+                 codec = None):
+        """
+        :param flush_rows: See SVDBWriter.
+        :param flush_interval: See SVDBWriter.
+        :param wal: See SVDB.
+        :param synchronous: See SVDB.
+        :param partition: None, or a partition policy. See parse_partition.
+        :param codec: None, or one of SoggyVision.compression.CODECS.
+        """
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f'Unknown codec: {codec}. Use one of {", ".join(CODECS)}.')
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.wal = wal
+        self.synchronous = synchronous
+        self.partition = parse_partition(partition)
+        self.codec = codec
+        self.compactor = Compactor()
+
+    def open_session(self, name, metadata, raw_only = False):
+        if self.partition is not None:
+            return PartitionedWriter(name, metadata, self.partition, self.flush_rows, self.flush_interval, self.wal,
+                                     self.synchronous, self.compactor, raw_only, self.codec)
+        db = SVDB(name, wal = self.wal, synchronous = self.synchronous)
+        db.insert_data(ACSMetadataTable.name, ACSMetadataTable.fields, metadata)
+        begin_time = metadata[ACSMetadataTable.fields.index('begin_time')]
+        return SVDBWriter(db, begin_time, self.flush_rows, self.flush_interval, raw_only, self.codec)
+
+    def close_session(self, writer, shutdown = False):
+        if self.partition is not None:  # A PartitionedWriter. Its last partition is compacted unless shutting down.
+            writer.close(compact = not shutdown)
+        else:
+            writer.close()
+
+    def close(self):
+        self.compactor.close()
+
+
+class NetCDFBackend(StorageBackend):
+    """One append-only NetCDF4 file per database name, already in the export layout. See NetCDFWriter."""
+
+    def __init__(self, flush_rows = 500, flush_interval = 1.0, codec = None, chunk_rows = None):
+        """
+        :param flush_rows: See NetCDFWriter.
+        :param flush_interval: See NetCDFWriter.
+        :param codec: None, or one of NETCDF_CODECS.
+        :param chunk_rows: See NetCDFWriter.
+        """
+        if codec is not None and codec not in NETCDF_CODECS:
+            raise ValueError(f'Unknown NetCDF codec: {codec}. Use one of {", ".join(NETCDF_CODECS)}.')
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.codec = codec
+        self.chunk_rows = chunk_rows
+
+    def open_session(self, name, metadata, raw_only = False):
+        return NetCDFWriter(netcdf_path(name), metadata, self.flush_rows, self.flush_interval, raw_only, self.codec,
+                            self.chunk_rows)
+
+
+def open_backend(backend = SQLITE, flush_rows = 500, flush_interval = 1.0, wal = True, synchronous = 'FULL',
+                 partition = None, codec = None):
+    """
+    :param backend: One of BACKENDS.
+    :param wal: sqlite only. See SVDB.
+    :param synchronous: sqlite only. See SVDB.
+    :param partition: sqlite only. See parse_partition.
+    :param codec: A codec of the backend, see CODECS and NETCDF_CODECS.
+    :return: A StorageBackend. See SQLiteBackend and NetCDFBackend for the other parameters.
+    """
+    if backend == SQLITE:
+        return SQLiteBackend(flush_rows, flush_interval, wal, synchronous, partition, codec)
+    if backend == NETCDF:
+        if partition is not None:
+            raise ValueError('Partitioning is only supported by the sqlite backend.')
+        return NetCDFBackend(flush_rows, flush_interval, codec)
+    raise ValueError(f'Unknown storage backend: {backend}. Use one of {", ".join(BACKENDS)}.')
@@ -0,0 +1,210 @@
+import numpy as np
+from typing import NamedTuple
+
+
+class WindowSnapshot(NamedTuple):
+    time: np.ndarray
+    wavelength_a: np.ndarray
+    wavelength_c: np.ndarray
+    a_m: np.ndarray
+    c_m: np.ndarray
+    internal_temperature: np.ndarray
+    external_temperature: np.ndarray
+    a_signal_dark: np.ndarray
+    c_signal_dark: np.ndarray
+    a_reference_dark: np.ndarray
+    c_reference_dark: np.ndarray
+    flag_gap: np.ndarray
+    flag_syntax: np.ndarray
+    flag_gross_a_m: np.ndarray
+    flag_gross_c_m: np.ndarray
+
+    def to_ds(self) -> 'xr.Dataset':
+        """
+        Build an xarray dataset of the snapshot. xarray is only imported here.
+
+        :return: A dataset with the same layout the acquisition window has always had.
+        """
+
+        import xarray as xr
+        ds = xr.Dataset()
+        ds = ds.assign_coords({'time': self.time, 'wavelength_a': self.wavelength_a, 'wavelength_c': self.wavelength_c})
+        ds['a_m'] = (['time', 'wavelength_a'], self.a_m)
+        ds['c_m'] = (['time', 'wavelength_c'], self.c_m)
+        ds['internal_temperature'] = (['time'], self.internal_temperature.round(2))
+        ds['external_temperature'] = (['time'], self.external_temperature.round(2))
+        for var in ['a_signal_dark', 'c_signal_dark', 'a_reference_dark', 'c_reference_dark', 'flag_gap', 'flag_syntax']:
+            ds[var] = (['time'], getattr(self, var))
+        ds['flag_gross_a_m'] = (['time', 'wavelength_a'], self.flag_gross_a_m)
+        ds['flag_gross_c_m'] = (['time', 'wavelength_c'], self.flag_gross_c_m)
+        return ds
+
+
+class RollingWindow():
+    """
+    A preallocated circular buffer of the most recent hindcast seconds of data.
+
+    Appending is O(1) per frame, amortized. The capacity is sized from max_rate and doubles whenever the buffer is full
+    and its oldest row is still within the hindcast, so a faster stream never shortens the window. snapshot() returns copies of only the rows inside the hindcast, oldest first,
+    so it is safe to hand to another thread while appending continues.
+    """
+
+    # Variable name: (per wavelength channel or None, dtype)
+    VARIABLES = {'a_m': ('a', np.float32),
+                 'c_m': ('c', np.float32),
+                 'internal_temperature': (None, np.float32),
+                 'external_temperature': (None, np.float32),
+                 'a_signal_dark': (None, np.int32),
+                 'c_signal_dark': (None, np.int32),
+                 'a_reference_dark': (None, np.int32),
+                 'c_reference_dark': (None, np.int32),
+                 'flag_gap': (None, np.int8),
+                 'flag_syntax': (None, np.int8),
+                 'flag_gross_a_m': ('a', np.int8),
+                 'flag_gross_c_m': ('c', np.int8)}
+
+    def __init__(self, wavelength_a: np.ndarray, wavelength_c: np.ndarray, hindcast: int, max_rate: float = 8) -> None:
+        """
+        :param wavelength_a: Absorption wavelengths.
+        :param wavelength_c: Attenuation wavelengths.
+        :param hindcast: The length of the window in seconds.
+        :param max_rate: The expected frame rate in Hz. Sets the initial capacity along with the hindcast.
+        """
+
+        self.wavelength_a = np.asarray(wavelength_a)
+        self.wavelength_c = np.asarray(wavelength_c)
+        self.max_rate = float(max_rate)
+        self.hindcast = None
+        self.capacity = 0
+        self._time = np.zeros(0, dtype='datetime64[ns]')
+        self._arrays = {name: self.__allocate(name, 0) for name in self.VARIABLES}
+        self._head = 0  # Index of the next row to write.
+        self._count = 0
+        self.resize(hindcast)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __allocate(self, name: str, capacity: int) -> np.ndarray:
+        channel, dtype = self.VARIABLES[name]
+        if channel is None:
+            return np.zeros(capacity, dtype=dtype)
+        wavelengths = self.wavelength_a if channel == 'a' else self.wavelength_c
+        return np.zeros((capacity, len(wavelengths)), dtype=dtype)
+
+    def __ordered(self, array: np.ndarray) -> np.ndarray:
+        """Return the filled rows of a buffer, oldest first. A view when the buffer has not wrapped."""
+
+        if self._count < self.capacity:
+            return array[:self._count]
+        return np.concatenate([array[self._head:], array[:self._head]])
+
+    def resize(self, hindcast: int) -> None:
+        """
+        Change the window length, keeping every row within the new hindcast.
+
+        :param hindcast: The length of the window in seconds.
+        """
+
+        hindcast = int(hindcast)
+        if hindcast == self.hindcast:
+            return
+        self.hindcast = hindcast
+        self.__reallocate(max(int(np.ceil(hindcast * self.max_rate)) + 1, self.__rows_within(None), 1))
+
+    def __rows_within(self, latest) -> int:
+        """
+        :param latest: The time the hindcast is measured back from. None for the most recent row.
+        :return: The number of buffered rows within the hindcast.
+        """
+
+        if self._count == 0:
+            return 0
+        time = self.__ordered(self._time)
+        if latest is None:
+            latest = time[-1]
+        return int(np.count_nonzero(time >= np.datetime64(latest, 'ns') - np.timedelta64(self.hindcast, 's')))
+
+    def __reallocate(self, capacity: int) -> None:
+        """Move the most recent rows that fit into new buffers of the given capacity."""
+
+        keep = min(self._count, capacity)
+        time = self.__ordered(self._time)[self._count - keep:]
+        arrays = {name: self.__ordered(array)[self._count - keep:] for name, array in self._arrays.items()}
+
+        self._time = np.zeros(capacity, dtype='datetime64[ns]')
+        self._time[:keep] = time
+        for name in self._arrays:
+            self._arrays[name] = self.__allocate(name, capacity)
+            self._arrays[name][:keep] = arrays[name]
+        self.capacity = capacity
+        self._count = keep
+        self._head = keep % capacity
+
+    def clear(self) -> None:
+        self._head = 0
+        self._count = 0
+
+    def append(self, time, **values) -> None:
+        """
+        Add a single row.
+
+        :param time: The time of the row.
+        :param values: A value for every name in VARIABLES.
+        """
+
+        if self._count == self.capacity and self._time[self._head] >= np.datetime64(time, 'ns') - np.timedelta64(
+                self.hindcast, 's'):  # The oldest row is still needed.
+            self.__reallocate(2 * self.capacity)
+        i = self._head
+        self._time[i] = np.datetime64(time, 'ns')
+        for name, array in self._arrays.items():
+            array[i] = values[name]
+        self._head = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, time: np.ndarray, **values) -> None:
+        """
+        Add many rows at once.
+
+        :param time: (N,) times.
+        :param values: An (N,) or (N, wavelengths) array for every name in VARIABLES.
+        """
+
+        time = np.asarray(time, dtype='datetime64[ns]')
+        n = len(time)
+        if n == 0:
+            return
+        if self._count + n > self.capacity:
+            needed = self.__rows_within(time[-1]) + int(np.count_nonzero(
+                time >= time[-1] - np.timedelta64(self.hindcast, 's')))
+            if needed > self.capacity:
+                self.__reallocate(max(2 * self.capacity, needed))
+        start = max(n - self.capacity, 0)  # Rows that would be overwritten within this call are skipped.
+        index = (self._head + np.arange(n - start)) % self.capacity
+        self._time[index] = time[start:]
+        for name, array in self._arrays.items():
+            array[index] = np.asarray(values[name])[start:]
+        self._head = int((self._head + n - start) % self.capacity)
+        self._count = min(self._count + n - start, self.capacity)
+
+    def snapshot(self) -> WindowSnapshot:
+        """
+        Copy out the rows within hindcast seconds of the most recent row, oldest first.
+
+        :return: WindowSnapshot
+        """
+
+        time = self.__ordered(self._time)
+        if self._count > 0:
+            keep = time >= time[-1] - np.timedelta64(self.hindcast, 's')
+        else:
+            keep = np.zeros(0, dtype=bool)
+        arrays = {name: self.__ordered(array)[keep] for name, array in self._arrays.items()}
+        return WindowSnapshot(time=time[keep], wavelength_a=self.wavelength_a, wavelength_c=self.wavelength_c,
+                              **arrays)
+
+    def to_ds(self) -> 'xr.Dataset':
+        """Build an xarray dataset of the current window."""
+
+        return self.snapshot().to_ds()
@@ -0,0 +1,99 @@
+"""
+Compare the block compression codecs for logged data: database size, write throughput and read throughput.
+
+Frames come from the ACS simulator, so the spectra have realistic levels and noise. Each codec writes the same frames
+through SVDBWriter, in full and raw only logging, then reads a_m back through SVDB.select_columns. Databases are
+written to DB_DIR as benchmark_compression_* and removed afterwards.
+
+Usage: python benchmarks/compression.py ACS-00291.dev [frames]
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from SoggyVision.acs import ACS
+from SoggyVision.compression import CODECS
+from SoggyVision.core import DB_DIR
+from SoggyVision.database import SVDB, SVDBWriter, ACSDataTable, ACSMetadataTable
+from SoggyVision.simulator import ACSSimulator
+
+FLUSH_ROWS = 500  # The StorageWriter default, so blocks have the size they would have when logging.
+
+
+def remove_database(dbname: str) -> None:
+    for suffix in ['.db', '.db-wal', '.db-shm']:
+        filepath = os.path.join(DB_DIR, dbname + suffix)
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+
+
+def run(acs: ACS, data: list, flags: list, codec: str, raw_only: bool) -> tuple:
+    """
+    Write and read back one database.
+
+    :return: bytes on disk, frames written per second, frames read per second
+    """
+
+    dbname = f"benchmark_compression_{codec or 'none'}_{'raw' if raw_only else 'full'}".replace('+', '_')
+    remove_database(dbname)
+    try:
+        db = SVDB(dbname, wal = True)
+        metadata = [json.dumps(v) if isinstance(v, list) else v for v in acs.get_metadata()]
+        metadata[ACSMetadataTable.fields.index('begin_time')] = data[0].time
+        db.insert_data(ACSMetadataTable.name, ACSMetadataTable.fields, metadata)
+        writer = SVDBWriter(db, data[0].time, FLUSH_ROWS, raw_only = raw_only, codec = codec)
+        t0 = time.perf_counter()
+        for row, flag in zip(data, flags):
+            writer.add(row, flag, row.time)
+        writer.flush()
+        write_seconds = time.perf_counter() - t0
+        db.dbcur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.dbcon.close()
+        size = os.path.getsize(os.path.join(DB_DIR, f"{dbname}.db"))
+
+        db = SVDB(dbname)
+        t0 = time.perf_counter()
+        columns = db.select_columns(ACSDataTable.name, ['time', 'a_m'])
+        read_seconds = time.perf_counter() - t0
+        db.dbcon.close()
+        if len(columns['time']) != len(data):
+            raise RuntimeError(f'{dbname}: read {len(columns["time"])} of {len(data)} frames.')
+        return size, len(data) / write_seconds, len(data) / read_seconds
+    finally:
+        remove_database(dbname)
+
+
+def main() -> int:
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    acs = ACS(sys.argv[1])
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    frames = ACSSimulator(acs, seed = 0).generate(n)[:, :acs.packet_length]
+    times = np.datetime64('2024-01-01T00:00:00', 'ns') + np.arange(n) * np.timedelta64(250, 'ms')
+    block = acs.get_data_block(times, frames)
+    data = list(block)
+    flags = [acs.get_flags(row, 0, 0) for row in data]
+
+    print(f"{n} frames, {acs.output_wavelengths} wavelengths, {FLUSH_ROWS} rows per block")
+    print(f"{'logging':<10}{'codec':<12}{'bytes/frame':>12}{'ratio':>8}{'write frames/s':>16}{'read frames/s':>15}")
+    for raw_only in [False, True]:
+        baseline = None
+        for codec in [None] + CODECS:
+            size, write_rate, read_rate = run(acs, data, flags, codec, raw_only)
+            baseline = size if baseline is None else baseline
+            print(f"{'raw only' if raw_only else 'full':<10}{codec or 'none':<12}{size / n:>12.0f}"
+                  f"{baseline / size:>8.2f}{write_rate:>16.0f}{read_rate:>15.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Measure the time it takes to import each SoggyVision module in a fresh interpreter,
+and check that the headless modules do not pull in Qt, matplotlib, xarray or scipy.
+
+Usage: python benchmarks/import_time.py [repeats]
+"""
+
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEADLESS_MODULES = ['SoggyVision.core', 'SoggyVision.qc', 'SoggyVision.dev', 'SoggyVision.acs',
+                    'SoggyVision.database', 'SoggyVision.acquisition', 'SoggyVision.replay',
+                    'SoggyVision.reprocess', 'SoggyVision.manager', 'SoggyVision.daemon',
+                    'SoggyVision.simulator', 'SoggyVision.metrics', 'SoggyVision.clock',
+                    'SoggyVision.partitions', 'SoggyVision.compression',
+                    'SoggyVision.storage', 'SoggyVision.netcdf']
+HEAVY_MODULES = ['PyQt6', 'pyqtgraph', 'matplotlib', 'xarray', 'scipy', 'netCDF4']
+
+PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ','.join(heavy))
+"""
+
+
+def time_import(module: str) -> tuple:
+    """
+    Import a module in a new interpreter.
+
+    :param module: The dotted module name.
+    :return: seconds taken by the import, list of heavy modules it loaded
+    """
+
+    result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    elapsed, _, heavy = result.stdout.strip().partition(' ')
+    return float(elapsed), [v for v in heavy.split(',') if v]
+
+
+def main() -> int:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    failed = False
+    print(f"{'module':<28}{'best (ms)':>12}  heavy modules loaded")
+    for module in HEADLESS_MODULES:
+        results = [time_import(module) for _ in range(repeats)]
+        best = min(elapsed for elapsed, _ in results)
+        heavy = results[0][1]
+        failed |= bool(heavy)
+        print(f"{module:<28}{best * 1000:>12.1f}  {', '.join(heavy) if heavy else '-'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,7 +6,6 @@ import time
 import os
 import pyqtgraph
 import numpy as np
-import xarray as xr
 
 import serial.tools.list_ports
 import json
@@ -15,8 +14,9 @@ import webbrowser
 
 from SoggyVision.acs import ACS
 from SoggyVision.core import wavelength_to_rgb, APP_DIR, CAL_DIR, DB_DIR, EXPORT_DIR, SV_VERSION, SV_REPO, SV_ISSUES, SV_DISCUSSION, build_directories
-from SoggyVision.daq import DataAcquisitionThread
-from SoggyVision.export import export_netcdf
+from SoggyVision.daq import DataAcquisitionThread, PortProbeThread
+from SoggyVision.dev import DevRegistry, LIVE_LUT_STEP
+from SoggyVision.partitions import CATALOG_SUFFIX, dataset_size, parse_partition
 # pyqtgraph.setConfigOption('background', 'gray')
 
 def main():
@@ -68,6 +68,7 @@ class MainWindow(QtWidgets.QMainWindow):
     def select_database(self):
         filepath, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Select a .db file...', DB_DIR)
         filename, ext = os.path.splitext(os.path.basename(filepath))
+        filename = filename.removesuffix(CATALOG_SUFFIX)  # A catalog exports its whole partitioned dataset.
         self._ExportWindow.Database.setText(filename)
 
 
@@ -84,6 +85,7 @@ class MainWindow(QtWidgets.QMainWindow):
         custom_attrs['operator'] = self._ExportWindow.Operator.text()
         custom_attrs['institution'] = self._ExportWindow.Institution.text()
         custom_attrs['dataset_description'] = self._ExportWindow.Description.toPlainText()
+        from SoggyVision.export import export_netcdf  # Loads xarray and netCDF4 only when exporting.
         export_netcdf(dbname, output_filename, custom_attrs, self._ExportWindow.ExportProgress)
 
     def setup_ui(self):
@@ -107,6 +109,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.CommSetupHeader.setEnabled(False)
         self.COMPortLabel.setEnabled(False)
         self.COMPortCombo.setEnabled(False)
+        self.PartitionCombo.setEnabled(False)
+        self.PartitionLabel.setEnabled(False)
         self.ConnectDisconnectButton.setEnabled(False)
         self.DataCollectionHeader.setEnabled(False)
         self.FilepathInputLabel.setEnabled(False)
@@ -259,12 +263,27 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         iso8601_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
         self.ClockUTC.setText(iso8601_str)
+        self.update_file_size()
+
+    def update_file_size(self):
+        """
+        Show the size of the logged dataset to the nearest megabyte. Runs on the clock timer, not on every frame.
+        :return: None
+        """
+        daq = getattr(self, 'daq', None)
+        if daq is not None and daq.log is True:
+            mb = str(round(dataset_size(daq.dbname)/(1024 * 1024))).zfill(6)
+            self.FileSize.setText(mb)
 
 
     def load_calibration_file(self):
         os.makedirs(CAL_DIR, exist_ok=True)
         filepath, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Select a .dev file...', CAL_DIR)
-        self.acs = ACS(filepath)
+        self.set_calibration(filepath)
+
+
+    def set_calibration(self, filepath):
+        self.acs = ACS(filepath, LIVE_LUT_STEP)  # Lookup tables keep conversion cheap at high frame rates.
 
         # Set Metadata
         self.SN.setText(self.acs.sn)
@@ -283,6 +302,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.CommSetupHeader.setEnabled(True)
         self.COMPortLabel.setEnabled(True)
         self.COMPortCombo.setEnabled(True)
+        self.PartitionCombo.setEnabled(True)
+        self.PartitionLabel.setEnabled(True)
         self.ConnectDisconnectButton.setEnabled(True)
 
         # Set additional info for Comm Setup.
@@ -389,69 +410,18 @@ class MainWindow(QtWidgets.QMainWindow):
         if button_state == 'Connect':
 
             ports = self.list_ports()
-            if self.COMPortCombo.currentText() == 'AUTO' and len(ports) == 1:
-                [port] = ports
-            elif self.COMPortCombo.currentText() == 'AUTO' and len(ports) > 1:
-                for port in ports:
-                    try:
-                        _serial = serial.Serial(port = port, baudrate=self.acs.baudrate)
-                        _serial.open()
-                        time.sleep(3)
-                        buffer = bytearray(_serial.read(_serial.in_waiting))
-                        if self.acs.PACKET_REGISTRATION in buffer:
-                            _serial.close()
-                            time.sleep(1)
-                            break
-                        else:
-                            continue
-                    except:
-                        continue
+            if self.COMPortCombo.currentText() == 'AUTO' and len(ports) > 0:
+                # Probe every port at once, off the GUI thread. probe_finished continues the connection.
+                self.ConnectDisconnectButton.setEnabled(False)
+                self.LoadDevButton.setEnabled(False)
+                self.statusbar.showMessage(f"Searching {len(ports)} serial ports for ACS data...")
+                self._probe = PortProbeThread(ports, self.acs.baudrate)
+                self._probe.probe_finished.connect(self.probe_finished)
+                self._probe.start()
             elif self.COMPortCombo.currentText() != 'AUTO':
-                port = self.COMPortCombo.currentText()
-
-            try:
-                self.COMPortCombo.setCurrentText(port)
-
-                self.daq = DataAcquisitionThread(port, self.acs, int(self.vsTimeWindow.Hindcast.text()))
-                if self.daq.serial.is_open:
-                    time.sleep(0.25)
-                    if self.daq.serial.in_waiting == 0 or self.acs.PACKET_REGISTRATION not in bytearray(
-                            self.daq.serial.read(self.daq.serial.in_waiting)):
-                        self.daq.running = False
-                        self.daq.serial.reset_output_buffer()
-                        self.daq.serial.reset_input_buffer()
-                        self.daq.serial.close()
-                        self._NoDataWindow.NoData.setText(f'Status: No ACS data detected on {self.daq.port}.')
-                        self.statusbar.showMessage(f"Unable to connect to {self.acs.sn} on {self.daq.port}.")
-                        self.daq.quit()
-                        self.showNoDataWindow()
-                    else:
-                        self.daq.start()
-
-                        # Change button state.
-
-                        self.ConnectDisconnectButton.setText('Disconnect')  # Set the button to disconnect.
-                        self.statusbar.showMessage(f"Connected to {self.acs.sn} on {self.daq.port}.")
-
-                        # Disable Things
-                        self.COMPortCombo.setEnabled(False)
-                        self.COMPortLabel.setEnabled(False)
-                        self.LoadDevButton.setEnabled(False)
-
-                        # Enable Things
-                        self.FilepathInput.setText(f"{self.acs.sn}_{datetime.now(timezone.utc).strftime('%Y%m%d')}")
-                        self.FilepathInput.setEnabled(True)
-                        self.FilepathInputLabel.setEnabled(True)
-
-                        self.Visualizer.setEnabled(True)
-                        self.StartStopLogButton.setEnabled(True)
-
-                        self.daq.serial_data.connect(self.plot_data)
-
-            except:
-                self._NoDataWindow.NoData.setText(f'Status: No available serial ports detected.')
-                self._NoDataWindow.setWindowTitle(f'No Available Serial Ports Detected')
-                self.showNoDataWindow()
+                self.connect_port(self.COMPortCombo.currentText())
+            else:
+                self.connect_port(None)
 
 
 
@@ -473,6 +443,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
             self.Visualizer.setEnabled(False)
             self.COMPortCombo.setEnabled(True)
+            self.PartitionCombo.setEnabled(True)
+            self.PartitionLabel.setEnabled(True)
             self.COMPortLabel.setEnabled(True)
             self.LoadDevButton.setEnabled(True)
             self.FilepathInput.setText("")
@@ -488,24 +460,118 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
+    def probe_finished(self, result):
+        self.ConnectDisconnectButton.setEnabled(True)
+        self.LoadDevButton.setEnabled(True)
+        if result is None:
+            self._NoDataWindow.NoData.setText(f'Status: No ACS data detected on any serial port.')
+            self.statusbar.showMessage(f"Unable to find {self.acs.sn} on any serial port.")
+            self.showNoDataWindow()
+            return
+
+        # Pick the calibration that matches the serial number in the frame.
+        serial_number = DevRegistry.normalize_serial_number(result.serial_number_hexdec)
+        if serial_number != DevRegistry.normalize_serial_number(self.acs.sn_hexdec):
+            filepath = DevRegistry(CAL_DIR).latest(serial_number)
+            if filepath is None:
+                self._NoDataWindow.NoData.setText(f'Status: Found an ACS with serial number 0x{serial_number:08X} '
+                                                  f'on {result.port}, but no matching .dev file in {CAL_DIR}.')
+                self.statusbar.showMessage(f"No calibration file for the ACS on {result.port}.")
+                self.showNoDataWindow()
+                return
+            self.set_calibration(filepath)
+        self.connect_port(result.port)
+
+
+    def connect_port(self, port):
+        try:
+            self.COMPortCombo.setCurrentText(port)
+
+            self.daq = DataAcquisitionThread(port, self.acs, int(self.vsTimeWindow.Hindcast.text()),
+                                             partition = self.log_partition())
+            if self.daq.serial.is_open:
+                time.sleep(0.25)
+                if self.daq.serial.in_waiting == 0 or self.acs.PACKET_REGISTRATION not in bytearray(
+                        self.daq.serial.read(self.daq.serial.in_waiting)):
+                    self.daq.running = False
+                    self.daq.serial.reset_output_buffer()
+                    self.daq.serial.reset_input_buffer()
+                    self.daq.serial.close()
+                    self._NoDataWindow.NoData.setText(f'Status: No ACS data detected on {self.daq.port}.')
+                    self.statusbar.showMessage(f"Unable to connect to {self.acs.sn} on {self.daq.port}.")
+                    self.daq.quit()
+                    self.showNoDataWindow()
+                else:
+                    self.daq.start()
+
+                    # Change button state.
+
+                    self.ConnectDisconnectButton.setText('Disconnect')  # Set the button to disconnect.
+                    self.statusbar.showMessage(f"Connected to {self.acs.sn} on {self.daq.port}.")
+
+                    # Disable Things
+                    self.COMPortCombo.setEnabled(False)
+                    self.PartitionCombo.setEnabled(False)
+                    self.PartitionLabel.setEnabled(False)
+                    self.COMPortLabel.setEnabled(False)
+                    self.LoadDevButton.setEnabled(False)
+
+                    # Enable Things
+                    self.FilepathInput.setText(f"{self.acs.sn}_{datetime.now(timezone.utc).strftime('%Y%m%d')}")
+                    self.FilepathInput.setEnabled(True)
+                    self.FilepathInputLabel.setEnabled(True)
+
+                    self.Visualizer.setEnabled(True)
+                    self.StartStopLogButton.setEnabled(True)
+
+                    self.daq.serial_data.connect(self.plot_data)
+                    self.daq.acquisition_error.connect(self.show_acquisition_error)
+
+        except:
+            self._NoDataWindow.NoData.setText(f'Status: No available serial ports detected.')
+            self._NoDataWindow.setWindowTitle(f'No Available Serial Ports Detected')
+            self.showNoDataWindow()
+
+
+
+
+    def show_acquisition_error(self, message):
+        self._NoDataWindow.NoData.setText(f'Status: {message}')
+        self._NoDataWindow.setWindowTitle('Data Acquisition Stopped')
+        self.statusbar.showMessage(message)
+        self.showNoDataWindow()
+
+
+    def log_partition(self):
+        """The partition policy chosen in PartitionCombo, or None to log each session to a single database."""
+        text = self.PartitionCombo.currentText()
+        return None if text == 'None' else parse_partition(text)
+
+
+    def log_target(self):
+        """The file the current session logs to, for status messages."""
+        if self.daq.partition is None:
+            return f"{self.daq.dbname}.db"
+        policy = f"{self.daq.partition} byte" if isinstance(self.daq.partition, int) else self.daq.partition
+        return f"{self.daq.dbname}{CATALOG_SUFFIX}.db ({policy} partitions)"
+
+
     def logging_actions(self):
         button_state = self.StartStopLogButton.text()
         if 'Start' in button_state:
-            self.daq.db = None
-            self.daq.dbname, _ = os.path.splitext(f"{self.FilepathInput.text()}")
-            self.daq.log = True
+            dbname, _ = os.path.splitext(f"{self.FilepathInput.text()}")
+            self.daq.start_logging(dbname)
             self.StartStopLogButton.setText('Stop Logging')
             self.FilepathInputLabel.setEnabled(False)
             self.FilepathInput.setEnabled(False)
             self.FileSize.setEnabled(True)
             self.FileSizeLabel.setEnabled(True)
             self.ConnectDisconnectButton.setEnabled(False)
-            self.statusbar.showMessage(f"Logging {self.acs.sn} data to {self.daq.dbname}.db.")
+            self.statusbar.showMessage(f"Logging {self.acs.sn} data to {self.log_target()}.")
 
         elif 'Stop' in button_state:
-            self.daq.log = False
-            self.statusbar.showMessage(f"Stopped logging {self.acs.sn} data to {self.daq.dbname}.db.")
-            self.daq.dbname = None
+            self.statusbar.showMessage(f"Stopped logging {self.acs.sn} data to {self.log_target()}.")
+            self.daq.stop_logging()
             self.db = None
             self.StartStopLogButton.setText('Start Logging')
             self.FilepathInput.setEnabled(True)
@@ -513,30 +579,25 @@ class MainWindow(QtWidgets.QMainWindow):
             self.ConnectDisconnectButton.setEnabled(True)
 
 
-    def plot_data(self,ds):
-        if self.daq.log is True: # If actively logging, update the database size to the nearest megabyte.
-            filepath = os.path.join(DB_DIR,f"{os.path.splitext(os.path.normpath(self.FilepathInput.text()))[0]}.db")
-            mb = str(round(os.stat(filepath).st_size/(1024 * 1024))).zfill(6)
-            self.FileSize.setText(mb)
-
+    def plot_data(self,snapshot):
         hindcast = self.vsTimeWindow.Hindcast.text()
         try:
             self.daq.hindcast = int(hindcast)
         except:
             pass
 
+        if len(snapshot.time) == 0:
+            return
 
         current_tab_idx = self.Visualizer.currentIndex()
         current_tab = self.Visualizer.tabText(current_tab_idx)
         if current_tab == 'a_m vs wavelength':
             self.avw.clear()
-            last_sample = ds.sel(time = ds['time'].max())
-            self.avw.setData(last_sample['wavelength_a'].values.flatten(), last_sample['a_m'].values.flatten())
+            self.avw.setData(snapshot.wavelength_a, snapshot.a_m[-1])
 
         elif current_tab == 'c_m vs wavelength':
             self.cvw.clear()
-            last_sample = ds.sel(time = ds['time'].max())
-            self.cvw.setData(last_sample['wavelength_c'].values.flatten(), last_sample['c_m'].values.flatten())
+            self.cvw.setData(snapshot.wavelength_c, snapshot.c_m[-1])
 
 
         elif current_tab == 'a_m vs time':
@@ -548,10 +609,9 @@ class MainWindow(QtWidgets.QMainWindow):
                 _plt.clear()
                 self.avt_legend.removeItem(self.a_plots[str(wvl)])
             selected_a = sorted([float(v.text()) for v in self.vsTimeWindow.AbsorptionList.selectedItems()])
-            wvlds = ds.sel(wavelength_a = selected_a, method = 'nearest')
             for wvl in selected_a:
-                _wvlds = wvlds.sel(wavelength_a = float(wvl), method = 'nearest')
-                self.a_plots[str(wvl)].setData(_wvlds['time'].values.flatten(), _wvlds['a_m'].values.flatten())
+                idx = np.abs(snapshot.wavelength_a - wvl).argmin()
+                self.a_plots[str(wvl)].setData(snapshot.time, snapshot.a_m[:, idx])
                 self.avt_legend.addItem(self.a_plots[str(wvl)], str(wvl))
             self._old_a = selected_a
 
@@ -561,10 +621,9 @@ class MainWindow(QtWidgets.QMainWindow):
                 _plt.clear()
                 self.cvt_legend.removeItem(self.c_plots[str(wvl)])
             selected_c = sorted([float(v.text()) for v in self.vsTimeWindow.AttenuationList.selectedItems()])
-            wvlds = ds.sel(wavelength_c=selected_c, method='nearest')
             for wvl in selected_c:
-                _wvlds = wvlds.sel(wavelength_c=float(wvl), method='nearest')
-                self.c_plots[str(wvl)].setData(_wvlds['time'].values.flatten(), _wvlds['c_m'].values.flatten())
+                idx = np.abs(snapshot.wavelength_c - wvl).argmin()
+                self.c_plots[str(wvl)].setData(snapshot.time, snapshot.c_m[:, idx])
                 self.cvt_legend.addItem(self.c_plots[str(wvl)], str(wvl))
 
 
@@ -572,20 +631,19 @@ class MainWindow(QtWidgets.QMainWindow):
             for _plt in [self._temp_ext, self._temp_int,
                         self._darkcsig, self._darkaref, self._darkcref, self._darkasig, self._qartodgap, self._qartodsyntax, self._qartodgross_a, self._qartodgross_c]:
                 _plt.clear()
-            self._temp_int.setData(ds['time'].values.flatten(), ds['internal_temperature'].values.flatten())
-            self._temp_ext.setData(ds['time'].values.flatten(), ds['external_temperature'].values.flatten())
-            self._darkcsig.setData(ds['time'].values.flatten(), ds['c_signal_dark'].values.flatten())
-            self._darkasig.setData(ds['time'].values.flatten(), ds['a_signal_dark'].values.flatten())
-            self._darkcref.setData(ds['time'].values.flatten(), ds['c_reference_dark'].values.flatten())
-            self._darkaref.setData(ds['time'].values.flatten(), ds['a_reference_dark'].values.flatten())
-
-            self._qartodgap.setData(ds['time'].values.flatten(), ds['flag_gap'].values.flatten())
-            self._qartodsyntax.setData(ds['time'].values.flatten(), ds['flag_syntax'].values.flatten())
+            self._temp_int.setData(snapshot.time, snapshot.internal_temperature.round(2))
+            self._temp_ext.setData(snapshot.time, snapshot.external_temperature.round(2))
+            self._darkcsig.setData(snapshot.time, snapshot.c_signal_dark)
+            self._darkasig.setData(snapshot.time, snapshot.a_signal_dark)
+            self._darkcref.setData(snapshot.time, snapshot.c_reference_dark)
+            self._darkaref.setData(snapshot.time, snapshot.a_reference_dark)
+
+            self._qartodgap.setData(snapshot.time, snapshot.flag_gap)
+            self._qartodsyntax.setData(snapshot.time, snapshot.flag_syntax)
             #self._qartodlocation.setData(ds['time'].values.flatten(), ds['flag_location'].values.flatten())
 
-            last_sample = ds.sel(time = ds['time'].max())
-            self._qartodgross_a.setData(last_sample['wavelength_a'].values.flatten(), last_sample['flag_gross_a_m'].values.flatten())
-            self._qartodgross_c.setData(last_sample['wavelength_c'].values.flatten(), last_sample['flag_gross_c_m'].values.flatten())
+            self._qartodgross_a.setData(snapshot.wavelength_a, snapshot.flag_gross_a_m[-1])
+            self._qartodgross_c.setData(snapshot.wavelength_c, snapshot.flag_gross_c_m[-1])
 
 
 
@@ -0,0 +1,45 @@
+import struct
+
+import numpy as np
+import pytest
+
+from SoggyVision.acs import ACS
+
+WAVELENGTHS = 4
+
+
+@pytest.fixture
+def acs():
+    """A small ACS rebuilt from metadata, so tests do not need a .dev file."""
+    bins = [0.0, 10.0, 20.0]
+    metadata = {'begin_time': None, 'sensor_type': 'ACS meter', 'calibration_filepath': 'test.dev',
+                'calibration_filename': 'test.dev', 'factory_calibration_date': '2021-04-12',
+                'serial_number': 'ACS-00291', 'serial_number_hexdec': '0x53000123',
+                'wavelengths_c': [400.0 + 10 * i for i in range(WAVELENGTHS)],
+                'wavelengths_a': [401.0 + 10 * i for i in range(WAVELENGTHS)], 'baudrate': 115200,
+                'path_length': 0.25, 'tcal': 18.4, 'ical': 17.3, 'structure_version': 1,
+                'number_of_wavelengths': WAVELENGTHS, 'number_of_temperature_bins': len(bins),
+                'temperature_bins': bins, 'offsets_a': [0.1] * WAVELENGTHS, 'offsets_c': [0.2] * WAVELENGTHS,
+                'delta_t_a': [[0.001, 0.002, 0.003]] * WAVELENGTHS, 'delta_t_c': [[0.004, 0.005, 0.006]] * WAVELENGTHS,
+                'end_time': None}
+    return ACS.from_metadata(metadata)
+
+
+def make_frames(acs, n, seed = 1):
+    """:return: n valid frames, each followed by its checksum and a pad byte."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for k in range(n):
+        spectra = rng.integers(1000, 60000, (acs.output_wavelengths, 4))
+        header = [acs.packet_length, 5, 1, int(acs.sn_hexdec, 16), 100, 0, 110, 35000 + k, 40000 + k, 120, 130,
+                  300000 + 250 * k, 1, acs.output_wavelengths]
+        frame = acs.PACKET_REGISTRATION + struct.pack(acs.packet_header, *header, *spectra.ravel().tolist())
+        frames.append(frame + struct.pack('!H', sum(frame) & 0xFFFF) + b'\x00')
+    return frames
+
+
+@pytest.fixture
+def db_dir(tmp_path, monkeypatch):
+    """Put every database of a test in its own directory."""
+    monkeypatch.setattr('SoggyVision.database.DB_DIR', str(tmp_path))
+    return tmp_path
@@ -0,0 +1,30 @@
+import threading
+import time
+
+from SoggyVision.acquisition import DataAcquisition
+from tests.conftest import make_frames
+
+
+class FailingAcquisition(DataAcquisition):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reported = []
+
+    def publish(self, snapshot):
+        raise RuntimeError('publish failed')
+
+    def report_error(self, error):
+        self.reported.append(error)
+
+
+def test_a_conversion_error_stops_every_stage(acs, db_dir):
+    daq = FailingAcquisition('loop://', acs, hindcast = 10, no_data_timeout = 30)
+    thread = threading.Thread(target = daq.run, daemon = True)
+    thread.start()
+    time.sleep(0.2)  # run() resets the input buffer first.
+    daq.serial.write(b''.join(make_frames(acs, 20)))
+    thread.join(timeout = 10)
+    assert not thread.is_alive()
+    assert isinstance(daq.error, RuntimeError)
+    assert daq.reported == [daq.error]
+    assert not daq.running
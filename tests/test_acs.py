@@ -0,0 +1,19 @@
+from datetime import datetime
+
+import numpy as np
+
+from SoggyVision.acs import ACSData, ACSFrameBlock
+from tests.conftest import make_frames
+
+
+def test_block_indexing(acs):
+    frames = [frame[:acs.packet_length] for frame in make_frames(acs, 10)]
+    block = acs.get_data_block(datetime(2026, 1, 1), frames)
+    assert isinstance(block[3], ACSData)
+    assert block[np.int64(-1)] == block.to_acsdata(9)
+    for index in [slice(2, 8, 2), [1, 5, 9], np.arange(10) % 3 == 0]:
+        selected = block[index]
+        assert isinstance(selected, ACSFrameBlock)
+        assert selected.to_data() == block.take(index).to_data()
+    assert len(block[2:8:2]) == 3
+    assert [data.elapsed_time for data in block[[1, 5, 9]]] == [block[i].elapsed_time for i in [1, 5, 9]]
@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+import pytest
+
+from SoggyVision.database import SVDB, SVDBWriter, ACSDataTable, ACSFlagsTable, ACSMetadataTable
+from tests.conftest import make_frames
+
+
+def write(acs, name, batches, codec):
+    """Write each batch of (data, flags) in its own flush. :return: The rows read back and the rows dropped."""
+    db = SVDB(name, wal = True)
+    metadata = [json.dumps(v) if isinstance(v, list) else v for v in acs.get_metadata()]
+    db.insert_data(ACSMetadataTable.name, ACSMetadataTable.fields, metadata)
+    writer = SVDBWriter(db, None, flush_rows = 1000, codec = codec)
+    for batch in batches:
+        for data, flags in batch:
+            writer.add(data, flags, data.time)
+        writer.flush()
+    writer.close()
+    db = SVDB(name)
+    rows = (len(db.select_columns(ACSDataTable.name, ['time'])['time']),
+            len(db.select_columns(ACSFlagsTable.name, ['time'])['time']))
+    db.dbcon.close()
+    return rows, writer.dropped_rows
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'delta+zlib'])
+def test_duplicate_times_match_between_rows_and_blocks(acs, db_dir, codec):
+    times = np.datetime64('2026-01-01T00:00:00', 'ns') + np.arange(20) * np.timedelta64(250, 'ms')
+    times[5] = times[4]  # Repeats within a batch.
+    times[12] = times[11]
+    block = acs.get_data_block(times, [frame[:acs.packet_length] for frame in make_frames(acs, 20)])
+    pairs = [(data, acs.get_flags(data, 0, 0)) for data in block]
+    batches = [pairs, pairs[8:16] + pairs[:2]]  # Then times that are already stored.
+
+    plain = write(acs, 'plain', batches, None)
+    compressed = write(acs, 'compressed', batches, codec)
+    assert plain == ((18, 18), 12)
+    assert compressed == plain
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from SoggyVision.acs import ACSFramer
+from SoggyVision.replay import RawFileReader
+from tests.conftest import make_frames
+
+
+def truncated_capture(acs):
+    """:return: The bytes of 20 good frames with a truncated frame directly before the 11th, and the good frames."""
+    frames = make_frames(acs, 21)
+    good = frames[:10] + frames[11:]
+    return b''.join(frames[:10]) + frames[10][:acs.packet_length // 2] + b''.join(frames[11:]), good
+
+
+def test_reader_resumes_after_a_truncated_frame(acs, tmp_path):
+    capture, good = truncated_capture(acs)
+    filepath = tmp_path / 'capture.bin'
+    filepath.write_bytes(capture)
+    with RawFileReader(str(filepath), acs, chunk_frames = 4, start_time = datetime(2026, 1, 1),
+                       drop_invalid = False) as reader:
+        offsets = reader.find_offsets()
+        frames, valid = reader.read_frames(offsets)
+    assert len(frames) == len(good)
+    assert valid.all()
+    assert [bytes(frame) for frame in frames] == [frame[:acs.packet_length] for frame in good]
+
+
+def test_framer_resumes_after_a_truncated_frame(acs):
+    capture, good = truncated_capture(acs)
+    framer = ACSFramer(acs)
+    drained = []
+    for i in range(0, len(capture), 100):  # Arrives in pieces, as from a serial port.
+        framer.feed(capture[i:i + 100])
+        frames, _ = framer.drain()
+        drained.extend(bytes(frame) + bytes(checksum) for frame, checksum in frames)
+    assert drained == [frame[:-1] for frame in good]
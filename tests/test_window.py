@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from SoggyVision.window import RollingWindow
+
+WAVELENGTHS = 4
+
+
+def rows(n, rate):
+    """:return: n rows at rate Hz, as keyword arguments of RollingWindow.extend."""
+    values = {name: np.zeros((n, WAVELENGTHS) if channel is not None else n, dtype = dtype)
+              for name, (channel, dtype) in RollingWindow.VARIABLES.items()}
+    time = np.datetime64('2026-01-01T00:00:00', 'ns') + np.arange(n) * np.timedelta64(int(1e9 / rate), 'ns')
+    return time, values
+
+
+@pytest.mark.parametrize('batch', [1, 7, 1000])
+def test_window_holds_the_hindcast_above_max_rate(batch):
+    wavelengths = np.arange(WAVELENGTHS)
+    window = RollingWindow(wavelengths, wavelengths, hindcast = 10, max_rate = 8)
+    time, values = rows(1000, 40)
+    for i in range(0, len(time), batch):
+        if batch == 1:
+            window.append(time[i], **{name: value[i] for name, value in values.items()})
+        else:
+            window.extend(time[i:i + batch], **{name: value[i:i + batch] for name, value in values.items()})
+    snapshot = window.snapshot()
+    assert len(snapshot.time) == 10 * 40 + 1
+    assert snapshot.time[-1] == time[-1]
+    window.resize(5)
+    assert len(window.snapshot().time) == 5 * 40 + 1